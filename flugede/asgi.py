@@ -12,5 +12,10 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'flugede.settings')
+# Serve the catalog from coroutine views (see store/async_views.py)
+os.environ.setdefault('CATALOG_VIEWS_ASYNC', 'true')
+# Each ASGI request runs its ORM calls in a thread of its own, so a
+# connection kept open for reuse would never be reused
+os.environ.setdefault('DATABASE_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
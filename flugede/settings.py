@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 from pathlib import Path
+import copy
 import os
-from decouple import config
+import tempfile
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,11 +45,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.metrics.MetricsMiddleware',
+    'store.profiling.RequestProfileMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'store.replicas.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'store.profiling.OnDemandProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -56,7 +62,8 @@ ROOT_URLCONF = 'flugede.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's backend plus render timing for request profiling
+        'BACKEND': 'store.profiling.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -83,6 +90,78 @@ DATABASES = {
     }
 }
 
+# DATABASE_PROFILE=production tunes SQLite for concurrent requests: WAL lets
+# readers run alongside the writer, BEGIN IMMEDIATE takes the write lock up
+# front so a transaction never fails upgrading from a read lock, writers
+# queue for up to DATABASE_BUSY_TIMEOUT seconds instead of failing with
+# "database is locked", and connections are kept between requests (checked
+# before reuse). Compare with `python manage.py bench_sqlite`.
+DATABASE_PROFILE = config('DATABASE_PROFILE', default='development')
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # durable across app crashes; only power loss can drop the last commits
+    'mmap_size': config('DATABASE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int),  # bytes
+    'cache_size': -config('DATABASE_CACHE_KB', default=64 * 1024, cast=int),  # negative: KiB
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRODUCTION = {
+    'CONN_MAX_AGE': config('DATABASE_CONN_MAX_AGE', default=600, cast=int),
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'timeout': config('DATABASE_BUSY_TIMEOUT', default=20, cast=float),  # seconds
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': ''.join(f'PRAGMA {name}={value};' for name, value in SQLITE_PRODUCTION_PRAGMAS.items()),
+    },
+}
+if DATABASE_PROFILE == 'production':
+    DATABASES['default'].update(SQLITE_PRODUCTION)
+
+# Catalog pages read from replicas when DATABASE_REPLICAS lists SQLite files
+# for them (kept in sync by `python manage.py replicate`); a browser that
+# writes stays on the primary for REPLICA_STICKY_SECONDS. See store/replicas.py.
+DATABASE_REPLICAS = []
+for number, path in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv()), 1):
+    DATABASES[f'replica{number}'] = {
+        **copy.deepcopy(DATABASES['default']), 'NAME': path, 'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['store.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=15, cast=int)
+
+# Route the catalog pages to coroutine views (store/async_views.py), which
+# don't hold a server thread while waiting on the database. flugede/asgi.py
+# turns this on; under WSGI async views would only add thread switches.
+CATALOG_VIEWS_ASYNC = config('CATALOG_VIEWS_ASYNC', default=False, cast=bool)
+
+
+# Request profiling (see store/profiling.py): this share of requests gets a
+# Server-Timing header and a store.profiling log line with its SQL, template
+# and Python time. 0 takes the middleware out of the stack.
+REQUEST_PROFILE_SAMPLE_RATE = config('REQUEST_PROFILE_SAMPLE_RATE', default=0.0, cast=float)
+REQUEST_PROFILE_SLOW_QUERIES = config('REQUEST_PROFILE_SLOW_QUERIES', default=3, cast=int)
+# Staff can profile a request with ?_profile=cpu|memory|all; the results are
+# kept as Request Profiles in the admin
+REQUEST_PROFILE_ON_DEMAND = config('REQUEST_PROFILE_ON_DEMAND', default=True, cast=bool)
+
+# Runtime metrics (see store/metrics.py), scraped from /metrics. Each worker
+# process writes its own file in METRICS_DIR; empty it when the server starts.
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_DIR = config('METRICS_DIR', default=os.path.join(tempfile.gettempdir(), 'flugede-metrics'))
+# Bearer token the scraper sends; required unless DEBUG is on, when local
+# scrapes are allowed without one
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'store.profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -148,6 +227,10 @@ else:
     DEFAULT_FROM_EMAIL = 'noreply@flugede.com'
     SERVER_EMAIL = 'noreply@flugede.com'
 
+# Transactional mail is queued in the OutboxEmail table and delivered in
+# batches by `python manage.py send_outbox --loop` (see store/emails.py)
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+
 # Session settings
 SESSION_COOKIE_AGE = 86400  # 24 hours
 
@@ -155,3 +238,19 @@ SESSION_COOKIE_AGE = 86400  # 24 hours
 # Reads from .env file or environment variables
 RAZORPAY_KEY_ID = config('RAZORPAY_KEY_ID', default='')
 RAZORPAY_KEY_SECRET = config('RAZORPAY_KEY_SECRET', default='')
+
+# Razorpay API client: one pooled client per process (see store/payments.py)
+RAZORPAY_API_BASE_URL = config('RAZORPAY_API_BASE_URL', default='https://api.razorpay.com')
+RAZORPAY_TIMEOUT = config('RAZORPAY_TIMEOUT', default=10, cast=float)  # seconds
+RAZORPAY_POOL_SIZE = config('RAZORPAY_POOL_SIZE', default=10, cast=int)
+RAZORPAY_MAX_RETRIES = config('RAZORPAY_MAX_RETRIES', default=2, cast=int)
+RAZORPAY_WEBHOOK_SECRET = config('RAZORPAY_WEBHOOK_SECRET', default='')
+
+# Payment confirmations and webhooks are finalized on an in-process worker pool
+# (see store/payment_events.py). Set PAYMENT_EVENTS_ASYNC=False to finalize inline.
+PAYMENT_EVENT_WORKERS = config('PAYMENT_EVENT_WORKERS', default=2, cast=int)
+PAYMENT_EVENTS_ASYNC = config('PAYMENT_EVENTS_ASYNC', default=True, cast=bool)
+
+# Delivered / cancelled orders untouched for this many days are moved to the
+# archive tables by `python manage.py archive_orders` (see store/archive.py)
+ORDER_ARCHIVE_AFTER_DAYS = config('ORDER_ARCHIVE_AFTER_DAYS', default=180, cast=int)
@@ -1,13 +1,76 @@
-from django.contrib import admin
-from django.utils.html import format_html
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html, format_html_join
+from .emails import SECRET_KINDS
+from .exports import (
+    NewsletterExporter, OrderExporter, ProductExporter, ReturnRequestExporter, export_response,
+)
+from .orders import can_transition, transition_orders
+from .pagination import EstimatedCountPaginator
+from .stock import adjust_stock
 from .models import (
     Category, Brand, Product, ProductImage, ProductSpecification,
-    UserProfile, Address, Cart, CartItem, Wishlist, Coupon,
-    Order, OrderItem, OrderStatusHistory, ReturnRequest,
+    UserProfile, Address, Cart, CartItem, Wishlist, Coupon, CouponRedemption,
+    Order, OrderItem, OrderStatusHistory, ArchivedOrder, ArchivedOrderItem, ArchivedOrderStatusHistory,
+    PaymentEvent, OutboxEmail, ReturnRequest, SalesRollup, RequestProfile,
     Review, ReviewImage, Newsletter, ContactMessage
 )
 
 
+# Base class for changelists over tables that grow without bound: the total
+# comes from the database's row estimate instead of COUNT(*), and the
+# "N total" link (a second COUNT over the unfiltered table) is turned off.
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+# Streaming CSV / JSONL export actions (see store/exports.py)
+class ExportMixin:
+    exporter = None
+    actions = ['export_csv', 'export_jsonl']
+
+    @admin.action(description='Export selected as CSV')
+    def export_csv(self, request, queryset):
+        return export_response(self.exporter, queryset, 'csv', request)
+
+    @admin.action(description='Export selected as JSON Lines')
+    def export_jsonl(self, request, queryset):
+        return export_response(self.exporter, queryset, 'jsonl', request)
+
+
+# Groups products by how long their current stock lasts at the forecast
+# sales rate (see store/forecasting.py)
+class StockoutFilter(admin.SimpleListFilter):
+    title = 'stock-out forecast'
+    parameter_name = 'stockout'
+    ranges = {
+        'week': ('Within a week', {'days_left__lt': 7}),
+        'month': ('Within a month', {'days_left__gte': 7, 'days_left__lt': 30}),
+        'later': ('After a month', {'days_left__gte': 30}),
+        'no_sales': ('No recent sales', {'days_left__isnull': True}),
+    }
+
+    def lookups(self, request, model_admin):
+        return [(key, label) for key, (label, _) in self.ranges.items()]
+
+    def queryset(self, request, queryset):
+        if self.value() in self.ranges:
+            days_left = Case(
+                When(stock__lte=0, then=Value(0)),
+                When(sales_velocity__gt=0, then=F('stock') / F('sales_velocity')),
+                default=None,
+                output_field=DecimalField(),
+            )
+            return queryset.annotate(days_left=days_left).filter(**self.ranges[self.value()][1])
+        return queryset
+
+
 # Inline Admin Classes
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
@@ -35,6 +98,22 @@ class OrderStatusHistoryInline(admin.TabularInline):
     can_delete = False
 
 
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    extra = 0
+    can_delete = False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class ArchivedOrderStatusHistoryInline(ArchivedOrderItemInline):
+    model = ArchivedOrderStatusHistory
+
+
 class ReviewImageInline(admin.TabularInline):
     model = ReviewImage
     extra = 1
@@ -60,14 +139,24 @@ class BrandAdmin(admin.ModelAdmin):
     list_editable = ('is_active',)
 
 
+def with_loaded_stock(form):
+    if 'stock' in form.base_fields:
+        form.base_fields['stock'].show_hidden_initial = True
+    return form
+
+
 # Product Admin
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'brand', 'price', 'discount_price', 'stock', 'stock_status_badge', 'is_active', 'is_featured')
-    list_filter = ('category', 'brand', 'is_active', 'is_featured', 'created_at')
+class ProductAdmin(ExportMixin, LargeTableAdmin):
+    exporter = ProductExporter()
+    list_display = ('name', 'category', 'brand', 'price', 'discount_price', 'stock', 'stock_status_badge',
+                    'sales_velocity', 'days_left', 'is_active', 'is_featured')
+    list_filter = (StockoutFilter, 'category', 'brand', 'is_active', 'is_featured', 'created_at')
     search_fields = ('name', 'description')
+    list_select_related = ('category', 'brand')
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ('price', 'discount_price', 'stock', 'is_active', 'is_featured')
+    readonly_fields = ('sales_velocity', 'days_until_stockout')
     inlines = [ProductImageInline, ProductSpecificationInline]
     fieldsets = (
         ('Basic Information', {
@@ -77,7 +166,7 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('price', 'discount_price')
         }),
         ('Inventory', {
-            'fields': ('stock', 'is_active', 'is_featured')
+            'fields': ('stock', 'sales_velocity', 'days_until_stockout', 'is_active', 'is_featured')
         }),
         ('Additional Info', {
             'fields': ('warranty_period',)
@@ -98,13 +187,42 @@ class ProductAdmin(admin.ModelAdmin):
         )
     stock_status_badge.short_description = 'Stock Status'
 
+    def days_left(self, obj):
+        return obj.days_of_stock
+    days_left.short_description = 'Days of stock'
+
+    # The change form and the changelist both carry the stock the page was
+    # rendered with (initial-... hidden inputs), so an edit can be applied as
+    # a difference from it
+    def get_form(self, request, obj=None, **kwargs):
+        return with_loaded_stock(super().get_form(request, obj, **kwargs))
+
+    def get_changelist_formset(self, request, **kwargs):
+        formset = super().get_changelist_formset(request, **kwargs)
+        with_loaded_stock(formset.form)
+        return formset
+
+    def save_model(self, request, obj, form, change):
+        if change and 'stock' in form.fields:
+            # Apply the edit as a difference, so orders placed since the page
+            # was loaded are not overwritten, whether or not stock was edited
+            field = form.fields['stock']
+            loaded = field.hidden_widget().value_from_datadict(form.data, form.files, form.add_initial_prefix('stock'))
+            delta = obj.stock - field.to_python(loaded) if loaded not in (None, '') else 0
+            obj.save(update_fields=[f.name for f in obj._meta.concrete_fields if not f.primary_key and f.name != 'stock'])
+            adjust_stock({obj.pk: delta})
+            obj.refresh_from_db(fields=['stock'])
+        else:
+            super().save_model(request, obj, form, change)
+
 
 # Product Image Admin
 @admin.register(ProductImage)
-class ProductImageAdmin(admin.ModelAdmin):
+class ProductImageAdmin(LargeTableAdmin):
     list_display = ('product', 'is_primary', 'image_preview', 'created_at')
     list_filter = ('is_primary', 'created_at')
     search_fields = ('product__name',)
+    list_select_related = ('product',)
 
     def image_preview(self, obj):
         if obj.image:
@@ -115,39 +233,60 @@ class ProductImageAdmin(admin.ModelAdmin):
 
 # User Profile Admin
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(LargeTableAdmin):
     list_display = ('user', 'phone', 'created_at')
     search_fields = ('user__username', 'user__email', 'phone')
+    list_select_related = ('user',)
 
 
 # Address Admin
 @admin.register(Address)
-class AddressAdmin(admin.ModelAdmin):
+class AddressAdmin(LargeTableAdmin):
     list_display = ('user', 'full_name', 'city', 'state', 'address_type', 'is_default')
     list_filter = ('address_type', 'is_default', 'state')
     search_fields = ('user__username', 'full_name', 'city', 'state', 'pincode')
+    list_select_related = ('user',)
 
 
 # Cart Admin
 @admin.register(Cart)
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(LargeTableAdmin):
     list_display = ('user', 'total_items_display', 'subtotal_display', 'created_at')
     search_fields = ('user__username',)
+    list_select_related = ('user',)
+
+    def get_queryset(self, request):
+        # Totals are aggregated in the changelist query instead of loading
+        # every cart's items; the price rule matches Product.final_price.
+        final_price = Case(
+            When(items__product__discount_price__gt=0, then=F('items__product__discount_price')),
+            default=F('items__product__price'),
+        )
+        return super().get_queryset(request).annotate(
+            item_total=Sum('items__quantity'),
+            subtotal_amount=Sum(
+                F('items__quantity') * final_price,
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
 
     def total_items_display(self, obj):
-        return obj.total_items
+        return obj.item_total or 0
     total_items_display.short_description = 'Total Items'
+    total_items_display.admin_order_field = 'item_total'
 
     def subtotal_display(self, obj):
-        return f"₹{obj.subtotal}"
+        return f"₹{obj.subtotal_amount or 0:.2f}"
     subtotal_display.short_description = 'Subtotal'
+    subtotal_display.admin_order_field = 'subtotal_amount'
 
 
 # Cart Item Admin
 @admin.register(CartItem)
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(LargeTableAdmin):
     list_display = ('cart', 'product', 'quantity', 'total_price_display')
     search_fields = ('cart__user__username', 'product__name')
+    list_select_related = ('cart__user', 'product')
 
     def total_price_display(self, obj):
         return f"₹{obj.total_price}"
@@ -156,15 +295,16 @@ class CartItemAdmin(admin.ModelAdmin):
 
 # Wishlist Admin
 @admin.register(Wishlist)
-class WishlistAdmin(admin.ModelAdmin):
+class WishlistAdmin(LargeTableAdmin):
     list_display = ('user', 'product', 'created_at')
     search_fields = ('user__username', 'product__name')
+    list_select_related = ('user', 'product')
 
 
 # Coupon Admin
 @admin.register(Coupon)
 class CouponAdmin(admin.ModelAdmin):
-    list_display = ('code', 'discount_type', 'discount_value', 'valid_from', 'valid_to', 'usage_limit', 'used_count', 'is_active', 'is_valid_badge')
+    list_display = ('code', 'discount_type', 'discount_value', 'valid_from', 'valid_to', 'usage_limit', 'per_user_limit', 'used_count', 'is_active', 'is_valid_badge')
     list_filter = ('discount_type', 'is_active', 'valid_from', 'valid_to')
     search_fields = ('code',)
     list_editable = ('is_active',)
@@ -180,14 +320,30 @@ class CouponAdmin(admin.ModelAdmin):
     is_valid_badge.short_description = 'Status'
 
 
+# Coupon Redemption Admin
+@admin.register(CouponRedemption)
+class CouponRedemptionAdmin(LargeTableAdmin):
+    list_display = ('coupon', 'user', 'order', 'created_at', 'released_at')
+    list_filter = ('created_at', 'released_at')
+    search_fields = ('coupon__code', 'user__username', 'order__order_number')
+    list_select_related = ('coupon', 'user', 'order')
+    readonly_fields = ('coupon', 'user', 'order', 'created_at', 'released_at')
+
+
 # Order Admin
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ExportMixin, LargeTableAdmin):
+    exporter = OrderExporter()
     list_display = ('order_number', 'user', 'total', 'order_status', 'payment_status', 'payment_method', 'created_at')
     list_filter = ('order_status', 'payment_status', 'payment_method', 'created_at')
     search_fields = ('order_number', 'user__username', 'user__email')
+    list_select_related = ('user',)
     readonly_fields = ('order_number', 'created_at', 'updated_at')
     inlines = [OrderItemInline, OrderStatusHistoryInline]
+    actions = [
+        'mark_confirmed', 'mark_packed', 'mark_shipped', 'mark_out_for_delivery', 'mark_delivered', 'mark_cancelled',
+        'export_csv', 'export_jsonl',
+    ]
     fieldsets = (
         ('Order Information', {
             'fields': ('order_number', 'user', 'address')
@@ -209,41 +365,227 @@ class OrderAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        if obj is not None and 'order_status' in form.base_fields:
+            # Offer only the statuses the order can move to (see store/orders.py)
+            form.base_fields['order_status'].choices = [
+                (status, label) for status, label in Order.ORDER_STATUS
+                if status == obj.order_status or can_transition(obj.order_status, status)
+            ]
+        return form
+
     def save_model(self, request, obj, form, change):
-        if change:  # If updating existing order
-            old_status = Order.objects.get(pk=obj.pk).order_status
-            if old_status != obj.order_status:
-                # Create status history
-                OrderStatusHistory.objects.create(
-                    order=obj,
-                    status=obj.order_status,
-                    notes=f"Status changed from {old_status} to {obj.order_status}"
-                )
+        if change and 'order_status' in form.changed_data:
+            # Save the other edits, then move the status the way the actions
+            # do: history, restock and coupon release on cancel, email
+            status = obj.order_status
+            obj.order_status = form.initial['order_status']
+            super().save_model(request, obj, form, change)
+            self.transition(request, Order.objects.filter(pk=obj.pk), status)
+            obj.refresh_from_db()
+            return
         super().save_model(request, obj, form, change)
 
+    def transition(self, request, queryset, status):
+        changed, skipped = transition_orders(queryset, status)
+        label = dict(Order.ORDER_STATUS)[status]
+        self.message_user(request, f'{len(changed)} order(s) marked {label}.')
+        if skipped:
+            self.message_user(
+                request,
+                f'{len(skipped)} order(s) skipped because they cannot move to {label} from their current status.',
+                level=messages.WARNING,
+            )
+
+    @admin.action(description='Mark selected orders as Confirmed')
+    def mark_confirmed(self, request, queryset):
+        self.transition(request, queryset, 'confirmed')
+
+    @admin.action(description='Mark selected orders as Packed')
+    def mark_packed(self, request, queryset):
+        self.transition(request, queryset, 'packed')
+
+    @admin.action(description='Mark selected orders as Shipped')
+    def mark_shipped(self, request, queryset):
+        self.transition(request, queryset, 'shipped')
+
+    @admin.action(description='Mark selected orders as Out for Delivery')
+    def mark_out_for_delivery(self, request, queryset):
+        self.transition(request, queryset, 'out_for_delivery')
+
+    @admin.action(description='Mark selected orders as Delivered')
+    def mark_delivered(self, request, queryset):
+        self.transition(request, queryset, 'delivered')
+
+    @admin.action(description='Cancel selected orders (restores stock)')
+    def mark_cancelled(self, request, queryset):
+        self.transition(request, queryset, 'cancelled')
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        # Orders moved to cold storage keep their id; send old links there
+        if not Order.objects.filter(pk=object_id).exists() and ArchivedOrder.objects.filter(pk=object_id).exists():
+            return redirect(reverse('admin:store_archivedorder_change', args=[object_id]))
+        return super().change_view(request, object_id, form_url, extra_context)
+
+
+# Archived Order Admin (read-only)
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(LargeTableAdmin):
+    list_display = ('order_number', 'user', 'total', 'order_status', 'payment_status', 'created_at', 'archived_at')
+    list_filter = ('order_status', 'payment_status', 'payment_method')
+    search_fields = ('order_number', 'user__username', 'user__email')
+    list_select_related = ('user',)
+    inlines = [ArchivedOrderItemInline, ArchivedOrderStatusHistoryInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+# Daily Sales Admin (read-only; maintained by `manage.py rollup_sales`)
+@admin.register(SalesRollup)
+class SalesRollupAdmin(LargeTableAdmin):
+    list_display = ('date', 'product', 'category', 'brand', 'orders', 'units', 'revenue', 'discounts',
+                    'cancelled_units', 'returned_units', 'net_revenue_display')
+    list_filter = ('date', 'category', 'brand')
+    search_fields = ('product__name',)
+    list_select_related = ('product', 'category', 'brand')
+
+    def net_revenue_display(self, obj):
+        return f"₹{obj.net_revenue}"
+    net_revenue_display.short_description = 'Net Revenue'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+# Payment Event Admin
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(LargeTableAdmin):
+    list_display = ('razorpay_payment_id', 'razorpay_order_id', 'source', 'event', 'status', 'attempts', 'created_at', 'processed_at')
+    list_filter = ('status', 'source', 'event', 'created_at')
+    search_fields = ('razorpay_payment_id', 'razorpay_order_id')
+    readonly_fields = ('razorpay_payment_id', 'razorpay_order_id', 'razorpay_signature', 'source', 'event', 'payload',
+                       'attempts', 'last_error', 'created_at', 'updated_at', 'processed_at')
+
+
+# Outbox Email Admin
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(LargeTableAdmin):
+    list_display = ('subject', 'kind', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'kind', 'created_at')
+    search_fields = ('subject',)
+    # Mail is only written by the enqueue helpers; staff can reschedule it
+    readonly_fields = ('kind', 'subject', 'body', 'from_email', 'recipients', 'claim_token', 'last_error',
+                       'created_at', 'updated_at', 'sent_at')
+    actions = ['retry_now']
+
+    def get_fields(self, request, obj=None):
+        fields = super().get_fields(request, obj)
+        if obj is not None and obj.kind in SECRET_KINDS:
+            # A password reset code is for its recipient only
+            fields = [field for field in fields if field != 'body']
+        return fields
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Retry selected emails now')
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status='sent').update(status='pending', next_attempt_at=timezone.now())
+        self.message_user(request, f'{updated} email(s) queued for retry.')
+
+
+# Request Profile Admin (read-only; staff capture profiles with ?_profile=, see store/profiling.py)
+@admin.register(RequestProfile)
+class RequestProfileAdmin(LargeTableAdmin):
+    list_display = ('created_at', 'method', 'path', 'view_name', 'status_code', 'kind', 'duration_ms',
+                    'peak_memory_kib', 'user')
+    list_filter = ('kind', 'created_at')
+    search_fields = ('path', 'view_name')
+    list_select_related = ('user',)
+    fields = readonly_fields = ('created_at', 'user', 'kind', 'method', 'path', 'view_name', 'status_code',
+                                'duration_ms', 'peak_memory_kib', 'download_link', 'cpu_summary_display',
+                                'allocations_display')
+
+    def get_queryset(self, request):
+        # The profile data is only read on the change page
+        return super().get_queryset(request).defer('cpu_stats', 'cpu_summary', 'allocations')
+
+    def get_urls(self):
+        return [
+            path('<path:object_id>/download/', self.admin_site.admin_view(self.download),
+                 name='store_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download(self, request, object_id):
+        profile = get_object_or_404(RequestProfile.objects.only('cpu_stats'), pk=object_id)
+        if not self.has_view_permission(request, profile):
+            raise PermissionDenied
+        if not profile.cpu_stats:
+            raise Http404('No CPU profile was captured for this request.')
+        response = HttpResponse(bytes(profile.cpu_stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="request-profile-{profile.pk}.prof"'
+        return response
+
+    def download_link(self, obj):
+        if not obj.cpu_stats:
+            return '-'
+        url = reverse('admin:store_requestprofile_download', args=[obj.pk])
+        return format_html('<a href="{}">request-profile-{}.prof</a> (open with pstats or snakeviz)', url, obj.pk)
+    download_link.short_description = 'CPU Profile'
+
+    def cpu_summary_display(self, obj):
+        return format_html('<pre>{}</pre>', obj.cpu_summary) if obj.cpu_summary else '-'
+    cpu_summary_display.short_description = 'Top Functions'
+
+    def allocations_display(self, obj):
+        if not obj.allocations:
+            return '-'
+        rows = format_html_join('', '<tr><td>{}</td><td>{}</td><td>{}</td></tr>',
+                                ((a['size_kib'], a['count'], a['site']) for a in obj.allocations))
+        return format_html('<table><tr><th>KiB</th><th>Blocks</th><th>Allocated at</th></tr>{}</table>', rows)
+    allocations_display.short_description = 'Top Allocation Sites'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
 # Return Request Admin
 @admin.register(ReturnRequest)
-class ReturnRequestAdmin(admin.ModelAdmin):
+class ReturnRequestAdmin(ExportMixin, LargeTableAdmin):
+    exporter = ReturnRequestExporter()
     list_display = ('order_item', 'user', 'reason', 'status', 'created_at')
     list_filter = ('status', 'reason', 'created_at')
     search_fields = ('user__username', 'order_item__order__order_number')
+    list_select_related = ('order_item__order', 'user')
     readonly_fields = ('created_at', 'updated_at')
 
 
 # Review Admin
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(LargeTableAdmin):
     list_display = ('product', 'user', 'rating', 'is_verified_purchase', 'is_approved', 'created_at')
     list_filter = ('rating', 'is_verified_purchase', 'is_approved', 'created_at')
     search_fields = ('product__name', 'user__username', 'title', 'comment')
+    list_select_related = ('product', 'user')
     list_editable = ('is_approved',)
     inlines = [ReviewImageInline]
 
 
 # Newsletter Admin
 @admin.register(Newsletter)
-class NewsletterAdmin(admin.ModelAdmin):
+class NewsletterAdmin(ExportMixin, LargeTableAdmin):
+    exporter = NewsletterExporter()
     list_display = ('email', 'is_active', 'created_at')
     list_filter = ('is_active', 'created_at')
     search_fields = ('email',)
@@ -252,7 +594,7 @@ class NewsletterAdmin(admin.ModelAdmin):
 
 # Contact Message Admin
 @admin.register(ContactMessage)
-class ContactMessageAdmin(admin.ModelAdmin):
+class ContactMessageAdmin(LargeTableAdmin):
     list_display = ('name', 'email', 'subject', 'is_read', 'created_at')
     list_filter = ('is_read', 'created_at')
     search_fields = ('name', 'email', 'subject', 'message')
@@ -0,0 +1,96 @@
+"""
+Hot/cold storage for orders.
+
+Delivered and cancelled orders that have not changed for
+ORDER_ARCHIVE_AFTER_DAYS are moved, with their items and status history,
+from Order / OrderItem / OrderStatusHistory into the Archived* tables by the
+archive_orders command. The hot tables then only hold recent and in-flight
+orders, so their indexes stay small enough to live in the page cache.
+
+Orders whose items still have return requests or reviews attached stay hot,
+because those rows point at OrderItem. Coupon redemptions keep their coupon
+and user, but their order link is cleared.
+
+Reads go through get_order(), which checks the hot table first and falls
+back to the archive, so order pages keep working for archived orders.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+
+from .models import (
+    Order, OrderItem, OrderStatusHistory,
+    ArchivedOrder, ArchivedOrderItem, ArchivedOrderStatusHistory,
+)
+
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+BATCH_SIZE = 500
+
+
+def get_order(**lookup):
+    """Return the hot Order matching lookup, else the ArchivedOrder, else 404."""
+    try:
+        return Order.objects.get(**lookup)
+    except Order.DoesNotExist:
+        pass
+    try:
+        return ArchivedOrder.objects.get(**lookup)
+    except ArchivedOrder.DoesNotExist:
+        raise Http404('No order matches the given query.')
+
+
+def archivable_orders(cutoff=None):
+    if cutoff is None:
+        cutoff = timezone.now() - timedelta(days=settings.ORDER_ARCHIVE_AFTER_DAYS)
+    return Order.objects.filter(
+        order_status__in=ARCHIVABLE_STATUSES,
+        updated_at__lt=cutoff,
+    ).exclude(
+        items__return_requests__isnull=False,
+    ).exclude(
+        items__review__isnull=False,
+    )
+
+
+def _copy_rows(source, target_model, ids, key='id'):
+    """Bulk-copy rows from source model to target_model for the given ids,
+    keeping primary keys. Only fields the two models share are copied."""
+    source_fields = {f.attname for f in source._meta.concrete_fields}
+    fields = [f.attname for f in target_model._meta.concrete_fields if f.attname in source_fields]
+    rows = source.objects.filter(**{f'{key}__in': ids}).order_by().values(*fields)
+    target_model.objects.bulk_create([target_model(**row) for row in rows])
+
+
+def archive_batch(ids, cutoff=None):
+    """Move the given orders to the archive in one transaction. Returns the
+    number moved; ids that stopped being archivable are skipped."""
+    with transaction.atomic():
+        ids = list(archivable_orders(cutoff).filter(id__in=ids).values_list('id', flat=True).distinct())
+        if not ids:
+            return 0
+        _copy_rows(Order, ArchivedOrder, ids)
+        _copy_rows(OrderItem, ArchivedOrderItem, ids, key='order_id')
+        _copy_rows(OrderStatusHistory, ArchivedOrderStatusHistory, ids, key='order_id')
+        Order.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_orders(cutoff=None, batch_size=BATCH_SIZE, limit=None):
+    """Archive everything eligible, batch_size orders per transaction, so
+    the write lock is held only briefly. Returns the number archived."""
+    archived = 0
+    last_id = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        ids = list(
+            archivable_orders(cutoff).filter(id__gt=last_id)
+            .order_by('id').values_list('id', flat=True).distinct()[:size]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+        archived += archive_batch(ids, cutoff)
+    return archived
@@ -0,0 +1,130 @@
+"""
+Coroutine versions of the catalog pages, for serving over ASGI.
+
+store/urls.py routes home, product_list, product_detail and
+search_suggestions here when CATALOG_VIEWS_ASYNC is set, which
+flugede/asgi.py does by default. They read the same data as the views in
+views.py and render the same templates, but wait for the database without
+holding a thread from the server, and start the queries a page needs that
+do not depend on each other (featured products, categories, brands, new
+arrivals...) together.
+
+Django's async ORM still runs every query through sync_to_async, and all of
+one request's calls share one thread and one connection, so those queries
+are sent one after another; what overlaps is the waiting, and requests with
+each other. Templates are rendered in that thread too, because context
+processors and lazy relations read the database. Compare the two paths with
+`python manage.py bench_async`.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator
+from django.db.models import Avg, Count
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404, render
+
+from .models import ArchivedOrderItem, Brand, Category, OrderItem, Product
+from .replicas import replica_reads
+from .views import PRODUCTS_PER_PAGE, filter_products, product_cards, suggestion, suggestion_products
+
+arender = sync_to_async(render)
+
+
+async def alist(queryset):
+    """Evaluate a queryset, prefetches included, without blocking the event
+    loop."""
+    return [obj async for obj in queryset]
+
+
+async def has_purchased(user, product):
+    """Whether user has a delivered order with product in it."""
+    if not user.is_authenticated:
+        return False
+    delivered = {'order__user': user, 'product': product, 'order__order_status': 'delivered'}
+    return (await OrderItem.objects.filter(**delivered).aexists()
+            or await ArchivedOrderItem.objects.filter(**delivered).aexists())
+
+
+# Home Page
+@replica_reads
+async def home(request):
+    featured_products, categories, brands, new_arrivals = await asyncio.gather(
+        alist(product_cards(Product.objects.filter(is_active=True, is_featured=True))[:8]),
+        alist(Category.objects.filter(is_active=True)[:6]),
+        alist(Brand.objects.filter(is_active=True)[:8]),
+        alist(product_cards(Product.objects.filter(is_active=True).order_by('-created_at'))[:8]),
+    )
+    context = {
+        'featured_products': featured_products,
+        'categories': categories,
+        'brands': brands,
+        'new_arrivals': new_arrivals,
+    }
+    return await arender(request, 'store/home.html', context)
+
+
+# Product Listing
+@replica_reads
+async def product_list(request):
+    products = filter_products(product_cards(Product.objects.filter(is_active=True)), request.GET)
+    count, categories, brands = await asyncio.gather(
+        products.acount(),
+        alist(Category.objects.filter(is_active=True)),
+        alist(Brand.objects.filter(is_active=True)),
+    )
+
+    # Pagination: the count is known, so get_page() only slices
+    paginator = Paginator(products, PRODUCTS_PER_PAGE)
+    paginator.count = count
+    page_obj = paginator.get_page(request.GET.get('page'))
+    page_obj.object_list = await alist(page_obj.object_list)
+
+    context = {
+        'page_obj': page_obj,
+        'categories': categories,
+        'brands': brands,
+        'current_category': request.GET.get('category'),
+        'current_brand': request.GET.get('brand'),
+    }
+    return await arender(request, 'store/product_list.html', context)
+
+
+# Product Detail
+@replica_reads
+async def product_detail(request, slug):
+    product, user = await asyncio.gather(
+        aget_object_or_404(product_cards(Product.objects.prefetch_related('specifications')),
+                           slug=slug, is_active=True),
+        request.auser(),
+    )
+    reviews = product.reviews.filter(is_approved=True).select_related('user').order_by('-created_at')
+    related_products, review_list, rating, can_review = await asyncio.gather(
+        alist(product_cards(Product.objects.filter(
+            category=product.category_id,
+            is_active=True
+        ).exclude(id=product.id))[:4]),
+        alist(reviews),
+        reviews.aaggregate(avg=Avg('rating'), count=Count('id')),
+        has_purchased(user, product),
+    )
+
+    context = {
+        'product': product,
+        'related_products': related_products,
+        'reviews': review_list,
+        'avg_rating': rating['avg'] or 0,
+        'review_count': rating['count'],
+        'can_review': can_review,
+    }
+    return await arender(request, 'store/product_detail.html', context)
+
+
+# Search with AJAX
+@replica_reads
+async def search_suggestions(request):
+    query = request.GET.get('q', '')
+    if len(query) >= 2:
+        suggestions = [suggestion(p) for p in await alist(suggestion_products(query))]
+        return JsonResponse({'suggestions': suggestions})
+    return JsonResponse({'suggestions': []})
@@ -0,0 +1,324 @@
+"""
+Bulk catalog import.
+
+CatalogImporter reads products from CSV or JSON Lines and upserts them by
+slug. The columns are those of the product export (store/exports.py), plus
+description and images, so an export can be edited and loaded back. Only
+the columns present in the file are written; a file with just slug, price
+and stock updates prices and stock and leaves everything else alone.
+
+  - specifications: "Name: value; Name: value" in CSV, an object in JSONL.
+    When present they replace the product's specifications.
+  - images: paths separated by ";" in CSV, a list in JSONL, relative to
+    images_dir. Each image is resized to at most IMAGE_MAX_SIZE and stored
+    as products/<slug>-<n>.jpg; images already stored under that name are
+    skipped.
+  - category and brand are names, created when missing.
+
+Records are read CHUNK_SIZE at a time and each chunk is written in one
+transaction with bulk_create/bulk_update, so memory does not grow with the
+file. Image files for a chunk are processed in a thread pool before the
+chunk is written. After every chunk the byte offset reached is saved to a
+state file, and a resumed run seeks straight past the records already
+imported. Rows are upserts, so redoing the chunk that was interrupted is
+harmless.
+"""
+import csv
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import reset_queries, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from PIL import Image, UnidentifiedImageError
+
+from .models import Brand, Category, Product, ProductImage, ProductSpecification
+
+CHUNK_SIZE = 1000
+MAX_ERRORS = 100  # error messages kept; the rest are only counted
+IMAGE_WORKERS = 8
+IMAGE_MAX_SIZE = (1200, 1200)
+IMAGE_QUALITY = 85
+
+TRUE = {'1', 'true', 'yes', 'y', 't'}
+# File column -> Product field, for the plain fields
+FIELDS = {
+    'name': 'name',
+    'description': 'description',
+    'price': 'price',
+    'discount_price': 'discount_price',
+    'stock': 'stock',
+    'is_active': 'is_active',
+    'is_featured': 'is_featured',
+    'warranty_period': 'warranty_period',
+}
+DECIMALS = {'price', 'discount_price'}
+BOOLEANS = {'is_active', 'is_featured'}
+
+
+class RecordError(ValueError):
+    pass
+
+
+@dataclass
+class ImportStats:
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    images: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)  # first MAX_ERRORS (record number, message)
+
+    def error(self, number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((number, message))
+
+
+def records(f, fmt, header=None):
+    """Records from f, read with readline() so f.tell() stays usable
+    between them. CSV records are dicts keyed by header, JSONL records the
+    raw line."""
+    lines = iter(f.readline, '')
+    if fmt == 'csv':
+        for row in csv.reader(lines):
+            yield dict(zip(header, row))
+    else:
+        yield from lines
+
+
+def _decimal(value, column):
+    try:
+        return Decimal(str(value).strip().replace(',', '')) if str(value).strip() else None
+    except InvalidOperation:
+        raise RecordError(f'{column}: {value!r} is not a number')
+
+
+def parse_record(record, fmt):
+    """Normalise one record into {'slug', 'fields', 'category', 'brand',
+    'specifications', 'images'}; keys missing from the file are absent."""
+    if fmt == 'jsonl':
+        try:
+            record = json.loads(record)
+        except ValueError as e:
+            raise RecordError(f'invalid JSON: {e}')
+        if not isinstance(record, dict):
+            raise RecordError('each line must be a JSON object')
+
+    slug = (record.get('slug') or slugify(record.get('name') or '')).strip()
+    if not slug:
+        raise RecordError('slug or name is required')
+    parsed = {'slug': slug, 'fields': {}}
+
+    for column, name in FIELDS.items():
+        if column not in record:
+            continue
+        value = record[column]
+        if column in DECIMALS:
+            value = _decimal(value, column)
+            if value is None and column == 'price':
+                raise RecordError('price is required')
+        elif column == 'stock':
+            try:
+                value = int(value or 0)
+            except (TypeError, ValueError):
+                raise RecordError(f'stock: {value!r} is not a whole number')
+        elif column in BOOLEANS:
+            value = value if isinstance(value, bool) else str(value).strip().lower() in TRUE
+        else:
+            value = '' if value is None else str(value)
+        parsed['fields'][name] = value
+
+    for column in ('category', 'brand'):
+        if column in record:
+            parsed[column] = (record[column] or '').strip()
+
+    if 'specifications' in record:
+        specs = record['specifications'] or {}
+        if isinstance(specs, str):
+            pairs = [part.partition(':') for part in specs.split(';') if part.strip()]
+            specs = {name.strip(): value.strip() for name, _, value in pairs}
+        parsed['specifications'] = list(specs.items())
+
+    if 'images' in record:
+        images = record['images'] or []
+        if isinstance(images, str):
+            images = [path.strip() for path in images.split(';') if path.strip()]
+        parsed['images'] = images
+    return parsed
+
+
+def _process_image(source, name):
+    """Resize source into storage as name. Returns name, or raises."""
+    if default_storage.exists(name):
+        return name
+    try:
+        with Image.open(source) as image:
+            image.thumbnail(IMAGE_MAX_SIZE)
+            buffer = io.BytesIO()
+            image.convert('RGB').save(buffer, 'JPEG', quality=IMAGE_QUALITY, optimize=True)
+    except (OSError, UnidentifiedImageError) as e:
+        raise RecordError(f'image {source}: {e}')
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+class CatalogImporter:
+    def __init__(self, images_dir='.', chunk_size=CHUNK_SIZE, image_workers=IMAGE_WORKERS):
+        self.images_dir = images_dir
+        self.chunk_size = chunk_size
+        self.pool = ThreadPoolExecutor(image_workers)
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.brands = dict(Brand.objects.values_list('name', 'id'))
+        self.stats = ImportStats()
+
+    def close(self):
+        self.pool.shutdown()
+
+    def _lookup(self, model, cache, names):
+        missing = {name for name in names if name and name not in cache}
+        if missing:
+            model.objects.bulk_create(
+                [model(name=name, slug=slugify(name)) for name in sorted(missing)], ignore_conflicts=True,
+            )
+            cache.update(model.objects.filter(name__in=missing).values_list('name', 'id'))
+
+    def _images(self, rows):
+        """Process every image of the chunk in the pool. Returns {slug:
+        [stored names]}; images that fail are reported and left out."""
+        jobs = []
+        for number, row in rows:
+            for position, path in enumerate(row.get('images', []), 1):
+                source = path if os.path.isabs(path) else os.path.join(self.images_dir, path)
+                jobs.append((number, row['slug'], source, f"products/{row['slug']}-{position}.jpg"))
+        futures = [(number, slug, self.pool.submit(_process_image, source, name)) for number, slug, source, name in jobs]
+        stored = {}
+        for number, slug, future in futures:
+            try:
+                stored.setdefault(slug, []).append(future.result())
+            except RecordError as e:
+                self.stats.error(number, str(e))
+        return stored
+
+    def import_chunk(self, records, fmt):
+        rows = []
+        for number, record in records:
+            try:
+                rows.append((number, parse_record(record, fmt)))
+            except RecordError as e:
+                self.stats.error(number, str(e))
+        # A slug repeated in one chunk: the last record wins
+        rows = list({row['slug']: (number, row) for number, row in rows}.values())
+
+        self._lookup(Category, self.categories, {row.get('category') for _, row in rows})
+        self._lookup(Brand, self.brands, {row.get('brand') for _, row in rows})
+
+        existing = Product.objects.in_bulk([row['slug'] for _, row in rows], field_name='slug')
+        current_specs = {}
+        for product_id, name, value in ProductSpecification.objects.filter(
+            product__in=list(existing.values())
+        ).order_by('product_id', 'order', 'id').values_list('product_id', 'name', 'value'):
+            current_specs.setdefault(product_id, []).append((name, value))
+
+        now = timezone.now()
+        accepted, to_create, to_update, changed_fields, specs = [], [], [], set(), {}
+        for number, row in rows:
+            values = dict(row['fields'])
+            if 'category' in row:
+                if row['category'] not in self.categories:
+                    self.stats.error(number, 'category is required')
+                    continue
+                values['category_id'] = self.categories[row['category']]
+            if 'brand' in row:
+                values['brand_id'] = self.brands.get(row['brand'])
+            new_specs = [(name[:100], str(value)[:200]) for name, value in row.get('specifications', [])]
+
+            product = existing.get(row['slug'])
+            if product is None:
+                missing = [name for name in ('name', 'price', 'category_id') if values.get(name) is None]
+                if missing:
+                    self.stats.error(number, f'new product needs {", ".join(missing)}')
+                    continue
+                to_create.append(Product(slug=row['slug'], description=values.pop('description', ''), **values))
+                if new_specs:
+                    specs[row['slug']] = new_specs
+            else:
+                diff = {name: value for name, value in values.items() if getattr(product, name) != value}
+                if diff:
+                    for name, value in diff.items():
+                        setattr(product, name, value)
+                    product.updated_at = now
+                    changed_fields.update(diff)
+                    to_update.append(product)
+                specs_changed = 'specifications' in row and new_specs != current_specs.get(product.pk, [])
+                if specs_changed:
+                    specs[row['slug']] = new_specs
+                if diff or specs_changed:
+                    self.stats.updated += 1
+                else:
+                    self.stats.unchanged += 1
+            accepted.append((number, row))
+        self.stats.created += len(to_create)
+        images = self._images(accepted)
+
+        with transaction.atomic():
+            Product.objects.bulk_create(to_create)
+            if to_update:
+                Product.objects.bulk_update(to_update, sorted(changed_fields) + ['updated_at'])
+            ids = dict(Product.objects.filter(slug__in=list(specs) + list(images)).values_list('slug', 'id'))
+
+            if specs:
+                ProductSpecification.objects.filter(product_id__in=[ids[slug] for slug in specs]).delete()
+                ProductSpecification.objects.bulk_create(
+                    ProductSpecification(product_id=ids[slug], name=name, value=value, order=position)
+                    for slug, pairs in specs.items() for position, (name, value) in enumerate(pairs)
+                )
+
+            if images:
+                product_ids = [ids[slug] for slug in images]
+                have = set(ProductImage.objects.filter(product_id__in=product_ids).values_list('product_id', 'image'))
+                has_primary = set(ProductImage.objects.filter(product_id__in=product_ids, is_primary=True)
+                                  .values_list('product_id', flat=True))
+                new_images = []
+                for slug, names in images.items():
+                    for name in names:
+                        if (ids[slug], name) in have:
+                            continue
+                        new_images.append(ProductImage(product_id=ids[slug], image=name,
+                                                       is_primary=ids[slug] not in has_primary))
+                        has_primary.add(ids[slug])
+                ProductImage.objects.bulk_create(new_images)
+                self.stats.images += len(new_images)
+
+    def run(self, path, fmt, state=None, checkpoint=None):
+        """Import the file, resuming from state ({'offset', 'records'}) if
+        given. checkpoint(state) is called after each committed chunk, and
+        with None once the whole file is done."""
+        state = state or {'offset': 0, 'records': 0}
+        number = state['records']
+        with open(path, newline='' if fmt == 'csv' else None, encoding='utf-8') as f:
+            header = next(csv.reader([f.readline()])) if fmt == 'csv' else None
+            if state['offset']:
+                f.seek(state['offset'])
+            chunk = []
+            for record in records(f, fmt, header):
+                number += 1
+                if fmt == 'jsonl' and not record.strip():
+                    continue
+                chunk.append((number, record))
+                if len(chunk) >= self.chunk_size:
+                    self.import_chunk(chunk, fmt)
+                    chunk = []
+                    reset_queries()  # keeps DEBUG's query log from holding every INSERT
+                    if checkpoint:
+                        checkpoint({'offset': f.tell(), 'records': number})
+            if chunk:
+                self.import_chunk(chunk, fmt)
+        if checkpoint:
+            checkpoint(None)
+        return self.stats
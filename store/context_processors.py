@@ -1,15 +1,16 @@
-from .models import Cart
+from django.db.models import Sum
+
+from .models import CartItem
 
 def cart_context(request):
     """Add cart information to all templates"""
     cart_count = 0
     if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_count = cart.total_items
-        except Cart.DoesNotExist:
-            cart_count = 0
-    
+        # One query, without loading the cart or its items
+        cart_count = CartItem.objects.filter(cart__user=request.user).aggregate(
+            count=Sum('quantity')
+        )['count'] or 0
+
     return {
         'cart_count': cart_count
     }
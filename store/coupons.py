@@ -0,0 +1,182 @@
+"""
+Coupon lookup and redemption helpers.
+
+Coupon usage is counted with a single conditional UPDATE, so concurrent
+checkouts on the same code can never push used_count past usage_limit and
+only the used_count column is written. Every successful redemption is
+recorded in the CouponRedemption ledger, which per-user limits and releases
+work from. Cancelling an order gives its use back, and so does deleting an
+order that could still have been cancelled (see signals.py).
+
+Lookups by code go through an in-process index of active coupons so that
+apply_coupon and checkout do not hit the database for every keystroke of a
+promotion. The index is dropped when a Coupon is saved or deleted (see
+signals.py) and single entries are evicted when their used_count changes.
+"""
+import threading
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .models import Coupon, CouponRedemption
+
+# Upper bound on how stale another worker process's view of used_count can be.
+COUPON_INDEX_TTL = 60
+
+
+class CouponIndex:
+    """Active coupons keyed by code, matched exactly as Coupon.code is.
+
+    Holds raw field values rather than model instances; every get() builds a
+    fresh Coupon so callers can never mutate shared state.
+    """
+
+    def __init__(self, ttl=COUPON_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rows = None
+        self._evicted = set()
+        self._loaded_at = 0.0
+        self._field_names = [f.attname for f in Coupon._meta.concrete_fields]
+
+    def get(self, code):
+        """Return the active coupon for code, or None. Unknown codes are
+        answered from the index without a query."""
+        if not code:
+            return None
+        key = code
+        rows, hit = self._current_rows()
+        if key in self._evicted:
+            self._refresh(key)
+            rows, hit = self._current_rows()[0], False
+        metrics.CACHE_LOOKUPS.inc(cache='coupon_index', result='hit' if hit else 'miss')
+        values = rows.get(key)
+        if values is None:
+            return None
+        return Coupon.from_db('default', self._field_names, values)
+
+    def clear(self):
+        with self._lock:
+            self._rows = None
+            self._evicted.clear()
+
+    def evict(self, code):
+        """Mark one code as stale; it is re-read on its next lookup."""
+        with self._lock:
+            if self._rows is not None:
+                self._evicted.add(code)
+
+    def _current_rows(self):
+        """(rows, whether they were already loaded)."""
+        rows = self._rows
+        if rows is None or time.monotonic() - self._loaded_at > self.ttl:
+            return self._load(), False
+        return rows, True
+
+    def _active(self):
+        return Coupon.objects.filter(is_active=True, valid_to__gte=timezone.now())
+
+    def _load(self):
+        code_index = self._field_names.index('code')
+        rows = {values[code_index]: values for values in self._active().values_list(*self._field_names)}
+        with self._lock:
+            self._rows = rows
+            self._evicted.clear()
+            self._loaded_at = time.monotonic()
+        return rows
+
+    def _refresh(self, key):
+        values = self._active().filter(code=key).values_list(*self._field_names).first()
+        with self._lock:
+            if self._rows is None:
+                return
+            rows = dict(self._rows)
+            if values is None:
+                rows.pop(key, None)
+            else:
+                rows[key] = values
+            self._rows = rows
+            self._evicted.discard(key)
+
+
+coupon_index = CouponIndex()
+
+
+def redeem_coupon(coupon, user, order=None):
+    """Reserve one use of coupon for user. Returns the redemption, or None if
+    the coupon is exhausted, expired, inactive or over the per-user limit."""
+    now = timezone.now()
+    with transaction.atomic():
+        # The conditional increment takes the row lock first, so the per-user
+        # count below cannot race with another redemption of the same code.
+        updated = Coupon.objects.filter(
+            pk=coupon.pk,
+            is_active=True,
+            valid_from__lte=now,
+            valid_to__gte=now,
+            used_count__lt=F('usage_limit'),
+        ).update(used_count=F('used_count') + 1)
+        if not updated:
+            metrics.COUPON_REDEMPTIONS.inc(outcome='refused')
+            return None
+
+        if coupon.per_user_limit is not None:
+            used_by_user = CouponRedemption.objects.filter(
+                coupon=coupon, user=user, released_at__isnull=True
+            ).count()
+            if used_by_user >= coupon.per_user_limit:
+                transaction.set_rollback(True)
+                metrics.COUPON_REDEMPTIONS.inc(outcome='refused')
+                return None
+
+        redemption = CouponRedemption.objects.create(coupon=coupon, user=user, order=order)
+        transaction.on_commit(lambda: coupon_index.evict(coupon.code))
+        transaction.on_commit(lambda: metrics.COUPON_REDEMPTIONS.inc(outcome='redeemed'))
+        return redemption
+
+
+def release_coupon(order):
+    """Give back the coupon uses held by order. Safe to call more than once;
+    returns the number of redemptions released."""
+    released = 0
+    now = timezone.now()
+    with transaction.atomic():
+        redemptions = list(CouponRedemption.objects.filter(
+            order=order, released_at__isnull=True
+        ).values_list('pk', 'coupon_id', 'coupon__code'))
+        for redemption_id, coupon_id, code in redemptions:
+            # Only the caller that flips released_at gets to decrement.
+            if CouponRedemption.objects.filter(
+                pk=redemption_id, released_at__isnull=True
+            ).update(released_at=now):
+                Coupon.objects.filter(pk=coupon_id, used_count__gt=0).update(
+                    used_count=F('used_count') - 1
+                )
+                transaction.on_commit(lambda code=code: coupon_index.evict(code))
+                transaction.on_commit(lambda: metrics.COUPON_REDEMPTIONS.inc(outcome='released'))
+                released += 1
+    return released
+
+
+def reclaim_coupon(order):
+    """Take back the coupon uses release_coupon() gave back for order, whose
+    payment went through after all. The customer paid the discounted total,
+    so the use counts even if that puts the coupon over usage_limit. Returns
+    the number of redemptions reclaimed."""
+    reclaimed = 0
+    with transaction.atomic():
+        redemptions = list(CouponRedemption.objects.filter(
+            order=order, released_at__isnull=False
+        ).values_list('pk', 'coupon_id', 'coupon__code'))
+        for redemption_id, coupon_id, code in redemptions:
+            if CouponRedemption.objects.filter(
+                pk=redemption_id, released_at__isnull=False
+            ).update(released_at=None):
+                Coupon.objects.filter(pk=coupon_id).update(used_count=F('used_count') + 1)
+                transaction.on_commit(lambda code=code: coupon_index.evict(code))
+                transaction.on_commit(lambda: metrics.COUPON_REDEMPTIONS.inc(outcome='reclaimed'))
+                reclaimed += 1
+    return reclaimed
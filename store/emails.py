@@ -0,0 +1,210 @@
+"""
+Transactional email outbox.
+
+Views never talk to the mail server. They call one of the enqueue helpers,
+which is a single INSERT into OutboxEmail, and the send_outbox management
+command delivers pending rows in batches over one reused backend connection
+(one SMTP handshake per batch, not per message). Failed sends are retried
+with exponential backoff until EMAIL_OUTBOX_MAX_ATTEMPTS is reached.
+
+Any Django email backend works, so locmem and console backends can be used
+in tests and development, and store.fake_smtp provides a local SMTP server.
+
+Password reset OTPs are secrets: their body is blanked once sent, and OTP
+mail still unsent when the OTP expires is given up and blanked too, so the
+outbox (and the admin) never keeps a usable code.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+BATCH_SIZE = 100
+BACKOFF_BASE = 30  # seconds; doubled after every failed attempt
+BACKOFF_MAX = 3600
+# A row stuck in 'sending' this long belongs to a sender that died mid-batch.
+STALE_AFTER = timedelta(minutes=10)
+OTP_VALID_FOR = timedelta(minutes=10)
+# Kinds whose body is blanked once it is no longer needed
+SECRET_KINDS = ('otp',)
+
+
+def build_email(subject, body, recipients, kind='other', from_email=None):
+    """Return an unsaved OutboxEmail, or None if there is no one to send it to."""
+    recipients = [r for r in recipients if r]
+    if not recipients:
+        return None
+    return OutboxEmail(
+        kind=kind,
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=recipients,
+    )
+
+
+def enqueue_email(subject, body, recipients, kind='other', from_email=None):
+    """Queue one message. Returns the OutboxEmail, or None if there is no one
+    to send it to."""
+    email = build_email(subject, body, recipients, kind, from_email)
+    if email:
+        email.save()
+    return email
+
+
+def enqueue_otp_email(user, otp):
+    return enqueue_email(
+        'Password Reset OTP - FlugEde',
+        f'Hi {user.username},\n\nYour OTP for password reset is: {otp}\n\nValid for 10 minutes.',
+        [user.email],
+        kind='otp',
+    )
+
+
+def enqueue_order_confirmation(order):
+    return enqueue_email(
+        f'Order Confirmed - {order.order_number} - FlugEde',
+        f'Hi {order.user.username},\n\n'
+        f'Thank you for shopping with FlugEde! Your order {order.order_number} has been confirmed.\n\n'
+        f'Order total: ₹{order.total}\n'
+        f'Payment method: {order.get_payment_method_display()}\n'
+        f'Expected delivery: {order.expected_delivery_date or "to be confirmed"}\n',
+        [order.user.email],
+        kind='order_confirmation',
+    )
+
+
+def order_status_email(order, notes=''):
+    body = (
+        f'Hi {order.user.username},\n\n'
+        f'Your order {order.order_number} is now: {order.get_order_status_display()}.\n'
+    )
+    if order.tracking_number:
+        body += f'Tracking number: {order.tracking_number}\n'
+    if notes:
+        body += f'\n{notes}\n'
+    return build_email(
+        f'Order {order.order_number} - {order.get_order_status_display()} - FlugEde',
+        body,
+        [order.user.email],
+        kind='order_status',
+    )
+
+
+def enqueue_order_status_email(order, notes=''):
+    email = order_status_email(order, notes)
+    if email:
+        email.save()
+    return email
+
+
+def enqueue_order_status_emails(orders, notes=''):
+    """Queue status emails for many orders with one INSERT per batch. Orders
+    should be fetched with select_related('user')."""
+    emails = [email for email in (order_status_email(order, notes) for order in orders) if email]
+    return OutboxEmail.objects.bulk_create(emails, batch_size=BATCH_SIZE)
+
+
+def due_emails(now=None):
+    now = now or timezone.now()
+    return OutboxEmail.objects.filter(
+        Q(status='pending', next_attempt_at__lte=now) |
+        Q(status='sending', updated_at__lt=now - STALE_AFTER)
+    )
+
+
+def claim_batch(batch_size=BATCH_SIZE):
+    """Mark up to batch_size due rows as ours. Concurrent senders never get
+    the same row."""
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    ids = list(due_emails(now).order_by('next_attempt_at').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    due_emails(now).filter(id__in=ids).update(status='sending', claim_token=token, updated_at=now)
+    return list(OutboxEmail.objects.filter(claim_token=token, status='sending').order_by('id'))
+
+
+def backoff_delay(attempts):
+    return timedelta(seconds=min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(attempts - 1, 0)))
+
+
+def deliver_batch(batch_size=BATCH_SIZE, connection=None, max_attempts=None):
+    """Send one batch over a single backend connection.
+
+    Returns (sent, failed) counts for the batch.
+    """
+    max_attempts = max_attempts or settings.EMAIL_OUTBOX_MAX_ATTEMPTS
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    connection = connection or get_connection()
+    sent_ids, failures = [], []
+    try:
+        connection.open()
+    except Exception as e:
+        failures = [(email, e) for email in batch]
+    else:
+        try:
+            for email in batch:
+                message = EmailMessage(
+                    email.subject, email.body, email.from_email, email.recipients,
+                    connection=connection,
+                )
+                try:
+                    if connection.send_messages([message]):
+                        sent_ids.append(email.id)
+                    else:
+                        failures.append((email, 'Backend reported nothing sent'))
+                except Exception as e:
+                    failures.append((email, e))
+        finally:
+            connection.close()
+
+    now = timezone.now()
+    if sent_ids:
+        OutboxEmail.objects.filter(id__in=sent_ids).update(
+            status='sent', sent_at=now, attempts=F('attempts') + 1, last_error='', claim_token='', updated_at=now
+        )
+        OutboxEmail.objects.filter(id__in=sent_ids, kind__in=SECRET_KINDS).update(body='')
+    for email, error in failures:
+        attempts = email.attempts + 1
+        OutboxEmail.objects.filter(id=email.id).update(
+            status='failed' if attempts >= max_attempts else 'pending',
+            attempts=attempts,
+            next_attempt_at=now + backoff_delay(attempts),
+            last_error=str(error),
+            claim_token='',
+            updated_at=now,
+        )
+    return len(sent_ids), len(failures)
+
+
+def expire_secrets(now=None):
+    """Give up OTP mail that expired before it could be sent, and blank the
+    body of every expired one. Returns the number given up."""
+    now = now or timezone.now()
+    expired = OutboxEmail.objects.filter(kind__in=SECRET_KINDS, created_at__lt=now - OTP_VALID_FOR)
+    given_up = expired.filter(status__in=['pending', 'sending']).update(
+        status='failed', last_error='Expired before it was sent', claim_token='', updated_at=now
+    )
+    expired.exclude(body='').update(body='', updated_at=now)
+    return given_up
+
+
+def deliver_outbox(batch_size=BATCH_SIZE, connection=None, max_attempts=None):
+    """Drain everything currently due. Returns (sent, failed)."""
+    expire_secrets()
+    total_sent = total_failed = 0
+    while True:
+        sent, failed = deliver_batch(batch_size, connection, max_attempts)
+        if not (sent or failed):
+            return total_sent, total_failed
+        total_sent += sent
+        total_failed += failed
@@ -0,0 +1,246 @@
+"""
+Streaming CSV / JSONL exports.
+
+Each exporter turns a queryset into rows (CSV) or records (JSONL) and
+export_response() streams them out with StreamingHttpResponse. Rows are read
+as values() dicts in primary key order, CHUNK_SIZE at a time (each chunk is
+a range scan starting after the last pk seen), and child rows such as order
+items are fetched once per chunk. Memory use therefore does not grow with
+the size of the export, and no model instances are built. The CSV header is
+sent before the first query runs.
+
+Django's ASGI handler reads a synchronous streaming body to the end before
+sending any of it, so for a request served over ASGI the same generator is
+handed over as an async iterator that runs it one write at a time in the
+request's sync thread.
+"""
+import csv
+import json
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import OrderItem, ProductSpecification
+
+CHUNK_SIZE = 2000  # rows per query
+BUFFER_SIZE = 64 * 1024  # characters handed to the server per write
+
+
+class Echo:
+    """File-like object for csv.writer that hands each line back."""
+
+    def write(self, value):
+        return value
+
+
+class Exporter:
+    name = ''
+    # (column name, values() lookup) pairs for the exported model
+    columns = ()
+
+    @property
+    def fields(self):
+        return [name for name, _ in self.columns]
+
+    def chunks(self, queryset):
+        """Yield lists of up to CHUNK_SIZE value dicts, in pk order."""
+        queryset = queryset.order_by('pk')
+        lookups = ['pk'] + [lookup for _, lookup in self.columns]
+        last_pk = None
+        while True:
+            page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            rows = list(page.values(*lookups)[:CHUNK_SIZE])
+            if not rows:
+                return
+            last_pk = rows[-1]['pk']
+            yield rows
+
+    def records(self, queryset):
+        for rows in self.chunks(queryset):
+            for row in rows:
+                yield {name: row[lookup] for name, lookup in self.columns}
+
+    def rows(self, queryset):
+        """CSV rows, one list per line, matching fields."""
+        for record in self.records(queryset):
+            yield [record[field] for field in self.fields]
+
+
+class OrderExporter(Exporter):
+    name = 'orders'
+    columns = (
+        ('order_number', 'order_number'),
+        ('username', 'user__username'),
+        ('email', 'user__email'),
+        ('created_at', 'created_at'),
+        ('order_status', 'order_status'),
+        ('payment_method', 'payment_method'),
+        ('payment_status', 'payment_status'),
+        ('subtotal', 'subtotal'),
+        ('shipping_charge', 'shipping_charge'),
+        ('tax', 'tax'),
+        ('discount', 'discount'),
+        ('total', 'total'),
+        ('coupon', 'coupon__code'),
+        ('tracking_number', 'tracking_number'),
+    )
+    item_fields = ('product_name', 'product_price', 'quantity', 'total_price')
+
+    @property
+    def fields(self):
+        return super().fields + [f'item_{field}' for field in self.item_fields]
+
+    def records(self, queryset):
+        for rows in self.chunks(queryset):
+            items = defaultdict(list)
+            for order_id, *values in OrderItem.objects.filter(
+                order_id__in=[row['pk'] for row in rows]
+            ).order_by('pk').values_list('order_id', *self.item_fields):
+                items[order_id].append(dict(zip(self.item_fields, values)))
+            for row in rows:
+                record = {name: row[lookup] for name, lookup in self.columns}
+                record['coupon'] = record['coupon'] or ''
+                record['items'] = items.get(row['pk'], [])
+                yield record
+
+    def rows(self, queryset):
+        # One line per order item; orders without items get a single line
+        order_fields = super().fields
+        for record in self.records(queryset):
+            order_row = [record[field] for field in order_fields]
+            if not record['items']:
+                yield order_row + [''] * len(self.item_fields)
+            for item in record['items']:
+                yield order_row + [item[field] for field in self.item_fields]
+
+
+class ProductExporter(Exporter):
+    name = 'products'
+    columns = (
+        ('id', 'id'),
+        ('name', 'name'),
+        ('slug', 'slug'),
+        ('category', 'category__name'),
+        ('brand', 'brand__name'),
+        ('price', 'price'),
+        ('discount_price', 'discount_price'),
+        ('stock', 'stock'),
+        ('is_active', 'is_active'),
+        ('is_featured', 'is_featured'),
+        ('warranty_period', 'warranty_period'),
+    )
+
+    @property
+    def fields(self):
+        return super().fields + ['specifications']
+
+    def records(self, queryset):
+        for rows in self.chunks(queryset):
+            specs = defaultdict(dict)
+            for product_id, name, value in ProductSpecification.objects.filter(
+                product_id__in=[row['pk'] for row in rows]
+            ).order_by('order', 'name').values_list('product_id', 'name', 'value'):
+                specs[product_id][name] = value
+            for row in rows:
+                record = {name: row[lookup] for name, lookup in self.columns}
+                record['brand'] = record['brand'] or ''
+                record['specifications'] = specs.get(row['pk'], {})
+                yield record
+
+    def rows(self, queryset):
+        for record in self.records(queryset):
+            record['specifications'] = '; '.join(f'{name}: {value}' for name, value in record['specifications'].items())
+            yield [record[field] for field in self.fields]
+
+
+class NewsletterExporter(Exporter):
+    name = 'newsletter'
+    columns = (
+        ('email', 'email'),
+        ('is_active', 'is_active'),
+        ('created_at', 'created_at'),
+    )
+
+
+class ReturnRequestExporter(Exporter):
+    name = 'return_requests'
+    columns = (
+        ('id', 'id'),
+        ('order_number', 'order_item__order__order_number'),
+        ('product_name', 'order_item__product_name'),
+        ('quantity', 'order_item__quantity'),
+        ('username', 'user__username'),
+        ('reason', 'reason'),
+        ('status', 'status'),
+        ('description', 'description'),
+        ('admin_notes', 'admin_notes'),
+        ('created_at', 'created_at'),
+        ('updated_at', 'updated_at'),
+    )
+
+
+def stream_csv(exporter, queryset):
+    writer = csv.writer(Echo())
+    yield writer.writerow(exporter.fields)
+    for row in exporter.rows(queryset):
+        yield writer.writerow(row)
+
+
+def stream_jsonl(exporter, queryset):
+    for record in exporter.records(queryset):
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def buffered(chunks, size=None):
+    """Join small lines into writes of about size (default BUFFER_SIZE)
+    characters. The first chunk (the CSV header) goes out on its own so the
+    download starts at once."""
+    size = size or BUFFER_SIZE
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return
+    yield first
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+async def aiterate(chunks):
+    """Async iterator over a sync one, fetching each chunk in the sync thread
+    (thread_sensitive, so the queries share the request's connection)."""
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        # Also runs when the client goes away mid-download
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'jsonl': (stream_jsonl, 'application/x-ndjson'),
+}
+
+
+def export_response(exporter, queryset, fmt='csv', request=None):
+    stream, content_type = FORMATS[fmt]
+    filename = f'{exporter.name}-{timezone.now():%Y%m%d-%H%M%S}.{fmt}'
+    chunks = buffered(stream(exporter, queryset))
+    if isinstance(request, ASGIRequest):
+        chunks = aiterate(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,141 @@
+"""
+A local stand-in for the Razorpay Orders API.
+
+FakeRazorpayServer speaks just enough of the API for checkout: creating and
+fetching orders, with HTTP basic auth and Razorpay-shaped error bodies. It
+keeps connections alive like the real gateway, and can add artificial
+latency, so checkout throughput can be benchmarked end to end without network
+access. pay() plays the part of Razorpay Checkout and returns a correctly
+signed payment for an order.
+"""
+import base64
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .payments import payment_signature
+
+
+class FakeRazorpayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY every
+    # keep-alive response would stall on the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def handle_api(self, method):
+        gateway = self.server.gateway
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if gateway.latency:
+            time.sleep(gateway.latency)
+
+        if self.headers.get('Authorization') != gateway.authorization:
+            return self.send_error_json(401, 'BAD_REQUEST_ERROR', 'Authentication failed')
+
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if method == 'POST' and path == '/v1/orders':
+            try:
+                data = json.loads(body or b'{}')
+            except ValueError:
+                return self.send_error_json(400, 'BAD_REQUEST_ERROR', 'Invalid JSON')
+            if not isinstance(data.get('amount'), int) or data['amount'] < 100:
+                return self.send_error_json(400, 'BAD_REQUEST_ERROR', 'The amount must be atleast INR 1.00')
+            return self.send_json(200, gateway.create_order(data))
+
+        if method == 'GET' and path.startswith('/v1/orders/'):
+            order = gateway.orders.get(path.rsplit('/', 1)[1])
+            if order is None:
+                return self.send_error_json(400, 'BAD_REQUEST_ERROR', 'The id provided does not exist')
+            return self.send_json(200, order)
+
+        return self.send_error_json(400, 'BAD_REQUEST_ERROR', 'The requested URL was not found on the server.')
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, code, description):
+        self.send_json(status, {'error': {'code': code, 'description': description}})
+
+
+class FakeRazorpayServer:
+    def __init__(self, key_id, key_secret, host='127.0.0.1', port=0, latency=0.0):
+        self.key_id = key_id
+        self.key_secret = key_secret
+        self.latency = latency
+        self.authorization = 'Basic ' + base64.b64encode(f'{key_id}:{key_secret}'.encode()).decode()
+        self.orders = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), FakeRazorpayHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.gateway = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def create_order(self, data):
+        order = {
+            'id': f'order_{uuid.uuid4().hex[:14]}',
+            'entity': 'order',
+            'amount': data['amount'],
+            'amount_paid': 0,
+            'amount_due': data['amount'],
+            'currency': data.get('currency', 'INR'),
+            'receipt': data.get('receipt'),
+            'status': 'created',
+            'attempts': 0,
+            'notes': data.get('notes', {}),
+            'created_at': int(time.time()),
+        }
+        with self._lock:
+            self.orders[order['id']] = order
+        return order
+
+    def pay(self, razorpay_order_id):
+        """Simulate a successful Checkout payment for an order."""
+        with self._lock:
+            order = self.orders[razorpay_order_id]
+            order.update(status='paid', amount_paid=order['amount'], amount_due=0, attempts=order['attempts'] + 1)
+        payment_id = f'pay_{uuid.uuid4().hex[:14]}'
+        return {
+            'razorpay_order_id': razorpay_order_id,
+            'razorpay_payment_id': payment_id,
+            'razorpay_signature': payment_signature(razorpay_order_id, payment_id, self.key_secret),
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
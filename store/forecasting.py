@@ -0,0 +1,127 @@
+"""
+Sales velocity and stock-out forecasting.
+
+forecast_stock() reads the order lines of the last WINDOW_DAYS days as plain
+integer arrays and computes, for every product at once, an exponentially
+weighted average of units sold per day (recent days count more, halving
+every HALF_LIFE_DAYS) and the number of days the current stock will last at
+that rate. Results are stored on Product (sales_velocity and
+days_until_stockout). Stock moves between runs, so what shoppers and staff
+see (Product.stock_status, the admin stock-out filter) is worked out from
+the current stock and the stored velocity; days_until_stockout is the
+snapshot as of the last run.
+
+Order lines are fetched without their timestamps: the orders in the window
+are read once to map each order id to a day index, and the much larger
+order item query only returns (order_id, product_id, quantity) integers.
+Both are loaded straight into NumPy arrays, so the work per order line is a
+few vectorised array operations. Orders placed (or whose status changed)
+between the two reads show up in only one of them; lines of orders missing
+from the first read are left out until the next run.
+
+The window must stay shorter than ORDER_ARCHIVE_AFTER_DAYS; archived orders
+are not read.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem, Product
+
+WINDOW_DAYS = 56
+HALF_LIFE_DAYS = 14
+UPDATE_BATCH_SIZE = 1000
+VELOCITY_PLACES = Decimal('0.01')
+# days_until_stockout is capped so a slow seller with deep stock still fits
+# the column and sorts last
+MAX_DAYS = 9999
+
+
+def _int_columns(queryset, *fields):
+    """values_list() of integer fields as one int64 array per field."""
+    rows = queryset.values_list(*fields).order_by()
+    data = np.fromiter((value for row in rows.iterator(chunk_size=10000) for value in row), dtype=np.int64)
+    return data.reshape(-1, len(fields)).T
+
+
+def day_weights(window=WINDOW_DAYS, half_life=HALF_LIFE_DAYS):
+    """Weight of each day in the window, index 0 being today."""
+    return 0.5 ** (np.arange(window) / half_life)
+
+
+def velocities(product_ids, ages, line_products, line_days, line_quantities,
+               window=WINDOW_DAYS, half_life=HALF_LIFE_DAYS):
+    """Weighted units per day for each product in product_ids (sorted).
+
+    ages holds each product's age in days; a product listed for fewer days
+    than the window is averaged over the days it was listed. The line_*
+    arrays describe the order lines: product id, day index (0 = today) and
+    quantity.
+    """
+    weights = day_weights(window, half_life)
+    index = np.searchsorted(product_ids, line_products)
+    known = (index < len(product_ids)) & (product_ids[np.minimum(index, len(product_ids) - 1)] == line_products)
+    sold = np.bincount(
+        index[known], weights=line_quantities[known] * weights[line_days[known]], minlength=len(product_ids),
+    )
+    listed_days = np.clip(ages, 1, window)
+    return sold / np.cumsum(weights)[listed_days - 1]
+
+
+def days_until_stockout(stock, velocity):
+    """Whole days the stock lasts at velocity units/day; -1 when there were
+    no sales to forecast from."""
+    days = np.full(len(stock), -1, dtype=np.int64)
+    selling = velocity > 0
+    days[selling] = np.minimum(np.floor(np.maximum(stock[selling], 0) / velocity[selling]), MAX_DAYS)
+    days[(stock <= 0)] = 0
+    return days
+
+
+def forecast_stock(window=WINDOW_DAYS, half_life=HALF_LIFE_DAYS, now=None):
+    """Recompute the forecast for every product. Returns (lines, updated):
+    order lines read and products whose stored forecast changed."""
+    now = now or timezone.now()
+    start = now - timedelta(days=window)
+    orders = Order.objects.filter(created_at__gte=start).exclude(order_status='cancelled').exclude(payment_status='failed')
+
+    order_ids, created = [], []
+    for order_id, created_at in orders.values_list('id', 'created_at').order_by('id').iterator(chunk_size=10000):
+        order_ids.append(order_id)
+        created.append((now - created_at).days)
+    order_ids = np.array(order_ids, dtype=np.int64)
+    order_days = np.clip(np.array(created, dtype=np.int64), 0, window - 1)
+
+    line_orders, line_products, line_quantities = _int_columns(
+        OrderItem.objects.filter(order__in=orders, product__isnull=False), 'order_id', 'product_id', 'quantity',
+    )
+    # Drop lines of orders that were not in the first read
+    index = np.searchsorted(order_ids, line_orders)
+    found = index < len(order_ids)
+    found[found] = order_ids[index[found]] == line_orders[found]
+    line_products, line_quantities = line_products[found], line_quantities[found]
+    line_days = order_days[index[found]]
+
+    products = list(Product.objects.values_list('id', 'stock', 'created_at', 'sales_velocity', 'days_until_stockout').order_by('id'))
+    if not products:
+        return len(line_products), 0
+    product_ids = np.array([p[0] for p in products], dtype=np.int64)
+    stock = np.array([p[1] for p in products], dtype=np.int64)
+    ages = np.array([(now - p[2]).days + 1 for p in products], dtype=np.int64)
+
+    velocity = velocities(product_ids, ages, line_products, line_days, line_quantities, window, half_life)
+    days = days_until_stockout(stock, velocity)
+
+    changed = []
+    for (pk, _, _, old_velocity, old_days), rate, left in zip(products, velocity.tolist(), days.tolist()):
+        rate = Decimal(rate).quantize(VELOCITY_PLACES)
+        left = None if left < 0 else left
+        if rate != old_velocity or left != old_days:
+            changed.append(Product(id=pk, sales_velocity=rate, days_until_stockout=left))
+
+    with transaction.atomic():
+        Product.objects.bulk_update(changed, ['sales_velocity', 'days_until_stockout'], batch_size=UPDATE_BATCH_SIZE)
+    return len(line_products), len(changed)
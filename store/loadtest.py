@@ -0,0 +1,283 @@
+"""
+Load generator: virtual shoppers replaying journeys against the app.
+
+A journey is a weighted list of steps. Each step is one request whose path
+and form data are templates filled from the shopper's picks for that pass
+({product_id}, {product_slug}, {category_slug}, {query}, {address_id}).
+JOURNEYS holds the built-in journeys; more can be loaded from a JSON file of
+the same shape:
+
+  {"browse": {"weight": 3, "steps": [
+      {"name": "home", "path": "/"},
+      {"name": "checkout", "method": "post", "path": "/checkout/",
+       "data": {"address_id": "{address_id}", "payment_method": "cod"},
+       "expect": [302], "location": "/order/success/"}]}}
+
+A step fails if the status is not in expect (default: below 400) or a
+redirect does not go to location.
+
+Shoppers are the users generate_data makes (loadtest<id>, with an address
+and a cart), one per thread, optionally spread over processes. They either
+call the WSGI handler directly (InProcessSession: no sockets, no server) or
+talk HTTP to a server (HttpSession). Latencies are recorded per step name
+and merged into a Report with throughput, error rate and percentiles.
+"""
+import multiprocessing
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from urllib.parse import urljoin
+
+import django
+import requests
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import Client
+
+from .models import Category, Product
+from .synthetic import LOAD_TEST_PASSWORD
+
+JOURNEYS = {
+    'browse': {'weight': 6, 'steps': [
+        {'name': 'home', 'path': '/'},
+        {'name': 'product_list', 'path': '/products/?category={category_slug}'},
+        {'name': 'search_suggestions', 'path': '/search-suggestions/?q={query}'},
+        {'name': 'product_detail', 'path': '/product/{product_slug}/'},
+    ]},
+    'buy': {'weight': 1, 'steps': [
+        {'name': 'home', 'path': '/'},
+        {'name': 'product_detail', 'path': '/product/{product_slug}/'},
+        {'name': 'add_to_cart', 'path': '/cart/add/{product_id}/', 'expect': [302]},
+        {'name': 'cart', 'path': '/cart/'},
+        {'name': 'checkout_page', 'path': '/checkout/'},
+        {'name': 'checkout', 'method': 'post', 'path': '/checkout/',
+         'data': {'address_id': '{address_id}', 'payment_method': 'cod'},
+         'expect': [302], 'location': '/order/success/'},
+    ]},
+}
+
+PERCENTILES = (50, 95, 99)
+MAX_ERROR_SAMPLES = 5
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * p // 100))  # ceil
+    return ordered[int(rank) - 1]
+
+
+@dataclass
+class StepStats:
+    latencies: list = field(default_factory=list)  # seconds, successful and failed
+    errors: int = 0
+    statuses: Counter = field(default_factory=Counter)
+    samples: list = field(default_factory=list)  # first MAX_ERROR_SAMPLES error descriptions
+
+    def merge(self, other):
+        self.latencies += other.latencies
+        self.errors += other.errors
+        self.statuses.update(other.statuses)
+        self.samples += other.samples[:MAX_ERROR_SAMPLES - len(self.samples)]
+
+
+@dataclass
+class Report:
+    elapsed: float = 0.0  # measured seconds
+    steps: dict = field(default_factory=dict)  # step name -> StepStats
+
+    def step(self, name):
+        return self.steps.setdefault(name, StepStats())
+
+    def merge(self, other):
+        for name, stats in other.steps.items():
+            self.step(name).merge(stats)
+
+    def summary(self):
+        """{step name: figures} plus 'total', all JSON-friendly."""
+        rows = {}
+        everything = StepStats()
+        for name, stats in sorted(self.steps.items()):
+            rows[name] = self._figures(stats)
+            everything.merge(stats)
+        rows['total'] = self._figures(everything)
+        return rows
+
+    def _figures(self, stats):
+        ordered = sorted(stats.latencies)
+        requests_made = len(ordered)
+        figures = {
+            'requests': requests_made,
+            'errors': stats.errors,
+            'error_rate': round(stats.errors / requests_made, 4) if requests_made else 0.0,
+            'rps': round(requests_made / self.elapsed, 2) if self.elapsed else 0.0,
+            'mean_ms': round(sum(ordered) / requests_made * 1000, 2) if requests_made else 0.0,
+            'statuses': {str(status): count for status, count in sorted(stats.statuses.items())},
+        }
+        for p in PERCENTILES:
+            figures[f'p{p}_ms'] = round(percentile(ordered, p) * 1000, 2)
+        if stats.samples:
+            figures['error_samples'] = stats.samples
+        return figures
+
+
+class InProcessSession:
+    """Requests go straight into Django's request handler."""
+
+    def __init__(self, user_id):
+        self.client = Client()
+        self.client.force_login(User.objects.get(pk=user_id))
+
+    def request(self, method, path, data):
+        response = getattr(self.client, method)(path, data or {})
+        return response.status_code, response.get('Location', '')
+
+
+class HttpSession:
+    """Requests go over HTTP to base_url, as a browser would send them."""
+
+    def __init__(self, user_id, base_url):
+        self.base_url = base_url
+        self.http = requests.Session()
+        username = User.objects.filter(pk=user_id).values_list('username', flat=True).get()
+        status, location = self.request('post', '/login/', {'username': username, 'password': LOAD_TEST_PASSWORD})
+        if status != 302:
+            raise RuntimeError(f'Could not log in as {username} (HTTP {status})')
+
+    def request(self, method, path, data):
+        url = urljoin(self.base_url, path)
+        if method == 'post':
+            if 'csrftoken' not in self.http.cookies:
+                self.http.get(url)
+            token = self.http.cookies.get('csrftoken', '')
+            data = {**(data or {}), 'csrfmiddlewaretoken': token}
+            response = self.http.post(url, data=data, allow_redirects=False,
+                                      headers={'X-CSRFToken': token, 'Referer': url})
+        else:
+            response = self.http.get(url, allow_redirects=False)
+        return response.status_code, response.headers.get('Location', '')
+
+
+def catalog_picks():
+    """Products [(id, slug)], category slugs and search terms for journeys
+    to fill in; empty products when nothing is in stock."""
+    products = list(
+        Product.objects.filter(is_active=True, stock__gt=0).order_by('-created_at')
+        .values_list('id', 'slug')[:2000]
+    )
+    categories = list(
+        Category.objects.filter(products__is_active=True).values_list('slug', flat=True).distinct()[:500]
+    )
+    names = Product.objects.filter(id__in=[pk for pk, _ in products[:200]]).values_list('name', flat=True)
+    queries = sorted({word.lower() for name in names for word in name.split() if len(word) >= 3})
+    return {'products': products, 'categories': categories, 'queries': queries}
+
+
+def fill(template, picks):
+    if isinstance(template, dict):
+        return {key: fill(value, picks) for key, value in template.items()}
+    return template.format(**picks)
+
+
+def _ok(step, status, location):
+    expect = step.get('expect')
+    if expect is not None and status not in expect:
+        return False
+    if expect is None and not 0 < status < 400:
+        return False
+    return not step.get('location') or location.startswith(step['location'])
+
+
+def _shopper(config, shopper_id, address_id, report, lock, seed):
+    """One virtual shopper: pick a journey, run its steps, repeat until the
+    deadline. Records into report under lock."""
+    rng = random.Random(f'{seed}:{shopper_id}')
+    local = Report()
+    try:
+        session = (HttpSession(shopper_id, config['url']) if config['url'] else InProcessSession(shopper_id))
+        names = list(config['journeys'])
+        weights = [config['journeys'][name]['weight'] for name in names]
+        while time.monotonic() < config['deadline']:
+            journey = config['journeys'][rng.choices(names, weights)[0]]
+            product_id, product_slug = rng.choice(config['products'])
+            picks = {
+                'product_id': product_id, 'product_slug': product_slug, 'address_id': address_id,
+                'category_slug': rng.choice(config['categories']), 'query': rng.choice(config['queries']),
+            }
+            for step in journey['steps']:
+                if time.monotonic() >= config['deadline']:
+                    break
+                method = step.get('method', 'get')
+                start = time.perf_counter()
+                try:
+                    status, location = session.request(method, fill(step['path'], picks),
+                                                       fill(step.get('data', {}), picks))
+                    error = None if _ok(step, status, location) else f'HTTP {status} {location}'.strip()
+                except Exception as e:  # a failed request is a result, not a crash
+                    status, error = 0, f'{type(e).__name__}: {e}'
+                elapsed = time.perf_counter() - start
+                if time.monotonic() >= config['measure_from']:
+                    stats = local.step(step['name'])
+                    stats.latencies.append(elapsed)
+                    stats.statuses[status] += 1
+                    if error:
+                        stats.errors += 1
+                        if len(stats.samples) < MAX_ERROR_SAMPLES:
+                            stats.samples.append(error)
+                if config['think']:
+                    time.sleep(rng.uniform(0, 2 * config['think']))
+    finally:
+        connections.close_all()
+        with lock:
+            report.merge(local)
+
+
+def run_threads(config, shoppers):
+    """Run [(user id, address id)] as threads in this process. Returns a
+    Report of the requests they made."""
+    report, lock = Report(), threading.Lock()
+    threads = [
+        threading.Thread(target=_shopper, args=(config, user_id, address_id, report, lock, config['seed']))
+        for user_id, address_id in shoppers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return report
+
+
+def _start_worker():
+    django.setup()
+
+
+def _run_process(args):
+    return run_threads(*args)
+
+
+def run(config, shoppers, processes=1):
+    """Run the shoppers for config['duration'] seconds after
+    config['warmup'], in processes x threads. Returns the merged Report.
+
+    config: journeys, products [(id, slug)], categories, queries, url (None
+    for in-process), think, seed, duration, warmup.
+    """
+    start = time.monotonic()
+    config = {**config, 'measure_from': start + config['warmup'],
+              'deadline': start + config['warmup'] + config['duration']}
+    if processes > 1:
+        # Children open their own database connections
+        connections.close_all()
+        slices = [(config, shoppers[i::processes]) for i in range(processes)]
+        with multiprocessing.Pool(processes, initializer=_start_worker) as pool:
+            reports = pool.map(_run_process, slices)
+        report = Report()
+        for part in reports:
+            report.merge(part)
+    else:
+        report = run_threads(config, shoppers)
+    report.elapsed = config['duration']
+    return report
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from datetime import timedelta
+
+from store.archive import BATCH_SIZE, archivable_orders, archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move old delivered and cancelled orders out of the hot order tables into the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Archive orders unchanged for this many days (default: ORDER_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Orders moved per transaction')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after archiving this many orders')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many orders are eligible')
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else settings.ORDER_ARCHIVE_AFTER_DAYS
+        cutoff = timezone.now() - timedelta(days=days)
+
+        if options['dry_run']:
+            eligible = archivable_orders(cutoff).values('id').distinct().count()
+            self.stdout.write(f'{eligible} orders older than {days} days can be archived')
+            return
+
+        archived = archive_orders(cutoff, batch_size=options['batch_size'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} orders older than {days} days'))
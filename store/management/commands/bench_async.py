@@ -0,0 +1,246 @@
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from store import loadtest
+
+# The catalog pages, as the browse journey visits them
+STEPS = loadtest.JOURNEYS['browse']['steps']
+
+# Each mode runs in a fresh process, configured the way it is deployed
+MODES = {
+    'sync': {'CATALOG_VIEWS_ASYNC': 'false'},  # flugede/wsgi.py
+    'async': {'CATALOG_VIEWS_ASYNC': 'true', 'DATABASE_CONN_MAX_AGE': '0'},  # flugede/asgi.py
+}
+
+HOST = 'testserver'
+
+
+class Command(BaseCommand):
+    help = ('Request the catalog pages (home, product list, product detail, search suggestions) from many '
+            'concurrent clients, once through the WSGI handler and the sync views and once through the ASGI '
+            'handler and the async views, and compare throughput, latency percentiles and threads used.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=64,
+                            help='Requests in flight: threads for sync, tasks for async')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to measure, per mode')
+        parser.add_argument('--warmup', type=float, default=2.0, help='Seconds to run before measuring')
+        parser.add_argument('--db-latency', type=float, default=0.0, metavar='MS',
+                            help='Add this much wait to every query, like a database across the network')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save', metavar='PATH', help='Write the results as JSON')
+        # Set when this command runs itself for one mode
+        parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        if options['mode']:
+            self.stdout.write(json.dumps(self.run_mode(options)))
+            return
+
+        results = {}
+        for mode in MODES:
+            self.stdout.write(f'{mode}: {options["concurrency"]} concurrent, {options["warmup"]:g}s warm-up + '
+                              f'{options["duration"]:g}s, {options["db_latency"]:g} ms added per query')
+            results[mode] = self.spawn(mode, options)
+        self.print_table(results)
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump({'options': {key: options[key] for key in
+                                       ('concurrency', 'duration', 'warmup', 'db_latency', 'seed')},
+                           'modes': results}, f, indent=2)
+            self.stdout.write(f'Saved to {options["save"]}')
+
+    def spawn(self, mode, options):
+        command = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_async', '--mode', mode,
+            '--concurrency', str(options['concurrency']), '--duration', str(options['duration']),
+            '--warmup', str(options['warmup']), '--db-latency', str(options['db_latency']),
+            '--seed', str(options['seed']),
+        ]
+        child = subprocess.run(command, env={**os.environ, **MODES[mode]}, capture_output=True, text=True)
+        if child.returncode:
+            raise CommandError(f'{mode} run failed:\n{child.stderr}')
+        return json.loads(child.stdout.strip().splitlines()[-1])
+
+    # One mode, in this process
+
+    def run_mode(self, options):
+        mode = options['mode']
+        if settings.CATALOG_VIEWS_ASYNC != (mode == 'async'):
+            raise CommandError(f'CATALOG_VIEWS_ASYNC must be {mode == "async"} for the {mode} run')
+        if options['db_latency']:
+            delay = options['db_latency'] / 1000
+
+            def wait(execute, sql, params, many, context):
+                time.sleep(delay)
+                return execute(sql, params, many, context)
+
+            def add_wait(connection, **kwargs):
+                connection.execute_wrappers.append(wait)
+
+            connection_created.connect(add_wait, weak=False)
+
+        picks = loadtest.catalog_picks()
+        if not picks['products']:
+            raise CommandError('No products in stock; run generate_data first')
+        start = time.monotonic()
+        config = {**picks, 'seed': options['seed'], 'measure_from': start + options['warmup'],
+                  'deadline': start + options['warmup'] + options['duration']}
+
+        threads = ThreadCount()
+        report = loadtest.Report(elapsed=options['duration'])
+        self.lock = threading.Lock()
+        with override_settings(ALLOWED_HOSTS=[HOST]), threads:
+            if mode == 'async':
+                asyncio.run(self.run_async(config, options['concurrency'], report))
+            else:
+                self.run_sync(config, options['concurrency'], report)
+        return {'endpoints': report.summary(), 'peak_threads': threads.peak}
+
+    def run_sync(self, config, concurrency, report):
+        handler = WSGIHandler()
+
+        def request(path):
+            path, _, query = path.partition('?')
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'HTTP_HOST': HOST, 'REMOTE_ADDR': '127.0.0.1',
+                'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+                'wsgi.errors': sys.stderr,
+            }
+            status = []
+            body = handler(environ, lambda line, headers, exc_info=None: status.append(line))
+            try:
+                for _ in body:
+                    pass
+            finally:
+                body.close()
+            return int(status[0].split()[0])
+
+        def client(number):
+            rng = random.Random(f'{config["seed"]}:{number}')
+            while time.monotonic() < config['deadline']:
+                step, path = self.pick(rng, config)
+                start = time.perf_counter()
+                status = request(path)
+                self.record(report, config, step, status, time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client, args=(number,)) for number in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    async def run_async(self, config, concurrency, report):
+        handler = ASGIHandler()
+
+        async def request(path):
+            path, _, query = path.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'headers': [(b'host', HOST.encode())], 'client': ('127.0.0.1', 0),
+                'server': (HOST, 80),
+            }
+            received, status = False, []
+
+            async def receive():
+                nonlocal received
+                if not received:
+                    received = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await asyncio.Future()  # the client never disconnects; the handler cancels this
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            await handler(scope, receive, send)
+            return status[0]
+
+        async def client(number):
+            rng = random.Random(f'{config["seed"]}:{number}')
+            while time.monotonic() < config['deadline']:
+                step, path = self.pick(rng, config)
+                start = time.perf_counter()
+                status = await request(path)
+                self.record(report, config, step, status, time.perf_counter() - start)
+
+        await asyncio.gather(*(client(number) for number in range(concurrency)))
+
+    def pick(self, rng, config):
+        step = rng.choice(STEPS)
+        product_id, product_slug = rng.choice(config['products'])
+        picks = {
+            'product_id': product_id, 'product_slug': product_slug,
+            'category_slug': rng.choice(config['categories']), 'query': rng.choice(config['queries']),
+        }
+        return step['name'], loadtest.fill(step['path'], picks)
+
+    def record(self, report, config, name, status, elapsed):
+        # Count what finishes inside the measured window; requests still in
+        # flight at the deadline would otherwise be added as free throughput
+        if not config['measure_from'] <= time.monotonic() <= config['deadline']:
+            return
+        with self.lock:
+            stats = report.step(name)
+            stats.latencies.append(elapsed)
+            stats.statuses[status] += 1
+            if status >= 400:
+                stats.errors += 1
+
+    def print_table(self, results):
+        columns = ['requests', 'rps', 'error_rate', 'p50_ms', 'p95_ms', 'p99_ms']
+        names = list(results['sync']['endpoints'])
+        width = max(len(name) for name in names) + 8
+        self.stdout.write(f'{"endpoint":<{width}}  ' + '  '.join(f'{column:>10}' for column in columns))
+        for name in names:
+            for mode, result in results.items():
+                figures = result['endpoints'].get(name)
+                if figures:
+                    self.stdout.write(f'{name + " " + mode:<{width}}  ' +
+                                      '  '.join(f'{figures[column]:>10g}' for column in columns))
+        for mode, result in results.items():
+            self.stdout.write(f'peak threads {mode}: {result["peak_threads"]}')
+        sync, async_ = results['sync']['endpoints']['total'], results['async']['endpoints']['total']
+        if sync['rps']:
+            self.stdout.write(f'async vs sync: {(async_["rps"] - sync["rps"]) / sync["rps"] * 100:+.0f}% req/s, '
+                              f'p99 {async_["p99_ms"]:g} ms vs {sync["p99_ms"]:g} ms')
+
+
+class ThreadCount:
+    """Peak number of live threads while in the with block."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+
+    def __enter__(self):
+        self.done = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        return self
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count() - 1)  # less this one
+
+    def __exit__(self, *exc_info):
+        self.done.set()
+        self.sampler.join()
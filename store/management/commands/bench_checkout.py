@@ -0,0 +1,138 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, override_settings
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
+import json
+import statistics
+import time
+import uuid
+
+import razorpay
+
+from store import views
+from store.fake_gateway import FakeRazorpayServer
+from store.models import Category, Product, Address, Cart, CartItem, Order
+
+KEY_ID = 'rzp_test_bench'
+KEY_SECRET = 'bench_secret'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark Razorpay checkout end to end against a local fake gateway'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=200, help='Total checkouts to run')
+        parser.add_argument('--threads', type=int, default=4, help='Concurrent shoppers')
+        parser.add_argument('--latency', type=float, default=0.0, help='Simulated gateway latency in seconds')
+        parser.add_argument('--unpooled', action='store_true',
+                            help='Also run with a new razorpay.Client per request for comparison')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        self.seed(tag, options['threads'])
+        try:
+            with FakeRazorpayServer(KEY_ID, KEY_SECRET, latency=options['latency']) as gateway:
+                with override_settings(
+                    RAZORPAY_KEY_ID=KEY_ID,
+                    RAZORPAY_KEY_SECRET=KEY_SECRET,
+                    RAZORPAY_API_BASE_URL=gateway.url,
+                    ALLOWED_HOSTS=['testserver'],
+                ):
+                    self.stdout.write('Pooled client:')
+                    self.run(gateway, options)
+
+                    if options['unpooled']:
+                        def new_client():
+                            return razorpay.Client(auth=(KEY_ID, KEY_SECRET), base_url=gateway.url)
+
+                        self.stdout.write('New client per request:')
+                        with mock.patch.object(views, 'get_razorpay_client', new_client):
+                            self.run(gateway, options)
+        finally:
+            self.cleanup()
+
+    def seed(self, tag, shoppers):
+        self.category = Category.objects.create(name=f'Bench {tag}', slug=f'bench-{tag}')
+        self.product = Product.objects.create(
+            name=f'Bench Phone {tag}', slug=f'bench-phone-{tag}', category=self.category,
+            description='Benchmark product', price=Decimal('19999'), stock=10 ** 9,
+        )
+        self.users = []
+        for i in range(shoppers):
+            user = User.objects.create_user(f'bench_checkout_{tag}_{i}', password='bench')
+            Cart.objects.create(user=user)
+            address = Address.objects.create(
+                user=user, full_name='Bench Shopper', phone='9999999999',
+                address_line1='1 Bench Street', city='Bengaluru', state='Karnataka', pincode='560001',
+            )
+            self.users.append((user, address))
+
+    def cleanup(self):
+        for user, _ in self.users:
+            user.delete()
+        self.product.delete()
+        self.category.delete()
+
+    def wait_until_confirmed(self, order_id, timeout=5):
+        # Payment confirmation is finalized in the background and clears the
+        # cart; wait for it like the success page would before shopping again.
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if Order.objects.filter(pk=order_id, payment_status='completed').exists():
+                return
+            time.sleep(0.005)
+
+    def run(self, gateway, options):
+        per_shopper = max(1, options['checkouts'] // len(self.users))
+
+        def shopper(slot):
+            user, address = self.users[slot]
+            client = Client()
+            client.force_login(user)
+            cart = Cart.objects.get(user=user)
+            latencies, failures = [], 0
+            try:
+                for _ in range(per_shopper):
+                    CartItem.objects.get_or_create(cart=cart, product=self.product)
+                    start = time.perf_counter()
+                    response = client.post('/checkout/', {
+                        'address_id': address.id,
+                        'payment_method': 'razorpay',
+                    })
+                    if response.status_code != 200:
+                        failures += 1
+                        continue
+                    created = response.json()
+                    payment = gateway.pay(created['razorpay_order_id'])
+                    payment['order_id'] = created['order_id']
+                    response = client.post('/verify-payment/', json.dumps(payment), content_type='application/json')
+                    if response.status_code != 200 or response.json().get('status') != 'ok':
+                        failures += 1
+                        continue
+                    latencies.append(time.perf_counter() - start)
+                    self.wait_until_confirmed(created['order_id'])
+            finally:
+                connection.close()
+            return latencies, failures
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(self.users)) as pool:
+            results = list(pool.map(shopper, range(len(self.users))))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(l for result, _ in results for l in result)
+        failures = sum(f for _, f in results)
+        if not latencies:
+            self.stdout.write(self.style.ERROR(f'  All {failures} checkouts failed'))
+            return
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f'  {len(latencies)} checkouts ({failures} failed) in {elapsed:.2f}s: '
+            f'{len(latencies) / elapsed:.1f} checkouts/s, '
+            f'p50 {statistics.median(latencies) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms'
+        )
+        paid = Order.objects.filter(user__in=[u for u, _ in self.users], payment_status='completed').count()
+        self.stdout.write(f'  {paid} orders confirmed so far')
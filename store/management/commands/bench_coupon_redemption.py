@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, OperationalError
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+import time
+import uuid
+
+from store.models import Coupon
+from store.coupons import redeem_coupon
+
+
+class Command(BaseCommand):
+    help = 'Benchmark many concurrent checkouts redeeming a single coupon code'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent checkout workers')
+        parser.add_argument('--attempts', type=int, default=500, help='Total redemption attempts')
+        parser.add_argument('--limit', type=int, default=200, help='Coupon usage_limit')
+        parser.add_argument('--naive', action='store_true',
+                            help='Also run the old read-modify-write increment for comparison')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench_coupon_user')
+
+        self.stdout.write('Running ledger redemption...')
+        self.run(user, options, self.redeem_ledger)
+
+        if options['naive']:
+            self.stdout.write('Running naive used_count += 1 / save()...')
+            self.run(user, options, self.redeem_naive)
+
+    def run(self, user, options, redeem):
+        coupon = Coupon.objects.create(
+            code=f'BENCH-{uuid.uuid4().hex[:8].upper()}',
+            discount_type='fixed',
+            discount_value=Decimal('100'),
+            valid_from=timezone.now() - timedelta(minutes=1),
+            valid_to=timezone.now() + timedelta(days=1),
+            usage_limit=options['limit'],
+        )
+
+        def worker(_):
+            try:
+                return 'ok' if redeem(coupon.pk, user) else 'rejected'
+            except OperationalError:
+                return 'error'
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            results = list(pool.map(worker, range(options['attempts'])))
+        elapsed = time.perf_counter() - start
+
+        coupon.refresh_from_db()
+        succeeded = results.count('ok')
+        self.stdout.write(
+            f'  {options["attempts"]} attempts on {options["threads"]} threads in {elapsed:.3f}s '
+            f'({options["attempts"] / elapsed:.0f} attempts/s)'
+        )
+        self.stdout.write(
+            f'  succeeded={succeeded} rejected={results.count("rejected")} errors={results.count("error")} '
+            f'used_count={coupon.used_count} usage_limit={coupon.usage_limit}'
+        )
+        if succeeded > coupon.usage_limit or coupon.used_count != succeeded:
+            self.stdout.write(self.style.ERROR('  Oversubscribed or lost updates detected!'))
+        else:
+            self.stdout.write(self.style.SUCCESS('  No oversubscription, no lost updates.'))
+        coupon.delete()
+
+    @staticmethod
+    def redeem_ledger(coupon_id, user):
+        return redeem_coupon(Coupon.objects.get(pk=coupon_id), user)
+
+    @staticmethod
+    def redeem_naive(coupon_id, user):
+        coupon = Coupon.objects.get(pk=coupon_id)
+        if not coupon.is_valid():
+            return False
+        coupon.used_count += 1
+        coupon.save()
+        return True
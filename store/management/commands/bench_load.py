@@ -0,0 +1,137 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db.models import Min
+from django.test import override_settings
+import json
+import threading
+
+from store import loadtest
+from store.models import Address
+
+# Figures printed per endpoint
+COLUMNS = ['requests', 'rps', 'error_rate', 'p50_ms', 'p95_ms', 'p99_ms']
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ('Drive the site with virtual shoppers replaying journeys (browse, buy with COD) and report '
+            'latency percentiles, throughput and error rate per endpoint. Uses the generate_data users.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds to measure')
+        parser.add_argument('--warmup', type=float, default=5.0, help='Seconds to run before measuring')
+        parser.add_argument('--shoppers', type=int, default=8, help='Concurrent shoppers (threads) in total')
+        parser.add_argument('--processes', type=int, default=1, help='Spread the shoppers over this many processes')
+        parser.add_argument('--think', type=float, default=0.0, help='Mean pause between requests, in seconds')
+        parser.add_argument('--journey', action='append', metavar='NAME[:WEIGHT]',
+                            help='Journey to run, optionally reweighted (repeatable); all by default')
+        parser.add_argument('--journeys-file', help='JSON file of extra journeys (see store/loadtest.py)')
+        transport = parser.add_mutually_exclusive_group()
+        transport.add_argument('--url', help='Send HTTP to a running server at this base URL')
+        transport.add_argument('--serve', action='store_true',
+                               help='Start a threaded WSGI server on a local port and send HTTP to it')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save', metavar='PATH', help='Write the results as JSON')
+        parser.add_argument('--compare', metavar='PATH', help='Show changes against results saved with --save')
+
+    def handle(self, *args, **options):
+        if options['shoppers'] < 1 or options['processes'] < 1:
+            raise CommandError('--shoppers and --processes must be at least 1')
+        journeys = self.journeys(options)
+        config = {
+            'journeys': journeys, 'think': options['think'], 'seed': options['seed'],
+            'duration': options['duration'], 'warmup': options['warmup'], 'url': options['url'],
+            **self.picks(),
+        }
+        shoppers = self.shoppers(options['shoppers'])
+        baseline = self.load(options['compare']) if options['compare'] else None
+
+        # The test client sends Host: testserver; --serve uses 127.0.0.1
+        with override_settings(ALLOWED_HOSTS=['testserver', '127.0.0.1', 'localhost']):
+            if options['serve']:
+                server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+                server.set_app(get_wsgi_application())
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                config['url'] = f'http://127.0.0.1:{server.server_address[1]}'
+            try:
+                self.stdout.write(f'{len(shoppers)} shoppers in {options["processes"]} process(es), '
+                                  f'{"HTTP to " + config["url"] if config["url"] else "in-process"}, '
+                                  f'{options["warmup"]:g}s warm-up + {options["duration"]:g}s')
+                report = loadtest.run(config, shoppers, processes=options['processes'])
+            finally:
+                if options['serve']:
+                    server.shutdown()
+                    server.server_close()
+
+        results = {
+            'options': {key: options[key] for key in
+                        ('duration', 'warmup', 'shoppers', 'processes', 'think', 'seed', 'url', 'serve')},
+            'journeys': {name: journey['weight'] for name, journey in journeys.items()},
+            'endpoints': report.summary(),
+        }
+        self.print_table(results['endpoints'], baseline and baseline['endpoints'])
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Saved to {options["save"]}')
+
+    def journeys(self, options):
+        available = dict(loadtest.JOURNEYS)
+        if options['journeys_file']:
+            available.update(self.load(options['journeys_file']))
+        if not options['journey']:
+            return available
+        chosen = {}
+        for spec in options['journey']:
+            name, _, weight = spec.partition(':')
+            if name not in available:
+                raise CommandError(f'Unknown journey {name!r}; choose from {", ".join(sorted(available))}')
+            chosen[name] = {**available[name], 'weight': float(weight) if weight else available[name]['weight']}
+        return chosen
+
+    def picks(self):
+        """Products, categories and search terms the journeys fill in."""
+        picks = loadtest.catalog_picks()
+        if not picks['products']:
+            raise CommandError('No products in stock; run generate_data first')
+        return picks
+
+    def shoppers(self, count):
+        """[(user id, address id)] for count generate_data users."""
+        addresses = list(
+            Address.objects.filter(user__username__startswith='loadtest', user__cart__isnull=False)
+            .values('user_id').annotate(address_id=Min('id')).order_by('user_id')
+            .values_list('user_id', 'address_id')[:count]
+        )
+        if len(addresses) < count:
+            raise CommandError(f'Need {count} load test users with an address and a cart, found {len(addresses)}; '
+                               f'run generate_data --users {count}')
+        return addresses
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read {path}: {e}')
+
+    def print_table(self, endpoints, baseline=None):
+        width = max(len(name) for name in endpoints)
+        self.stdout.write(f'{"endpoint":<{width}}  ' + '  '.join(f'{column:>10}' for column in COLUMNS))
+        for name, figures in endpoints.items():
+            self.stdout.write(f'{name:<{width}}  ' + '  '.join(f'{figures[column]:>10g}' for column in COLUMNS))
+            if baseline and name in baseline:
+                self.stdout.write(f'{"  vs baseline":<{width}}  ' + '  '.join(
+                    f'{self.change(baseline[name][column], figures[column]):>10}' for column in COLUMNS))
+            for sample in figures.get('error_samples', []):
+                self.stdout.write(self.style.ERROR(f'  {sample}'))
+
+    def change(self, before, after):
+        if not before:
+            return '-' if not after else 'new'
+        return f'{(after - before) / before * 100:+.0f}%'
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.core.mail import get_connection, send_mail
+import time
+
+from store.emails import enqueue_email, deliver_outbox
+from store.fake_smtp import LocalSMTPServer
+from store.models import OutboxEmail
+
+SMTP_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+
+class Command(BaseCommand):
+    help = 'Compare inline send_mail with the batched outbox sender against a local SMTP server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200)
+        parser.add_argument('--handshake-delay', type=float, default=0.05,
+                            help='Seconds the local SMTP server waits before its greeting')
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        with LocalSMTPServer(handshake_delay=options['handshake_delay']) as smtp:
+            def connection(**kwargs):
+                return get_connection(SMTP_BACKEND, host=smtp.host, port=smtp.port, use_tls=False,
+                                      username='', password='', **kwargs)
+
+            self.stdout.write('Inline send_mail (one SMTP session per message):')
+            start = time.perf_counter()
+            for i in range(count):
+                send_mail(f'Inline {i}', 'Benchmark', 'bench@flugede.com', ['shopper@example.com'],
+                          connection=connection())
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'  {count} messages in {elapsed:.2f}s '
+                              f'({elapsed / count * 1000:.2f}ms per request), {smtp.connections} connections')
+
+            self.stdout.write('Outbox (enqueue in the request, batched sender):')
+            smtp.connections = 0
+            start = time.perf_counter()
+            ids = [
+                enqueue_email(f'Queued {i}', 'Benchmark', ['shopper@example.com'], from_email='bench@flugede.com').id
+                for i in range(count)
+            ]
+            enqueued = time.perf_counter() - start
+
+            start = time.perf_counter()
+            sent, failed = deliver_outbox(connection=connection())
+            delivered = time.perf_counter() - start
+            self.stdout.write(f'  enqueue: {enqueued / count * 1000:.3f}ms per request')
+            self.stdout.write(f'  delivery: {sent} sent, {failed} failed in {delivered:.2f}s, '
+                              f'{smtp.connections} connections')
+
+            OutboxEmail.objects.filter(id__in=ids).delete()
@@ -0,0 +1,111 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, override_settings
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import hashlib
+import hmac
+import json
+import time
+import uuid
+
+from store.models import Order, OrderStatusHistory, PaymentEvent
+from store.payments import payment_signature
+
+KEY_SECRET = 'bench_secret'
+WEBHOOK_SECRET = 'bench_webhook_secret'
+
+
+class Command(BaseCommand):
+    help = 'Fire bursts of duplicate payment confirmations and webhooks and check exactly-once finalization'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=100, help='Orders to confirm')
+        parser.add_argument('--duplicates', type=int, default=4,
+                            help='Confirmations per payment (half frontend, half webhook)')
+        parser.add_argument('--threads', type=int, default=8)
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(f'bench_payments_{tag}', password='bench')
+        orders = [
+            Order.objects.create(
+                user=user, subtotal=Decimal('1000'), total=Decimal('1230'), payment_method='razorpay',
+                razorpay_order_id=f'order_{tag}{i:06d}',
+            )
+            for i in range(options['orders'])
+        ]
+
+        requests = []
+        for order in orders:
+            payment_id = f'pay_{uuid.uuid4().hex[:14]}'
+            for n in range(options['duplicates']):
+                requests.append((n % 2 == 0, order.razorpay_order_id, payment_id))
+
+        def send(request):
+            frontend, razorpay_order_id, razorpay_payment_id = request
+            client = Client()
+            try:
+                start = time.perf_counter()
+                if frontend:
+                    body = json.dumps({
+                        'razorpay_order_id': razorpay_order_id,
+                        'razorpay_payment_id': razorpay_payment_id,
+                        'razorpay_signature': payment_signature(razorpay_order_id, razorpay_payment_id, KEY_SECRET),
+                    })
+                    response = client.post('/verify-payment/', body, content_type='application/json')
+                else:
+                    body = json.dumps({
+                        'event': 'payment.captured',
+                        'payload': {'payment': {'entity': {'id': razorpay_payment_id, 'order_id': razorpay_order_id}}},
+                    }).encode()
+                    signature = hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+                    response = client.post('/razorpay/webhook/', body, content_type='application/json',
+                                           headers={'X-Razorpay-Signature': signature})
+                return response.status_code, time.perf_counter() - start
+            finally:
+                connection.close()
+
+        try:
+            with override_settings(
+                RAZORPAY_KEY_ID='rzp_test_bench',
+                RAZORPAY_KEY_SECRET=KEY_SECRET,
+                RAZORPAY_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                ALLOWED_HOSTS=['testserver'],
+            ):
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                    results = list(pool.map(send, requests))
+                acked = time.perf_counter() - start
+
+                ids = [o.razorpay_order_id for o in orders]
+                events = PaymentEvent.objects.filter(razorpay_order_id__in=ids)
+                while events.filter(status__in=['pending', 'processing']).exists():
+                    time.sleep(0.05)
+                finished = time.perf_counter() - start
+
+            latencies = sorted(latency for _, latency in results)
+            statuses = [status for status, _ in results]
+            self.stdout.write(
+                f'{len(requests)} confirmations acknowledged in {acked:.2f}s '
+                f'({len(requests) / acked:.0f}/s, p50 {latencies[len(latencies) // 2] * 1000:.1f}ms), '
+                f'all finalized after {finished:.2f}s'
+            )
+            self.stdout.write(f'  non-200 responses: {sum(1 for s in statuses if s != 200)}')
+            for status, error in events.exclude(status='processed').values_list('status', 'last_error')[:5]:
+                self.stdout.write(f'  {status}: {error}')
+
+            confirmations = OrderStatusHistory.objects.filter(order__in=orders, status='confirmed').count()
+            completed = Order.objects.filter(pk__in=[o.pk for o in orders], payment_status='completed').count()
+            self.stdout.write(
+                f'  events stored={events.count()} completed orders={completed} '
+                f'confirmation history rows={confirmations} (expected {len(orders)} each)'
+            )
+            if events.count() == completed == confirmations == len(orders):
+                self.stdout.write(self.style.SUCCESS('  Exactly-once finalization held.'))
+            else:
+                self.stdout.write(self.style.ERROR('  Duplicate or missing finalization detected!'))
+        finally:
+            PaymentEvent.objects.filter(razorpay_order_id__startswith=f'order_{tag}').delete()
+            user.delete()
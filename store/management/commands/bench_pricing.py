@@ -0,0 +1,128 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import transaction
+from decimal import Decimal
+import random
+import time
+
+from store.models import Category, Product, Cart, CartItem, Order, OrderItem
+from store.pricing import price_cart, price_order, reprice_carts, reprice_orders
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark per-object vs batch pricing of carts and orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=2000, help='Number of carts to price')
+        parser.add_argument('--orders', type=int, default=2000, help='Number of orders to price')
+        parser.add_argument('--products', type=int, default=200, help='Catalog size')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        # Everything runs inside a transaction that is rolled back at the end,
+        # so the benchmark leaves no data behind.
+        try:
+            with transaction.atomic():
+                self.seed(options)
+                self.bench_carts()
+                self.bench_orders()
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        self.stdout.write('Seeding benchmark data...')
+
+        category = Category.objects.create(name='Bench Category', slug='bench-category')
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Bench Product {i}',
+                slug=f'bench-product-{i}',
+                category=category,
+                description='Benchmark product',
+                price=Decimal(rng.randint(100, 150000)),
+                discount_price=Decimal(rng.randint(50, 99)) if rng.random() < 0.5 else None,
+                stock=100,
+            )
+            for i in range(options['products'])
+        ])
+
+        users = User.objects.bulk_create([
+            User(username=f'bench_pricing_{i}')
+            for i in range(max(options['carts'], 1))
+        ])
+
+        carts = Cart.objects.bulk_create([Cart(user=user) for user in users[:options['carts']]])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=rng.randint(1, 3))
+            for cart in carts
+            for product in rng.sample(products, rng.randint(1, 5))
+        ])
+        self.cart_ids = [cart.id for cart in carts]
+
+        orders = Order.objects.bulk_create([
+            Order(
+                order_number=f'BENCH{i:012d}',
+                user=users[i % len(users)],
+                subtotal=0,
+                total=0,
+                payment_method='cod',
+            )
+            for i in range(options['orders'])
+        ])
+        items = []
+        for order in orders:
+            for product in rng.sample(products, rng.randint(1, 5)):
+                quantity = rng.randint(1, 3)
+                items.append(OrderItem(
+                    order=order,
+                    product=product,
+                    product_name=product.name,
+                    product_price=product.final_price,
+                    quantity=quantity,
+                    total_price=product.final_price * quantity,
+                ))
+        OrderItem.objects.bulk_create(items)
+        self.order_ids = [order.id for order in orders]
+
+    def report(self, label, count, elapsed):
+        self.stdout.write(f'  {label:<28} {count:>7} in {elapsed:8.3f}s  {count / elapsed:>10.0f}/s')
+
+    def bench_carts(self):
+        self.stdout.write('Carts:')
+
+        start = time.perf_counter()
+        per_object = {cart.id: price_cart(cart) for cart in Cart.objects.filter(id__in=self.cart_ids)}
+        self.report('per-object price_cart', len(per_object), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        batch = reprice_carts(self.cart_ids)
+        self.report('batch reprice_carts', len(batch), time.perf_counter() - start)
+
+        if per_object != batch:
+            raise CommandError('Batch cart pricing does not match per-object pricing')
+
+    def bench_orders(self):
+        self.stdout.write('Orders:')
+        orders = Order.objects.filter(id__in=self.order_ids)
+
+        start = time.perf_counter()
+        per_object = {order.id: price_order(order) for order in orders.select_related('coupon')}
+        self.report('per-object price_order', len(per_object), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        batch = reprice_orders(orders)
+        self.report('batch reprice_orders', len(batch), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        reprice_orders(orders, save=True)
+        self.report('batch reprice_orders(save)', len(batch), time.perf_counter() - start)
+
+        if per_object != batch:
+            raise CommandError('Batch order pricing does not match per-object pricing')
+        self.stdout.write(self.style.SUCCESS('Batch results match per-object results exactly.'))
@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from store.models import Product
+
+PROFILES = {
+    'development': {},
+    'production': settings.SQLITE_PRODUCTION,
+}
+
+
+class Command(BaseCommand):
+    help = ('Benchmark concurrent catalog reads and stock writes on a copy of the SQLite database, '
+            'with the development and production database profiles')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=10.0, help='How long to run each profile')
+        parser.add_argument('--readers', type=int, default=8, help='Threads serving catalog pages')
+        parser.add_argument('--writers', type=int, default=4, help='Threads placing orders (read then update stock)')
+        parser.add_argument('--profile', choices=sorted(PROFILES), action='append',
+                            help='Profile to run (repeatable); both by default')
+
+    def handle(self, *args, **options):
+        source = connections['default'].settings_dict
+        if source['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('bench_sqlite only runs against a SQLite database')
+        self.product_ids = list(Product.objects.filter(is_active=True).values_list('id', flat=True)[:10000])
+        self.category_ids = list(Product.objects.values_list('category_id', flat=True).distinct()[:1000])
+        if not self.product_ids:
+            raise CommandError('No products to work with; run generate_data first')
+        connections['default'].close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            for name in options['profile'] or sorted(PROFILES):
+                path = os.path.join(directory, f'{name}.sqlite3')
+                self.copy_database(source['NAME'], path)
+                alias = f'bench_{name}'
+                connections.settings[alias] = connections.configure_settings({
+                    'default': copy.deepcopy(source),
+                    alias: {'ENGINE': source['ENGINE'], 'NAME': path, **copy.deepcopy(PROFILES[name])},
+                })[alias]
+                try:
+                    self.stdout.write(f'{name}:')
+                    self.run(alias, options)
+                finally:
+                    del connections.settings[alias]
+
+    def copy_database(self, source, target):
+        with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+            src.backup(dst)
+            # Start each profile from a rollback journal; production switches to WAL itself
+            dst.execute('PRAGMA journal_mode=DELETE')
+        src.close()
+        dst.close()
+
+    def run(self, alias, options):
+        deadline = time.monotonic() + options['seconds']
+        products = Product.objects.using(alias)
+
+        def request(body):
+            # One request: run it, then close the connection the way
+            # request_finished does (kept open only with CONN_MAX_AGE)
+            start = time.perf_counter()
+            try:
+                body()
+                return time.perf_counter() - start, None
+            except OperationalError as e:
+                return time.perf_counter() - start, str(e)
+            finally:
+                connections[alias].close_if_unusable_or_obsolete()
+
+        def browse():
+            category_id = random.choice(self.category_ids)
+            page = products.filter(category_id=category_id, is_active=True).order_by('-created_at')
+            page.count()
+            list(page.values('id', 'name', 'price', 'stock')[:20])
+
+        def order():
+            product_ids = random.sample(self.product_ids, min(2, len(self.product_ids)))
+            with transaction.atomic(using=alias):
+                list(products.filter(id__in=product_ids).values_list('id', 'stock'))
+                for product_id in product_ids:
+                    products.filter(id=product_id).update(stock=F('stock') - 1, updated_at=timezone.now())
+
+        def worker(body):
+            latencies, errors = [], []
+            try:
+                while time.monotonic() < deadline:
+                    latency, error = request(body)
+                    (errors if error else latencies).append(error or latency)
+            finally:
+                connections[alias].close()
+            return latencies, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['readers'] + options['writers']) as pool:
+            reads = [pool.submit(worker, browse) for _ in range(options['readers'])]
+            writes = [pool.submit(worker, order) for _ in range(options['writers'])]
+            results = {'reads': [f.result() for f in reads], 'writes': [f.result() for f in writes]}
+        elapsed = time.perf_counter() - start
+
+        for kind, result in results.items():
+            latencies = sorted(latency for done, _ in result for latency in done)
+            errors = [error for _, failed in result for error in failed]
+            line = f'  {kind}: {len(latencies) / elapsed:.1f}/s'
+            if latencies:
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                line += f', p50 {statistics.median(latencies) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms'
+            if errors:
+                line += f', {len(errors)} failed ({max(set(errors), key=errors.count)})'
+            self.stdout.write(line)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from store.fake_gateway import FakeRazorpayServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake Razorpay Orders API for offline development and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--key-id', default='rzp_test_fake')
+        parser.add_argument('--key-secret', default='fake_secret')
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds of simulated latency per call')
+
+    def handle(self, *args, **options):
+        server = FakeRazorpayServer(
+            options['key_id'], options['key_secret'],
+            host=options['host'], port=options['port'], latency=options['latency'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Fake Razorpay listening on {server.url}'))
+        self.stdout.write('Point the store at it with:')
+        self.stdout.write(f'  RAZORPAY_API_BASE_URL={server.url}')
+        self.stdout.write(f'  RAZORPAY_KEY_ID={options["key_id"]}')
+        self.stdout.write(f'  RAZORPAY_KEY_SECRET={options["key_secret"]}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from store.forecasting import HALF_LIFE_DAYS, WINDOW_DAYS, forecast_stock
+
+
+class Command(BaseCommand):
+    help = 'Recompute every product\'s sales velocity and days until stock-out from recent orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=WINDOW_DAYS, help='Days of order history to read')
+        parser.add_argument('--half-life', type=float, default=HALF_LIFE_DAYS,
+                            help='Days after which a sale counts half as much')
+
+    def handle(self, *args, **options):
+        if options['window'] < 1 or options['half_life'] <= 0:
+            raise CommandError('--window and --half-life must be positive')
+        start = time.perf_counter()
+        lines, updated = forecast_stock(window=options['window'], half_life=options['half_life'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {lines} order line(s), updated {updated} product forecast(s) in {elapsed:.2f}s'
+        ))
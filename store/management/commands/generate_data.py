@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+import os
+import time
+
+from store.synthetic import CHUNK_SIZE, LOAD_TEST_PASSWORD, generate, make_plan
+
+
+class Command(BaseCommand):
+    help = 'Append a deterministic synthetic data set (catalog, customers, orders) at load-testing scale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--categories', type=int, default=None, help='Default: one per 1000 products, at least 10')
+        parser.add_argument('--brands', type=int, default=None, help='Default: one per 200 products, at least 20')
+        parser.add_argument('--days', type=int, default=365, help='Spread orders over this many past days')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows of each kind per transaction')
+        parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                            help='Processes building rows in parallel (inserts stay in this process)')
+
+    def handle(self, *args, **options):
+        if min(options['products'], options['users'], options['days'], options['chunk_size']) < 1:
+            raise CommandError('--products, --users, --days and --chunk-size must be positive')
+
+        plan = make_plan(
+            seed=options['seed'], products=options['products'], users=options['users'], orders=options['orders'],
+            categories=options['categories'], brands=options['brands'], days=options['days'],
+        )
+        totals = {'products': plan.products, 'users': plan.users, 'orders': plan.orders}
+        started = time.perf_counter()
+        inserted = 0
+
+        def progress(kind, done, rows):
+            nonlocal inserted
+            inserted += rows
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'  {kind}: {done}/{totals[kind]}  ({inserted} rows, {inserted / elapsed:,.0f} rows/s)')
+
+        counts = generate(plan, chunk_size=options['chunk_size'], workers=options['workers'], progress=progress)
+
+        if connection.vendor in ('sqlite', 'postgresql'):
+            # Fresh statistics for the planner and the admin's row estimates
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        for name, rows in counts.items():
+            self.stdout.write(f'{name:>22}: {rows}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Inserted {total} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s); '
+            f'users log in as loadtest<id> / {LOAD_TEST_PASSWORD}'
+        ))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import time
+
+from store.catalog_import import CHUNK_SIZE, IMAGE_WORKERS, CatalogImporter
+
+
+class Command(BaseCommand):
+    help = 'Create or update products (with specifications and images) from a CSV or JSON Lines file, by slug'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file, e.g. a product export')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Default: from the file extension')
+        parser.add_argument('--images-dir', help='Directory image paths are relative to (default: the file\'s directory)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Records per transaction')
+        parser.add_argument('--image-workers', type=int, default=IMAGE_WORKERS, help='Threads processing images')
+        parser.add_argument('--state-file', help='Where progress is saved (default: <path>.import-state)')
+        parser.add_argument('--restart', action='store_true', help='Ignore saved progress and start from the top')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        state_file = options['state_file'] or f'{path}.import-state'
+
+        state = None
+        if os.path.exists(state_file) and not options['restart']:
+            with open(state_file) as f:
+                state = json.load(f)
+            self.stdout.write(f'Resuming after record {state["records"]}')
+
+        def checkpoint(state):
+            if state is None:
+                if os.path.exists(state_file):
+                    os.remove(state_file)
+                return
+            with open(state_file + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(state_file + '.tmp', state_file)
+            self.stdout.write(f'  {state["records"]} records')
+
+        importer = CatalogImporter(
+            images_dir=options['images_dir'] or os.path.dirname(os.path.abspath(path)),
+            chunk_size=options['chunk_size'], image_workers=options['image_workers'],
+        )
+        start = time.perf_counter()
+        try:
+            stats = importer.run(path, fmt, state=state, checkpoint=checkpoint)
+        finally:
+            importer.close()
+        elapsed = time.perf_counter() - start
+
+        for number, message in stats.errors:
+            self.stderr.write(f'record {number}: {message}')
+        if stats.error_count > len(stats.errors):
+            self.stderr.write(f'... and {stats.error_count - len(stats.errors)} more errors')
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats.created} created, {stats.updated} updated, {stats.unchanged} unchanged, '
+            f'{stats.images} images, {stats.error_count} errors in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from store.payment_events import pending_events, process_payment_event
+
+
+class Command(BaseCommand):
+    help = 'Finalize payment events that were never processed, failed, or were abandoned by a worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help='Skip events that have already been tried this many times')
+
+    def handle(self, *args, **options):
+        event_ids = list(
+            pending_events().filter(attempts__lt=options['max_attempts']).values_list('id', flat=True)
+        )
+        self.stdout.write(f'Processing {len(event_ids)} payment events...')
+
+        results = {}
+        for event_id in event_ids:
+            status = process_payment_event(event_id) or 'skipped'
+            results[status] = results.get(status, 0) + 1
+
+        summary = ', '.join(f'{status}={count}' for status, count in sorted(results.items())) or 'nothing to do'
+        self.stdout.write(self.style.SUCCESS(f'Done: {summary}'))
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+import time
+
+from store.replicas import replicate
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database into the DATABASE_REPLICAS files (stand-in for replication)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep copying; the interval is the replication lag')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between copies with --loop')
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No replicas configured; set DATABASE_REPLICAS to a comma-separated list of files')
+        while True:
+            start = time.perf_counter()
+            for alias in settings.DATABASE_REPLICAS:
+                replicate(alias)
+            if options['verbosity'] > 1 or not options['loop']:
+                self.stdout.write(f'Copied to {len(settings.DATABASE_REPLICAS)} replica(s) '
+                                  f'in {time.perf_counter() - start:.2f}s')
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import date
+import time
+
+from store.rollups import BACKFILL_DAYS, backfill_rollups, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = ('Update the daily sales rollups for the orders changed since the last run (the first run builds '
+            'everything), or rebuild a date range with --backfill')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true', help='Rebuild rollups instead of applying queued changes')
+        parser.add_argument('--from', dest='start', help='First day to rebuild (YYYY-MM-DD); default: first order')
+        parser.add_argument('--to', dest='end', help='Last day to rebuild (YYYY-MM-DD); default: last order')
+        parser.add_argument('--chunk-days', type=int, default=BACKFILL_DAYS, help='Days rebuilt per transaction')
+
+    def parse_day(self, value):
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'Invalid date: {value}')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['backfill']:
+            days, rows = backfill_rollups(
+                self.parse_day(options['start']), self.parse_day(options['end']), chunk_days=options['chunk_days']
+            )
+            done = f'Recomputed {days} day(s)'
+        else:
+            changes, rows = refresh_rollups()
+            done = f'Applied {changes} queued change(s)'
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f'{done}, {rows} rollup row(s) in {elapsed:.2f}s'))
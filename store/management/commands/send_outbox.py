@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+import time
+
+from store.emails import BATCH_SIZE, deliver_outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued transactional emails in batches over one reused mail connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll for new mail')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = deliver_outbox(batch_size=options['batch_size'])
+            if sent or failed or not options['loop']:
+                self.stdout.write(f'Sent {sent} email(s), {failed} failed (will retry with backoff)')
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
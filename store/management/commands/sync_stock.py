@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+import os
+import shutil
+import time
+
+from store.stock import BATCH_SIZE, SyncStats, apply_feed, pending_feeds
+
+
+class Command(BaseCommand):
+    help = 'Apply warehouse stock feeds (absolute counts or deltas by product slug), or watch a drop directory for them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='CSV or JSONL feed files with slug and stock or delta columns')
+        parser.add_argument('--watch', metavar='DIR',
+                            help='Apply feeds dropped into DIR, moving them to DIR/processed or DIR/failed')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between checks with --watch')
+        parser.add_argument('--as-of', help='When absolute counts were taken (ISO 8601); orders placed since '
+                                            'are subtracted. A row\'s as_of column overrides it')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE * 4, help='Feed rows per batch of UPDATEs; a file is applied in one transaction')
+
+    def handle(self, *args, **options):
+        as_of = None
+        if options['as_of']:
+            as_of = parse_datetime(options['as_of'])
+            if as_of is None:
+                raise CommandError(f'Invalid --as-of: {options["as_of"]}')
+            if timezone.is_naive(as_of):
+                as_of = timezone.make_aware(as_of)
+        if not options['paths'] and not options['watch']:
+            raise CommandError('Give feed files or --watch DIR')
+
+        for path in options['paths']:
+            self.apply(path, as_of, options['batch_size'])
+
+        directory = options['watch']
+        if not directory:
+            return
+        for name in ('processed', 'failed'):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+        while True:
+            for path in pending_feeds(directory):
+                try:
+                    self.apply(path, as_of, options['batch_size'])
+                    target = 'processed'
+                except Exception as e:
+                    self.stderr.write(f'{path}: {e}')
+                    target = 'failed'
+                shutil.move(path, os.path.join(directory, target, os.path.basename(path)))
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def apply(self, path, as_of, batch_size):
+        start = time.perf_counter()
+        stats = apply_feed(path, as_of=as_of, batch_size=batch_size, stats=SyncStats())
+        elapsed = time.perf_counter() - start
+        for number, message in stats.errors:
+            self.stderr.write(f'{path} row {number}: {message}')
+        if stats.unknown_count:
+            self.stderr.write(f'{path}: {stats.unknown_count} unknown slug(s), e.g. {", ".join(stats.unknown[:5])}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{os.path.basename(path)}: {stats.rows} rows, {stats.set} set, {stats.adjusted} adjusted, '
+            f'{stats.error_count} errors in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.models import Order
+from store.orders import TRANSITIONS, allowed_sources, transition_orders
+
+
+class Command(BaseCommand):
+    help = 'Move many orders to a new status at once (e.g. mark a day of shipments as shipped)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('status', choices=list(TRANSITIONS), help='Status to move the orders to')
+        parser.add_argument('order_numbers', nargs='*', help='Order numbers to transition')
+        parser.add_argument('--file', help='Read order numbers from this file, one per line')
+        parser.add_argument('--from-status', help='Transition every order currently in this status')
+        parser.add_argument('--notes', default='', help='Note stored in the status history')
+        parser.add_argument('--no-email', action='store_true', help='Do not email customers')
+
+    def handle(self, *args, **options):
+        status = options['status']
+        order_numbers = list(options['order_numbers'])
+        if options['file']:
+            with open(options['file']) as f:
+                order_numbers += [line.strip() for line in f if line.strip()]
+
+        if options['from_status']:
+            orders = Order.objects.filter(order_status=options['from_status'])
+            if order_numbers:
+                orders = orders.filter(order_number__in=order_numbers)
+        elif order_numbers:
+            orders = Order.objects.filter(order_number__in=order_numbers)
+        else:
+            raise CommandError('Give order numbers, --file or --from-status')
+
+        changed, skipped = transition_orders(orders, status, notes=options['notes'], notify=not options['no_email'])
+
+        self.stdout.write(self.style.SUCCESS(f'{len(changed)} order(s) moved to {status}'))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'{len(skipped)} order(s) skipped; {status} is only reachable from: {", ".join(allowed_sources(status))}'
+            ))
+        if order_numbers:
+            missing = len(set(order_numbers)) - len(changed) - len(skipped)
+            if missing > 0:
+                self.stdout.write(self.style.WARNING(f'{missing} order number(s) not found'))
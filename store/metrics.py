@@ -0,0 +1,355 @@
+"""
+Runtime metrics in the Prometheus text format, served at /metrics.
+
+Counters and histograms are declared at the bottom of this module and
+updated where things happen:
+
+    CHECKOUTS.inc(payment_method='cod', outcome='placed')
+    REQUEST_DURATION.observe(0.042, view='product_list')
+
+Each process keeps its values in its own file, METRICS_DIR/<pid>.db,
+memory-mapped: an update is a dictionary lookup plus a read and a write of
+one double in the mapping, under a lock only this process's threads share.
+Processes never wait on each other. A scrape reads every file in the
+directory and adds them up, so any worker answers for the whole server.
+Files of workers that have exited keep counting towards the totals, as
+counters must; empty METRICS_DIR when the server is (re)started.
+
+A file is a used-bytes header followed by entries of (key length, key,
+padding to 8 bytes, float64 value). Entries are only ever appended, and the
+header is updated after the entry is written, so a reader always sees whole
+entries.
+"""
+import bisect
+import hmac
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_HEADER = struct.Struct('<I4x')  # bytes in use
+_KEY_LENGTH = struct.Struct('<I')
+_VALUE = struct.Struct('<d')
+INITIAL_FILE_SIZE = 1 << 16
+
+# Seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+def _entries(data):
+    """(key, value, value offset) for each entry in a metrics file."""
+    used = _HEADER.unpack_from(data, 0)[0]
+    position = _HEADER.size
+    while position < used:
+        length = _KEY_LENGTH.unpack_from(data, position)[0]
+        start = position + _KEY_LENGTH.size
+        key = bytes(data[start:start + length]).decode()
+        offset = start + length + (-(_KEY_LENGTH.size + length) % 8)
+        yield key, _VALUE.unpack_from(data, offset)[0], offset
+        position = offset + _VALUE.size
+
+
+class _ValueFile:
+    """This process's values. Callers hold _lock."""
+
+    def __init__(self, path):
+        self.file = open(path, 'a+b')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < INITIAL_FILE_SIZE:
+            self.file.truncate(INITIAL_FILE_SIZE)
+            size = INITIAL_FILE_SIZE
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.used = _HEADER.unpack_from(self.map, 0)[0] or _HEADER.size
+        self.offsets = {key: offset for key, _, offset in _entries(self.map)}
+
+    def add(self, key, amount):
+        offset = self.offsets.get(key)
+        if offset is None:
+            offset = self._append(key)
+        _VALUE.pack_into(self.map, offset, _VALUE.unpack_from(self.map, offset)[0] + amount)
+
+    def _append(self, key):
+        encoded = key.encode()
+        padding = -(_KEY_LENGTH.size + len(encoded)) % 8
+        end = self.used + _KEY_LENGTH.size + len(encoded) + padding + _VALUE.size
+        if end > len(self.map):
+            size = len(self.map)
+            while size < end:
+                size *= 2
+            self.file.truncate(size)
+            self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), size)
+        _KEY_LENGTH.pack_into(self.map, self.used, len(encoded))
+        start = self.used + _KEY_LENGTH.size
+        self.map[start:start + len(encoded)] = encoded
+        offset = start + len(encoded) + padding
+        _VALUE.pack_into(self.map, offset, 0.0)
+        self.used = end
+        _HEADER.pack_into(self.map, 0, self.used)
+        self.offsets[key] = offset
+        return offset
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+_lock = threading.Lock()
+_file = None
+
+
+def _add(key, amount):
+    global _file
+    with _lock:
+        if _file is None:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            _file = _ValueFile(os.path.join(settings.METRICS_DIR, f'{os.getpid()}.db'))
+        _file.add(key, amount)
+
+
+def reset():
+    """Close this process's file; the next update opens one in the current
+    METRICS_DIR."""
+    global _file
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
+
+
+def _after_fork():
+    # The child gets its own file; the lock may have been held mid-update
+    global _file, _lock
+    _file, _lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+_registry = []
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys = {}  # label values -> file key(s)
+        _registry.append(self)
+
+    def _label_pairs(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}, got {tuple(labels)}')
+        return [[name, str(labels[name])] for name in self.labelnames]
+
+    def _key(self, sample, pairs):
+        return json.dumps([sample, pairs])
+
+    def render(self, samples):
+        """Exposition lines, given {labels: value} for each sample name."""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        values = tuple(labels.get(name) for name in self.labelnames)
+        key = self._keys.get(values)
+        if key is None:
+            key = self._keys[values] = self._key(self.name, self._label_pairs(labels))
+        _add(key, amount)
+
+    def render(self, samples):
+        return [f'{self.name}{_format_labels(pairs)} {_format_value(value)}'
+                for pairs, value in sorted(samples.get(self.name, {}).items())]
+
+
+class Histogram(_Metric):
+    """Bucket counts are stored per bucket and made cumulative at scrape."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.bounds = [_format_value(float(bound)) for bound in self.buckets] + ['+Inf']
+
+    def observe(self, value, **labels):
+        values = tuple(labels.get(name) for name in self.labelnames)
+        keys = self._keys.get(values)
+        if keys is None:
+            pairs = self._label_pairs(labels)
+            keys = self._keys[values] = (
+                [self._key(f'{self.name}_bucket', pairs + [['le', bound]]) for bound in self.bounds],
+                self._key(f'{self.name}_sum', pairs),
+            )
+        buckets, sum_key = keys
+        _add(buckets[bisect.bisect_left(self.buckets, value)], 1)
+        _add(sum_key, value)
+
+    def render(self, samples):
+        lines = []
+        counts = defaultdict(dict)  # labels -> {le: count}
+        for pairs, value in samples.get(f'{self.name}_bucket', {}).items():
+            counts[pairs[:-1]][pairs[-1][1]] = value
+        sums = samples.get(f'{self.name}_sum', {})
+        for pairs in sorted(counts):
+            total = 0
+            for bound in self.bounds:
+                total += counts[pairs].get(bound, 0)
+                lines.append(f'{self.name}_bucket{_format_labels(pairs + (("le", bound),))} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(pairs)} {_format_value(total)}')
+            lines.append(f'{self.name}_sum{_format_labels(pairs)} {_format_value(sums.get(pairs, 0.0))}')
+        return lines
+
+
+def collect(directory=None):
+    """{sample name: {label pairs: value}} summed over every process's file."""
+    directory = directory or settings.METRICS_DIR
+    samples = defaultdict(lambda: defaultdict(float))
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith('.db')]
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:  # removed since listdir
+            continue
+        if len(data) < _HEADER.size:
+            continue
+        for key, value, _ in _entries(data):
+            sample, pairs = json.loads(key)
+            samples[sample][tuple(tuple(pair) for pair in pairs)] += value
+    return samples
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    samples = collect()
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.render(samples))
+    return '\n'.join(lines) + '\n'
+
+
+def scrape_allowed(request):
+    """Scrapers send METRICS_TOKEN as a bearer token. Without a token set,
+    only local scrapes are allowed, and only with DEBUG on: behind a proxy
+    on the same host every request comes from localhost."""
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        return hmac.compare_digest(request.headers.get('Authorization', ''), expected)
+    return settings.DEBUG and request.META.get('REMOTE_ADDR') in ('127.0.0.1', '::1')
+
+
+class _RequestCounts:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+
+
+_counts = ContextVar('metrics_request_counts', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    """Execute wrapper on every connection (see store/signals.py), counting
+    queries for the request being served in this context, in whichever
+    thread the ORM runs."""
+    counts = _counts.get()
+    if counts is not None:
+        counts.queries += 1
+    return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Count requests, their latency and their queries per URL name."""
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counts = _RequestCounts()
+        token = _counts.set(counts)
+        try:
+            response = self.get_response(request)
+        finally:
+            _counts.reset(token)
+        return self.record(request, response, counts)
+
+    async def __acall__(self, request):
+        counts = _RequestCounts()
+        token = _counts.set(counts)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _counts.reset(token)
+        return self.record(request, response, counts)
+
+    def record(self, request, response, counts):
+        elapsed = time.perf_counter() - counts.start
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        REQUESTS.inc(view=view, method=method, status=response.status_code)
+        REQUEST_DURATION.observe(elapsed, view=view)
+        if counts.queries:
+            DB_QUERIES.inc(counts.queries, view=view)
+        return response
+
+
+# Metrics
+
+REQUESTS = Counter('http_requests_total', 'Requests served, by URL name, method and status.',
+                   ['view', 'method', 'status'])
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time to produce a response, by URL name.', ['view'])
+DB_QUERIES = Counter('db_queries_total', 'Database queries run while serving requests, by URL name.', ['view'])
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'In-process cache lookups, by cache and hit or miss.',
+                        ['cache', 'result'])
+CHECKOUTS = Counter('checkouts_total', 'Checkout submissions, by payment method and outcome.',
+                    ['payment_method', 'outcome'])
+PAYMENT_VERIFICATIONS = Counter('payment_verifications_total',
+                                'Razorpay signature checks, by source and outcome.', ['source', 'outcome'])
+PAYMENT_EVENTS = Counter('payment_events_total', 'Payment events applied to orders, by final status.', ['status'])
+COUPON_REDEMPTIONS = Counter('coupon_redemptions_total', 'Coupon uses reserved, refused, given back and reclaimed.',
+                             ['outcome'])
+STOCK_OUTS = Counter('stock_outs_total', 'Times a product went from in stock to out of stock.')
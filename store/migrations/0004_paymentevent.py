@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-19 15:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_couponredemption_coupon_per_user_limit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('razorpay_payment_id', models.CharField(max_length=255, unique=True)),
+                ('razorpay_order_id', models.CharField(db_index=True, max_length=255)),
+                ('razorpay_signature', models.CharField(blank=True, max_length=255)),
+                ('source', models.CharField(choices=[('checkout', 'Checkout Confirmation'), ('callback', 'Razorpay Callback'), ('webhook', 'Razorpay Webhook')], max_length=20)),
+                ('event', models.CharField(default='payment.captured', max_length=50)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('processed', 'Processed'), ('failed', 'Failed'), ('ignored', 'Ignored')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
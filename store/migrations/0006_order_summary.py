@@ -0,0 +1,63 @@
+# Generated by Django 6.0 on 2026-10-19 15:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_order_summary(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    ProductImage = apps.get_model('store', 'ProductImage')
+    batch_size = 2000
+
+    last_id = 0
+    while True:
+        orders = list(Order.objects.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not orders:
+            return
+        last_id = orders[-1].id
+
+        items = {}
+        for order_id, product_id, quantity in OrderItem.objects.filter(
+            order_id__in=[o.id for o in orders]
+        ).order_by('id').values_list('order_id', 'product_id', 'quantity'):
+            items.setdefault(order_id, []).append((product_id, quantity))
+
+        product_ids = {pid for rows in items.values() for pid, _ in rows if pid}
+        images = {}
+        for product_id, image in ProductImage.objects.filter(
+            product_id__in=product_ids
+        ).order_by('-is_primary', 'created_at').values_list('product_id', 'image'):
+            images.setdefault(product_id, image)
+
+        for order in orders:
+            rows = items.get(order.id, [])
+            order.item_count = sum(quantity for _, quantity in rows)
+            order.thumbnail = next((images[pid] for pid, _ in rows if pid in images), '')
+        Order.objects.bulk_update(orders, ['item_count', 'thumbnail'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_outboxemail'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='thumbnail',
+            field=models.ImageField(blank=True, upload_to='products/'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_user_history_idx'),
+        ),
+        migrations.RunPython(backfill_order_summary, migrations.RunPython.noop),
+    ]
@@ -2,7 +2,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
-from decimal import Decimal
+from django.utils.functional import cached_property
 import random
 import string
 
@@ -53,11 +53,30 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
     warranty_period = models.CharField(max_length=100, blank=True)  # e.g., "1 Year", "2 Years"
+    # Filled in by the forecast_stock command (store.forecasting)
+    sales_velocity = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # units per day
+    days_until_stockout = models.PositiveIntegerField(null=True, blank=True)  # None: no recent sales
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    LOW_STOCK_DAYS = 14
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Storefront listings (home, product_list, related products). Partial,
+            # because SQLite matches the bare "is_active" term Django writes for
+            # is_active=True against an index condition but not an index column.
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='product_listing_idx'),
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True, is_featured=True),
+                         name='product_featured_idx'),
+            models.Index(fields=['price'], condition=models.Q(is_active=True), name='product_price_idx'),
+            models.Index(fields=['category', '-created_at'], condition=models.Q(is_active=True),
+                         name='product_category_idx'),
+            models.Index(fields=['brand', '-created_at'], condition=models.Q(is_active=True),
+                         name='product_brand_idx'),
+            models.Index(fields=['days_until_stockout'], name='product_stockout_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -76,11 +95,24 @@ class Product(models.Model):
     def is_in_stock(self):
         return self.stock > 0
 
+    @property
+    def days_of_stock(self):
+        """Days the current stock lasts at the forecast sales rate; None when
+        there were no recent sales."""
+        if self.stock <= 0:
+            return 0
+        if self.sales_velocity > 0:
+            return int(self.stock / self.sales_velocity)
+        return None
+
     @property
     def stock_status(self):
-        if self.stock == 0:
+        if self.stock <= 0:
             return 'Out of Stock'
-        elif self.stock < 10:
+        days = self.days_of_stock
+        if days is not None:
+            return 'Low Stock' if days < self.LOW_STOCK_DAYS else 'In Stock'
+        if self.stock < 10:
             return 'Low Stock'
         return 'In Stock'
 
@@ -167,24 +199,30 @@ class Cart(models.Model):
     def total_items(self):
         return sum(item.quantity for item in self.items.all())
 
+    @cached_property
+    def pricing(self):
+        """Priced totals for the cart, computed once per instance"""
+        from .pricing import price_cart
+        return price_cart(self)
+
     @property
     def subtotal(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.pricing.subtotal
 
     @property
     def tax(self):
         """Calculate 18% GST"""
-        return round(self.subtotal * Decimal('0.18'), 2)
+        return self.pricing.tax
 
     @property
     def shipping(self):
         """Free shipping for orders >= 500, else 50"""
-        return 0 if self.subtotal >= 500 else 50
+        return self.pricing.shipping
 
     @property
     def total(self):
         """Total = Subtotal + Tax + Shipping"""
-        return self.subtotal + self.tax + self.shipping
+        return self.pricing.total
 
 
 # Cart Item Model
@@ -229,6 +267,7 @@ class Coupon(models.Model):
     valid_from = models.DateTimeField()
     valid_to = models.DateTimeField()
     usage_limit = models.IntegerField(default=1)
+    per_user_limit = models.IntegerField(null=True, blank=True)  # None = no per-user cap
     used_count = models.IntegerField(default=0)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -243,8 +282,29 @@ class Coupon(models.Model):
                 self.used_count < self.usage_limit)
 
 
+# Coupon Redemption Ledger
+class CouponRedemption(models.Model):
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name='redemptions')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='coupon_redemptions')
+    order = models.ForeignKey('Order', on_delete=models.SET_NULL, null=True, blank=True, related_name='coupon_redemptions')
+    released_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.coupon.code} - {self.user.username}"
+
+    @property
+    def is_released(self):
+        return self.released_at is not None
+
+
 # Order Model
 class Order(models.Model):
+    is_archived = False
+
     ORDER_STATUS = (
         ('pending', 'Pending'),
         ('confirmed', 'Confirmed'),
@@ -300,16 +360,40 @@ class Order(models.Model):
     # Notes
     order_notes = models.TextField(blank=True)
     
+    # Summary (denormalized for order history)
+    item_count = models.PositiveIntegerField(default=0)
+    thumbnail = models.ImageField(upload_to='products/', blank=True)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_history_idx'),
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+            models.Index(fields=['updated_at'], name='order_updated_at_idx'),
+            models.Index(fields=['razorpay_order_id'], name='order_razorpay_order_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.order_number}"
 
+    def refresh_summary(self, save=True):
+        """Recompute item_count and thumbnail from the order's items."""
+        items = list(self.items.order_by('id'))
+        self.item_count = sum(item.quantity for item in items)
+        product_ids = [item.product_id for item in items if item.product_id]
+        images = ProductImage.objects.filter(product_id__in=product_ids)
+        first = {}
+        for image in images:
+            first.setdefault(image.product_id, image)
+        thumbnail = next((first[pid] for pid in product_ids if pid in first), None)
+        self.thumbnail = thumbnail.image.name if thumbnail else ''
+        if save:
+            self.save(update_fields=['item_count', 'thumbnail', 'updated_at'])
+
     def save(self, *args, **kwargs):
         if not self.order_number:
             self.order_number = self.generate_order_number()
@@ -319,8 +403,14 @@ class Order(models.Model):
     def generate_order_number():
         prefix = 'FLG'
         timestamp = timezone.now().strftime('%Y%m%d')
-        random_str = ''.join(random.choices(string.digits, k=6))
-        return f"{prefix}{timestamp}{random_str}"
+        while True:
+            random_str = ''.join(random.choices(string.digits, k=6))
+            number = f"{prefix}{timestamp}{random_str}"
+            # Archived orders keep their numbers and are still looked up by them
+            taken = Order.objects.filter(order_number=number).values('order_number').union(
+                ArchivedOrder.objects.filter(order_number=number).values('order_number'))
+            if not taken.exists():
+                return number
 
 
 # Order Item Model
@@ -337,6 +427,12 @@ class OrderItem(models.Model):
     return_deadline = models.DateField(null=True, blank=True)
     warranty_period = models.CharField(max_length=100, blank=True)
 
+    class Meta:
+        indexes = [
+            # Has this user bought this product (reviews): the user's orders, then this
+            models.Index(fields=['order', 'product'], name='order_item_product_idx'),
+        ]
+
     def __str__(self):
         return f"{self.product_name} x {self.quantity}"
 
@@ -356,6 +452,259 @@ class OrderStatusHistory(models.Model):
         return f"{self.order.order_number} - {self.status}"
 
 
+# Order Archive (cold storage for old delivered / cancelled orders, see store/archive.py)
+# Rows keep the primary keys they had in the hot tables, so order URLs stay valid.
+class ArchivedOrder(models.Model):
+    is_archived = True
+
+    id = models.BigIntegerField(primary_key=True)
+    order_number = models.CharField(max_length=20, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    address = models.ForeignKey(Address, on_delete=models.SET_NULL, null=True)
+    
+    # Pricing
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    shipping_charge = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    coupon = models.ForeignKey(Coupon, on_delete=models.SET_NULL, null=True, blank=True)
+    
+    # Status
+    order_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    payment_method = models.CharField(max_length=20, choices=Order.PAYMENT_METHOD)
+    payment_status = models.CharField(max_length=20, choices=Order.PAYMENT_STATUS)
+    
+    # Tracking
+    tracking_number = models.CharField(max_length=100, blank=True)
+    expected_delivery_date = models.DateField(null=True, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    
+    # Razorpay Payment
+    razorpay_order_id = models.CharField(max_length=255, blank=True)
+    razorpay_payment_id = models.CharField(max_length=255, blank=True)
+    razorpay_signature = models.CharField(max_length=255, blank=True)
+    
+    order_notes = models.TextField(blank=True)
+    item_count = models.PositiveIntegerField(default=0)
+    thumbnail = models.ImageField(upload_to='products/', blank=True)
+    
+    # Timestamps (copied from the hot row)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Archived Order'
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='archived_order_history_idx'),
+            models.Index(fields=['created_at'], name='archived_order_created_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order {self.order_number} (archived)"
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    product_name = models.CharField(max_length=200)
+    product_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField()
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    is_returnable = models.BooleanField(default=True)
+    return_deadline = models.DateField(null=True, blank=True)
+    warranty_period = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'product'], name='archived_item_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_name} x {self.quantity}"
+
+
+class ArchivedOrderStatusHistory(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='status_history')
+    status = models.CharField(max_length=20)
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name_plural = 'Archived Order Status Histories'
+
+    def __str__(self):
+        return f"{self.order.order_number} - {self.status}"
+
+
+# Daily Sales Rollup (materialized by store/rollups.py)
+class SalesRollup(models.Model):
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='sales_rollups')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='sales_rollups')
+    brand = models.ForeignKey(Brand, on_delete=models.SET_NULL, null=True, blank=True, related_name='sales_rollups')
+    
+    # Everything ordered that day (except failed payments)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discounts = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    # Of which later cancelled / returned (revenue net of their discount share)
+    cancelled_units = models.PositiveIntegerField(default=0)
+    cancelled_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    returned_units = models.PositiveIntegerField(default=0)
+    returned_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    refreshed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = 'Daily Sales'
+        verbose_name_plural = 'Daily Sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_sales_rollup_day_product'),
+        ]
+        indexes = [
+            models.Index(fields=['date']),
+            models.Index(fields=['product', 'date']),
+            models.Index(fields=['category', 'date']),
+            models.Index(fields=['brand', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - product {self.product_id}"
+
+    @property
+    def net_revenue(self):
+        return self.revenue - self.discounts - self.cancelled_revenue - self.returned_revenue
+
+
+# A (day, product) rollup to recompute, queued when an order changes
+class SalesRollupChange(models.Model):
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.date} - product {self.product_id}"
+
+
+# Payment Event (idempotent payment confirmation / webhook ingestion)
+class PaymentEvent(models.Model):
+    SOURCES = (
+        ('checkout', 'Checkout Confirmation'),
+        ('callback', 'Razorpay Callback'),
+        ('webhook', 'Razorpay Webhook'),
+    )
+
+    STATUS = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+        ('ignored', 'Ignored'),
+        ('refund_due', 'Refund Due'),  # captured after the order was cancelled
+    )
+
+    razorpay_payment_id = models.CharField(max_length=255)
+    razorpay_order_id = models.CharField(max_length=255, db_index=True)
+    razorpay_signature = models.CharField(max_length=255, blank=True)
+    source = models.CharField(max_length=20, choices=SOURCES)
+    event = models.CharField(max_length=50, default='payment.captured')
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS, default='pending')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # One row per payment and event type: the same report from two
+            # channels is a duplicate, a later event for the payment is not
+            models.UniqueConstraint(fields=['razorpay_payment_id', 'event'], name='unique_payment_event'),
+        ]
+
+    def __str__(self):
+        return f"{self.razorpay_payment_id} {self.event} ({self.status})"
+
+
+# Email Outbox (transactional mail, sent in batches by the send_outbox command)
+class OutboxEmail(models.Model):
+    KINDS = (
+        ('otp', 'Password Reset OTP'),
+        ('order_confirmation', 'Order Confirmation'),
+        ('order_status', 'Order Status Update'),
+        ('other', 'Other'),
+    )
+
+    STATUS = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+
+    kind = models.CharField(max_length=30, choices=KINDS, default='other')
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=STATUS, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Outbox Email'
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)}"
+
+
+# Request Profile (CPU / allocation profile of one request, captured on demand
+# by staff, see store/profiling.py)
+class RequestProfile(models.Model):
+    KINDS = (
+        ('cpu', 'CPU (cProfile)'),
+        ('memory', 'Allocations (tracemalloc)'),
+        ('all', 'CPU and allocations'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view_name = models.CharField(max_length=200, blank=True)
+    status_code = models.IntegerField()
+    duration_ms = models.FloatField()
+    cpu_stats = models.BinaryField(blank=True)  # marshalled pstats, as cProfile's dump_stats writes
+    cpu_summary = models.TextField(blank=True)
+    allocations = models.JSONField(default=list, blank=True)
+    peak_memory_kib = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.get_kind_display()})"
+
+
 # Return Request Model
 class ReturnRequest(models.Model):
     RETURN_STATUS = (
@@ -402,6 +751,10 @@ class Review(models.Model):
     class Meta:
         unique_together = ('product', 'user', 'order_item')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['product', '-created_at'], condition=models.Q(is_approved=True),
+                         name='review_product_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.rating} stars by {self.user.username}"
@@ -0,0 +1,102 @@
+"""
+Order status transitions.
+
+TRANSITIONS lists which statuses an order may move to from its current one.
+transition_orders() moves many orders at once in a single transaction:
+bulk_update on Order, bulk_create of the OrderStatusHistory rows, one UPDATE
+to put cancelled stock back, and status emails queued in bulk. The admin
+actions and the transition_orders command both go through it.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .coupons import release_coupon
+from .emails import enqueue_order_status_emails
+from .models import CouponRedemption, Order, OrderItem, OrderStatusHistory
+from .rollups import mark_orders
+from .stock import adjust_stock
+
+TRANSITIONS = {
+    'pending': ('confirmed', 'cancelled'),
+    'confirmed': ('packed', 'cancelled'),
+    'packed': ('shipped', 'cancelled'),
+    'shipped': ('out_for_delivery', 'delivered', 'returned'),
+    'out_for_delivery': ('delivered', 'returned'),
+    'delivered': ('returned',),
+    'cancelled': (),
+    'returned': (),
+}
+BATCH_SIZE = 500
+
+
+def can_transition(from_status, to_status):
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+def allowed_sources(to_status):
+    return [status for status, targets in TRANSITIONS.items() if to_status in targets]
+
+
+def restock(order_ids):
+    """Put the stock of the given orders' items back with set-based UPDATEs."""
+    quantities = Counter()
+    for product_id, quantity in OrderItem.objects.filter(
+        order_id__in=order_ids, product__isnull=False
+    ).values_list('product_id', 'quantity'):
+        quantities[product_id] += quantity
+    return adjust_stock(quantities)
+
+
+def transition_orders(orders, status, notes='', notify=True):
+    """Move orders (a queryset or iterable of ids) to status.
+
+    Orders for which the move is not allowed from their current status are
+    left alone. Returns (changed, skipped) lists of Order objects.
+    """
+    if status not in TRANSITIONS:
+        raise ValueError(f'Unknown order status: {status}')
+    if isinstance(orders, QuerySet):
+        ids = orders.values('id')
+    else:
+        ids = list(orders)
+
+    with transaction.atomic():
+        candidates = list(Order.objects.select_for_update().filter(id__in=ids).select_related('user').order_by('id'))
+        changed = [order for order in candidates if can_transition(order.order_status, status)]
+        skipped = [order for order in candidates if not can_transition(order.order_status, status)]
+        if not changed:
+            return changed, skipped
+
+        now = timezone.now()
+        history = []
+        for order in changed:
+            history.append(OrderStatusHistory(
+                order=order,
+                status=status,
+                notes=notes or f"Status changed from {order.order_status} to {status}",
+            ))
+            order.order_status = status
+            order.updated_at = now
+            if status == 'delivered':
+                order.delivered_at = now
+        Order.objects.bulk_update(changed, ['order_status', 'delivered_at', 'updated_at'], batch_size=BATCH_SIZE)
+        OrderStatusHistory.objects.bulk_create(history, batch_size=BATCH_SIZE)
+        mark_orders([order.id for order in changed])
+
+        if status == 'cancelled':
+            changed_ids = [order.id for order in changed]
+            restock(changed_ids)
+            held = set(CouponRedemption.objects.filter(
+                order_id__in=changed_ids, released_at__isnull=True
+            ).values_list('order_id', flat=True))
+            for order in changed:
+                if order.id in held:
+                    release_coupon(order)
+
+        if notify:
+            enqueue_order_status_emails(changed)
+
+    return changed, skipped
@@ -0,0 +1,114 @@
+"""
+Pagination helpers for large tables.
+
+Keyset pagination for newest-first listings.
+
+OFFSET pagination makes the database walk and discard every earlier row, so
+deep pages get slower as history grows. Here a page is requested with a
+cursor naming the last row already shown (its created_at and id), and the
+next page is a range scan from that point on a (created_at, id) index.
+
+EstimatedCountPaginator is for admin changelists: an exact COUNT(*) over a
+big unfiltered table reads every row, so it takes the planner's row
+estimate instead and only counts exactly when the list is filtered or the
+table is small.
+"""
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from . import metrics
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+ESTIMATE_THRESHOLD = 10000  # below this many rows an exact count is cheap
+ESTIMATE_TTL = 60  # seconds
+
+_estimates = {}
+
+
+def encode_cursor(obj):
+    delta = obj.created_at - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return f'{micros}-{obj.pk}'
+
+
+def decode_cursor(value):
+    """Return (created_at, pk) for a cursor, or None if it is malformed."""
+    try:
+        micros, pk = (int(part) for part in value.split('-'))
+    except (AttributeError, ValueError):
+        return None
+    return EPOCH + timedelta(microseconds=micros), pk
+
+
+def keyset_page(queryset, cursor=None, per_page=10):
+    """Return (rows, next_cursor) for the page after cursor, newest first.
+
+    next_cursor is None on the last page.
+    """
+    queryset = queryset.order_by('-created_at', '-pk')
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        created_at, pk = position
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    rows = list(queryset[:per_page + 1])
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def _query_estimate(connection, table):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # sqlite_stat1 exists once ANALYZE (or PRAGMA optimize) has run;
+            # the first number of each row is the rows in that index. A
+            # partial index only counts the rows it covers, so take the
+            # largest (CAST reads the leading number).
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if not cursor.fetchone():
+                return None
+            cursor.execute('SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s', [table])
+            row = cursor.fetchone()
+            return row[0] if row else None
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        else:
+            return None
+        row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+def estimated_row_count(model, using='default'):
+    """Approximate number of rows in model's table, or None if the database
+    has no statistics for it. Cached for ESTIMATE_TTL seconds."""
+    key = (using, model._meta.db_table)
+    cached = _estimates.get(key)
+    if cached and time.monotonic() - cached[1] < ESTIMATE_TTL:
+        metrics.CACHE_LOOKUPS.inc(cache='row_estimates', result='hit')
+        return cached[0]
+    metrics.CACHE_LOOKUPS.inc(cache='row_estimates', result='miss')
+    estimate = _query_estimate(connections[using], model._meta.db_table)
+    _estimates[key] = (estimate, time.monotonic())
+    return estimate
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is not None and not query.where and not query.distinct:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
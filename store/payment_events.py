@@ -0,0 +1,237 @@
+"""
+Idempotent payment event ingestion.
+
+Frontend confirmations, the Razorpay redirect callback and Razorpay webhooks
+all become PaymentEvent rows keyed by (razorpay_payment_id, event), so the
+same report arriving twice (or by two channels at once) is stored once, while
+a later event for the payment (authorized, then captured) is kept and
+applied. Recording an event is a single insert; the request is answered
+straight away and the order is finalized on a small in-process worker pool
+after the insert commits.
+
+Finalizing is exactly-once: a worker must claim the event with a conditional
+UPDATE before touching it, and the order itself only moves to 'completed'
+through a conditional UPDATE, so only one caller ever clears the cart and
+writes the status history. Events left behind by a crash or restart are
+picked up by the process_payment_events management command.
+
+A failed payment leaves the order open: Razorpay Checkout lets the shopper
+retry against the same Razorpay order, so the stock stays reserved (it goes
+back if the order is cancelled) and only the coupon use is given back. If a
+retry then succeeds, the coupon use is taken again.
+
+A payment captured after the order was cancelled does not reopen it: its
+stock and coupon use are already given back. The payment id is stored on
+the order with a status history note, and the event is left as
+'refund_due' for staff to refund.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics
+from .coupons import reclaim_coupon, release_coupon
+from .emails import enqueue_order_confirmation
+from .models import CartItem, Order, OrderStatusHistory, PaymentEvent
+from .rollups import mark_orders
+
+SUCCESS_EVENTS = {'payment.authorized', 'payment.captured', 'order.paid'}
+FAILURE_EVENTS = {'payment.failed'}
+# Orders a late capture must not reopen
+CLOSED_STATUSES = ['cancelled', 'returned']
+
+# A 'processing' event older than this is assumed abandoned by a dead worker.
+STALE_AFTER = timedelta(minutes=5)
+
+# Transient failures (e.g. a locked database) are retried in the worker before
+# the event is left for process_payment_events.
+WORKER_RETRIES = 3
+WORKER_BACKOFF = 0.05
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PAYMENT_EVENT_WORKERS,
+                    thread_name_prefix='payment-events',
+                )
+    return _executor
+
+
+def record_payment_event(razorpay_order_id, razorpay_payment_id, razorpay_signature='',
+                         source='checkout', event='payment.captured', payload=None):
+    """Store a payment event once per payment id and event type and schedule
+    its processing.
+
+    Returns (event, created). A duplicate returns the existing row and
+    schedules nothing new.
+    """
+    try:
+        with transaction.atomic():
+            payment_event = PaymentEvent.objects.create(
+                razorpay_payment_id=razorpay_payment_id,
+                razorpay_order_id=razorpay_order_id,
+                razorpay_signature=razorpay_signature or '',
+                source=source,
+                event=event,
+                payload=payload or {},
+            )
+    except IntegrityError:
+        return PaymentEvent.objects.get(razorpay_payment_id=razorpay_payment_id, event=event), False
+
+    event_id = payment_event.pk
+    transaction.on_commit(lambda: dispatch(event_id))
+    return payment_event, True
+
+
+def dispatch(event_id):
+    if settings.PAYMENT_EVENTS_ASYNC:
+        _get_executor().submit(_run_in_worker, event_id)
+    else:
+        process_payment_event(event_id)
+
+
+def _run_in_worker(event_id):
+    try:
+        for attempt in range(WORKER_RETRIES + 1):
+            if process_payment_event(event_id) != 'failed':
+                break
+            time.sleep(WORKER_BACKOFF * (2 ** attempt))
+    finally:
+        connection.close()
+
+
+def claim(event_id):
+    """Move an event to 'processing'. Only one caller can win."""
+    now = timezone.now()
+    claimable = Q(status__in=['pending', 'failed']) | Q(status='processing', updated_at__lt=now - STALE_AFTER)
+    return PaymentEvent.objects.filter(claimable, pk=event_id).update(
+        status='processing', attempts=F('attempts') + 1, updated_at=now
+    ) == 1
+
+
+def process_payment_event(event_id):
+    """Apply one event to its order. Returns the final event status, or None
+    if another worker owns the event."""
+    if not claim(event_id):
+        return None
+
+    payment_event = PaymentEvent.objects.get(pk=event_id)
+    try:
+        with transaction.atomic():
+            if payment_event.event in SUCCESS_EVENTS:
+                status = apply_payment_success(payment_event)
+            elif payment_event.event in FAILURE_EVENTS:
+                status = 'processed' if apply_payment_failure(payment_event) else 'ignored'
+            else:
+                status = 'ignored'
+    except Exception as e:
+        PaymentEvent.objects.filter(pk=event_id).update(
+            status='failed', last_error=str(e), updated_at=timezone.now()
+        )
+        metrics.PAYMENT_EVENTS.inc(status='failed')
+        return 'failed'
+
+    now = timezone.now()
+    PaymentEvent.objects.filter(pk=event_id).update(
+        status=status, last_error='', processed_at=now, updated_at=now
+    )
+    metrics.PAYMENT_EVENTS.inc(status=status)
+    return status
+
+
+def apply_payment_success(payment_event):
+    """Confirm the order for a captured payment. Returns the event status:
+    'processed', 'ignored' if the order was already completed (or
+    refunded), or 'refund_due' if it was cancelled first."""
+    # Write first: on SQLite a transaction that reads before it writes cannot
+    # wait for the write lock and fails straight away under contention.
+    orders = Order.objects.filter(razorpay_order_id=payment_event.razorpay_order_id)
+    open_orders = orders.exclude(order_status__in=CLOSED_STATUSES)
+    paid = {
+        'razorpay_payment_id': payment_event.razorpay_payment_id,
+        'razorpay_signature': payment_event.razorpay_signature,
+        'payment_status': 'completed',
+        'order_status': 'confirmed',
+        'updated_at': timezone.now(),
+    }
+    updated = open_orders.filter(payment_status='pending').update(**paid)
+    retried = False
+    if not updated:
+        # A retry succeeded after a failed attempt
+        updated = retried = open_orders.filter(payment_status='failed').update(**paid)
+    if not updated:
+        if flag_refund_due(orders, payment_event):
+            return 'refund_due'
+        if not orders.exists():
+            raise Order.DoesNotExist(f'No order for {payment_event.razorpay_order_id}')
+        return 'ignored'
+
+    order = orders.select_related('user').first()
+    mark_orders([order.id])
+    if retried:
+        # The failure gave the coupon use back, but the amount paid has the discount
+        reclaim_coupon(order)
+
+    # Clear cart for the user
+    CartItem.objects.filter(cart__user_id=order.user_id).delete()
+
+    OrderStatusHistory.objects.create(
+        order=order,
+        status='confirmed',
+        notes='Payment completed via Razorpay'
+    )
+    enqueue_order_confirmation(order)
+    return 'processed'
+
+
+def flag_refund_due(orders, payment_event):
+    """Store a payment captured on a cancelled order for refunding. Returns
+    False if there is none, or this payment was flagged already."""
+    payment_id = payment_event.razorpay_payment_id
+    flagged = orders.filter(
+        order_status__in=CLOSED_STATUSES, payment_status__in=['pending', 'failed'],
+    ).exclude(razorpay_payment_id=payment_id)
+    if not flagged.update(razorpay_payment_id=payment_id, updated_at=timezone.now()):
+        return False
+    OrderStatusHistory.objects.bulk_create([
+        OrderStatusHistory(order_id=order_id, status=status,
+                           notes=f'Payment {payment_id} captured after the order was {status}; refund due')
+        for order_id, status in orders.values_list('id', 'order_status')
+    ])
+    return True
+
+
+def apply_payment_failure(payment_event):
+    """Mark the order's payment failed unless another payment already
+    completed it, and give back its coupon use. The stock stays reserved
+    while the shopper can still retry."""
+    orders = Order.objects.filter(razorpay_order_id=payment_event.razorpay_order_id)
+    updated = orders.filter(payment_status='pending').update(
+        payment_status='failed', updated_at=timezone.now()
+    )
+    if updated:
+        for order in orders.only('id'):
+            release_coupon(order)
+        mark_orders(orders.values('id'))
+    return bool(updated)
+
+
+def pending_events():
+    """Events that still need work: never processed, failed, or abandoned."""
+    stale = timezone.now() - STALE_AFTER
+    return PaymentEvent.objects.filter(
+        Q(status__in=['pending', 'failed']) | Q(status='processing', updated_at__lt=stale)
+    ).order_by('created_at')
@@ -0,0 +1,144 @@
+"""
+Razorpay gateway access.
+
+One PaymentGatewayClient is shared by the whole process, so calls to the
+Razorpay API reuse pooled keep-alive connections instead of building a new
+client and TLS session per request. Every call gets a timeout, and retries of
+transient failures are capped by a process-wide retry budget.
+
+Payment signatures are checked locally with HMAC-SHA256 and need no client.
+"""
+import hashlib
+import hmac
+import threading
+import time
+
+import razorpay
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+
+class RetryBudget:
+    """Allows retries only up to a fraction of recent requests, so a gateway
+    outage cannot turn into a retry storm."""
+
+    def __init__(self, ratio=0.1, initial=10, cap=100):
+        self.ratio = ratio
+        self.cap = cap
+        self._tokens = float(initial)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.cap, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class PaymentGatewayClient(razorpay.Client):
+    """razorpay.Client with a pooled session, default timeouts and budgeted
+    retries."""
+
+    def __init__(self, key_id, key_secret, base_url=None, timeout=10, pool_size=10,
+                 max_retries=2, backoff=0.1, retry_budget=None):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        options = {'base_url': base_url} if base_url else {}
+        super().__init__(session=session, auth=(key_id, key_secret), **options)
+
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_budget = retry_budget or RetryBudget()
+        # The SDK looks its own version up through pkg_resources on every call.
+        self._version = super()._get_version()
+
+    def _get_version(self):
+        return self._version
+
+    def request(self, method, path, **options):
+        options.setdefault('timeout', self.timeout)
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return super().request(method, path, **options)
+            except (requests.ConnectionError, requests.Timeout, razorpay.errors.ServerError) as exc:
+                if not self._should_retry(method, exc, attempt):
+                    raise
+            attempt += 1
+            time.sleep(self.backoff * (2 ** (attempt - 1)))
+
+    def _should_retry(self, method, exc, attempt):
+        if attempt >= self.max_retries:
+            return False
+        # Non-idempotent calls are only retried when the connection failed,
+        # not when the gateway may already have acted on the request.
+        if method != 'get' and not isinstance(exc, requests.ConnectionError):
+            return False
+        return self.retry_budget.withdraw()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_razorpay_client():
+    """Return the process-wide Razorpay client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PaymentGatewayClient(
+                    settings.RAZORPAY_KEY_ID,
+                    settings.RAZORPAY_KEY_SECRET,
+                    base_url=settings.RAZORPAY_API_BASE_URL,
+                    timeout=settings.RAZORPAY_TIMEOUT,
+                    pool_size=settings.RAZORPAY_POOL_SIZE,
+                    max_retries=settings.RAZORPAY_MAX_RETRIES,
+                )
+    return _client
+
+
+def reset_razorpay_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.session.close()
+        _client = None
+
+
+def payment_signature(razorpay_order_id, razorpay_payment_id, secret=None):
+    """The signature Razorpay Checkout returns for a successful payment."""
+    secret = secret or settings.RAZORPAY_KEY_SECRET
+    message = f'{razorpay_order_id}|{razorpay_payment_id}'
+    return hmac.new(secret.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+
+def verify_payment_signature(razorpay_order_id, razorpay_payment_id, razorpay_signature, secret=None):
+    """Check a Checkout payment signature in-process. Returns True or False."""
+    secret = secret or settings.RAZORPAY_KEY_SECRET
+    if not (razorpay_order_id and razorpay_payment_id and razorpay_signature and secret):
+        return False
+    expected = payment_signature(razorpay_order_id, razorpay_payment_id, secret)
+    return hmac.compare_digest(expected, str(razorpay_signature))
+
+
+def verify_webhook_signature(body, signature, secret=None):
+    """Check the X-Razorpay-Signature header of a webhook against its raw body."""
+    secret = secret or settings.RAZORPAY_WEBHOOK_SECRET
+    if not (signature and secret):
+        return False
+    if isinstance(body, str):
+        body = body.encode()
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, str(signature))
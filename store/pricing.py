@@ -0,0 +1,161 @@
+"""
+Pricing engine for carts and orders.
+
+GST, shipping and coupon maths live here and nowhere else. A cart or order is
+priced in a single pass over its lines; the batch helpers reprice many carts
+or orders with one query per chunk, which is what we run when tax rules or
+coupon terms change. All amounts are Decimals rounded to paise.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+
+TAX_RATE = Decimal('0.18')  # 18% GST
+FREE_SHIPPING_THRESHOLD = Decimal('500')
+SHIPPING_CHARGE = Decimal('50.00')
+
+ZERO = Decimal('0.00')
+PAISE = Decimal('0.01')
+
+BATCH_SIZE = 2000
+
+
+class Quote(namedtuple('Quote', 'subtotal shipping tax discount total')):
+    """Priced totals for a cart or order."""
+
+    __slots__ = ()
+
+    def with_coupon(self, coupon):
+        """Re-apply a coupon without recomputing the subtotal."""
+        return quote(self.subtotal, coupon)
+
+
+def to_paise(amount):
+    return Decimal(amount).quantize(PAISE)
+
+
+def shipping_for(subtotal):
+    """Free shipping for orders >= 500, else 50"""
+    return ZERO if subtotal >= FREE_SHIPPING_THRESHOLD else SHIPPING_CHARGE
+
+
+def tax_for(subtotal):
+    return to_paise(subtotal * TAX_RATE)
+
+
+def coupon_discount(coupon, subtotal):
+    """Discount a coupon gives on subtotal. Validity and redemption are the
+    caller's concern; this only does the maths."""
+    if coupon is None or subtotal < coupon.min_purchase_amount:
+        return ZERO
+    if coupon.discount_type == 'percentage':
+        discount = (subtotal * coupon.discount_value) / 100
+        if coupon.max_discount_amount:
+            discount = min(discount, coupon.max_discount_amount)
+    else:
+        discount = coupon.discount_value
+    return to_paise(discount)
+
+
+def quote(subtotal, coupon=None):
+    subtotal = to_paise(subtotal)
+    shipping = shipping_for(subtotal)
+    tax = tax_for(subtotal)
+    discount = coupon_discount(coupon, subtotal)
+    return Quote(subtotal, shipping, tax, discount, subtotal + shipping + tax - discount)
+
+
+def line_total(price, discount_price, quantity):
+    """Same rule as Product.final_price * quantity, on raw column values."""
+    return (discount_price if discount_price else price) * quantity
+
+
+def price_cart(cart, coupon=None):
+    """Price a cart in one query (none if items__product is prefetched)."""
+    if 'items' in getattr(cart, '_prefetched_objects_cache', {}):
+        items = cart.items.all()
+    else:
+        items = cart.items.select_related('product')
+    subtotal = sum((item.total_price for item in items), ZERO)
+    return quote(subtotal, coupon)
+
+
+def price_order(order):
+    """Price an order from its stored line totals and coupon."""
+    subtotal = sum((item.total_price for item in order.items.all()), ZERO)
+    return quote(subtotal, order.coupon)
+
+
+def _chunks(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def reprice_carts(cart_ids=None, coupon=None, batch_size=BATCH_SIZE):
+    """Price many carts at once. Returns {cart_id: Quote}.
+
+    Reads raw (cart_id, price, discount_price, quantity) rows a chunk at a time
+    instead of building model instances, and sums them as Decimals in Python
+    so the result matches price_cart exactly.
+    """
+    from .models import Cart, CartItem
+
+    if cart_ids is None:
+        cart_ids = Cart.objects.values_list('id', flat=True)
+    cart_ids = list(cart_ids)
+
+    quotes = {}
+    for chunk in _chunks(cart_ids, batch_size):
+        subtotals = dict.fromkeys(chunk, ZERO)
+        rows = CartItem.objects.filter(cart_id__in=chunk).order_by().values_list(
+            'cart_id', 'product__price', 'product__discount_price', 'quantity'
+        )
+        for cart_id, price, discount_price, quantity in rows:
+            subtotals[cart_id] += line_total(price, discount_price, quantity)
+        for cart_id, subtotal in subtotals.items():
+            quotes[cart_id] = quote(subtotal, coupon)
+    return quotes
+
+
+def reprice_orders(orders=None, batch_size=BATCH_SIZE, save=False):
+    """Price many orders at once from their items and coupons.
+
+    Returns {order_id: Quote}. With save=True the pricing columns are written
+    back with one bulk_update per chunk.
+    """
+    from .models import Coupon, Order, OrderItem
+    from .rollups import mark_orders
+
+    if orders is None:
+        orders = Order.objects.all()
+    order_rows = list(orders.order_by().values_list('id', 'coupon_id'))
+    coupons = Coupon.objects.in_bulk({coupon_id for _, coupon_id in order_rows if coupon_id})
+
+    quotes = {}
+    for chunk in _chunks(order_rows, batch_size):
+        subtotals = {order_id: ZERO for order_id, _ in chunk}
+        rows = OrderItem.objects.filter(order_id__in=subtotals).order_by().values_list(
+            'order_id', 'total_price'
+        )
+        for order_id, total_price in rows:
+            subtotals[order_id] += total_price
+
+        chunk_quotes = {
+            order_id: quote(subtotals[order_id], coupons.get(coupon_id))
+            for order_id, coupon_id in chunk
+        }
+        quotes.update(chunk_quotes)
+
+        if save:
+            updated = [
+                Order(id=order_id, subtotal=q.subtotal, shipping_charge=q.shipping,
+                      tax=q.tax, discount=q.discount, total=q.total)
+                for order_id, q in chunk_quotes.items()
+            ]
+            with transaction.atomic():
+                Order.objects.bulk_update(
+                    updated, ['subtotal', 'shipping_charge', 'tax', 'discount', 'total']
+                )
+                mark_orders(list(chunk_quotes))
+    return quotes
@@ -0,0 +1,316 @@
+"""
+Per-request profiling for finding where a slow page spends its time.
+
+RequestProfileMiddleware profiles a random REQUEST_PROFILE_SAMPLE_RATE share
+of requests (0, the default, removes it from the stack). For each profiled
+request it records:
+
+- db: every query on every database alias, with its duration; the
+  REQUEST_PROFILE_SLOW_QUERIES slowest are kept with their SQL
+- tpl: time rendering templates, less the queries run while rendering
+  (lazy querysets evaluated in the template count as db)
+- view: from the end of URL resolution until the response comes back
+  through this middleware, i.e. the view and the response phase of the
+  middleware listed after this one
+- app: the rest of the request, i.e. Python outside SQL and templates
+
+and sends them back as a Server-Timing header (shown in the browser's
+network panel) and one JSON log line on the store.profiling logger.
+Unsampled requests pay for one random() call.
+
+Template time comes from the DjangoTemplates backend below, which TEMPLATES
+uses instead of Django's; it behaves identically when nothing is profiled.
+
+For a deep dive into one request, staff add ?_profile=cpu|memory|all (or an
+X-Profile header with the same values) to any URL. OnDemandProfileMiddleware
+then runs the rest of the request under cProfile and/or tracemalloc and
+saves a RequestProfile: the pstats data (download it from the admin and open
+it with pstats or snakeviz), the top functions by cumulative time, and the
+top allocation sites still holding memory when the view returned, with the
+peak. The response's X-Profile header points at the admin page. Other
+requests pay for one dictionary lookup on the query string and one on the
+headers.
+
+tracemalloc slows everything down and cProfile slows Python-heavy code
+more than SQL, so compare timings within one profile, not with normal
+requests; use cpu alone for the most faithful timings. One request per
+process is profiled at a time and allocations made by other threads
+meanwhile are included.
+
+Both middlewares also run as coroutines under ASGI. Queries are timed by an
+execute wrapper every connection gets (store/signals.py), so those run in
+sync_to_async threads count too; an async request's CPU profile covers its
+ORM calls and template rendering but not its coroutines.
+"""
+import cProfile
+import io
+import json
+import logging
+import marshal
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextvars import ContextVar
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.template.backends import django as django_backend
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+_profile = ContextVar('request_profile', default=None)
+
+MAX_SQL_LENGTH = 500
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_KINDS = {'cpu', 'memory', 'all'}
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+
+class Profile:
+    def __init__(self, slow_queries):
+        self.start = time.perf_counter()
+        self.view_start = None
+        self.total = self.view = self.sql = self.template = 0.0
+        self.queries = 0
+        self.rendering = False
+        self.slow_queries = slow_queries
+        self.slowest = []  # [(seconds, alias, sql)], longest first
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.sql += elapsed
+            self.queries += 1
+            if self.slow_queries and (len(self.slowest) < self.slow_queries or elapsed > self.slowest[-1][0]):
+                self.slowest.append((elapsed, context['connection'].alias, sql))
+                self.slowest.sort(key=lambda query: query[0], reverse=True)
+                del self.slowest[self.slow_queries:]
+
+    @property
+    def app(self):
+        return max(0.0, self.total - self.sql - self.template)
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.sql * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template * 1000:.1f}',
+            f'view;dur={self.view * 1000:.1f}',
+            f'app;dur={self.app * 1000:.1f}',
+            f'total;dur={self.total * 1000:.1f}',
+        ])
+
+    def log_record(self, request, response):
+        match = request.resolver_match
+        return {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(self.total * 1000, 2),
+            'view_ms': round(self.view * 1000, 2),
+            'sql_ms': round(self.sql * 1000, 2),
+            'queries': self.queries,
+            'template_ms': round(self.template * 1000, 2),
+            'app_ms': round(self.app * 1000, 2),
+            'slow_queries': [
+                {'ms': round(elapsed * 1000, 2), 'db': alias, 'sql': sql[:MAX_SQL_LENGTH]}
+                for elapsed, alias, sql in self.slowest
+            ],
+        }
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper on every connection (see store/signals.py), timing
+    queries for the request being profiled in this context."""
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile.record_query(execute, sql, params, many, context)
+
+
+class RequestProfileMiddleware:
+    """Profile a sample of requests; list it first in MIDDLEWARE so the
+    total covers the whole stack."""
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.rate = settings.REQUEST_PROFILE_SAMPLE_RATE
+        if self.rate <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.rate:
+            return self.get_response(request)
+
+        profile = Profile(settings.REQUEST_PROFILE_SLOW_QUERIES)
+        token = _profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if random.random() >= self.rate:
+            return await self.get_response(request)
+
+        profile = Profile(settings.REQUEST_PROFILE_SLOW_QUERIES)
+        token = _profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        end = time.perf_counter()
+        profile.total = end - profile.start
+        if profile.view_start is not None:
+            profile.view = end - profile.view_start
+
+        response['Server-Timing'] = profile.server_timing()
+        logger.info(json.dumps(profile.log_record(request, response)))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = _profile.get()
+        if profile is not None:
+            profile.view_start = time.perf_counter()
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        profile = _profile.get()
+        if profile is None or profile.rendering:  # nested renders are inside the outer one's time
+            return super().render(context, request)
+        start, sql = time.perf_counter(), profile.sql
+        profile.rendering = True
+        try:
+            return super().render(context, request)
+        finally:
+            profile.rendering = False
+            profile.template += (time.perf_counter() - start) - (profile.sql - sql)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Django's template backend, timing renders for RequestProfileMiddleware."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+class OnDemandProfileMiddleware:
+    """Profile a request for staff who ask for it; list it after
+    AuthenticationMiddleware."""
+    sync_capable = async_capable = True
+
+    _lock = threading.Lock()  # cProfile and tracemalloc are process-wide
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILE_ON_DEMAND:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def requested_kind(self, request):
+        if PROFILE_PARAM not in request.GET and PROFILE_HEADER not in request.META:
+            return None
+        kind = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER) or 'all'
+        return kind if kind in PROFILE_KINDS else None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        kind = self.requested_kind(request)
+        if kind is None or not request.user.is_staff:
+            return self.get_response(request)
+        if not self._lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.capture(request, kind, self.get_response)
+        finally:
+            self._lock.release()
+
+    async def __acall__(self, request):
+        kind = self.requested_kind(request)
+        if kind is None or not (await request.auser()).is_staff:
+            return await self.get_response(request)
+        if not self._lock.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            # cProfile only sees the thread it is enabled in. Capture from a
+            # worker thread that waits on the rest of the request: the
+            # request's own sync_to_async calls (ORM, templates) then run in
+            # that thread too, only the coroutines stay on the event loop.
+            return await sync_to_async(self.capture)(request, kind, async_to_sync(self.get_response))
+        finally:
+            self._lock.release()
+
+    def capture(self, request, kind, get_response):
+        from .models import RequestProfile
+
+        profiler = cProfile.Profile() if kind in ('cpu', 'all') else None
+        # Leave tracemalloc alone if something else started it
+        tracing = kind in ('memory', 'all') and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            if profiler:
+                profiler.disable()
+            duration = time.perf_counter() - start
+            if tracing:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+        match = request.resolver_match
+        profile = RequestProfile(
+            user=request.user, kind=kind, method=request.method, path=request.get_full_path()[:500],
+            view_name=match.view_name if match else '', status_code=response.status_code,
+            duration_ms=round(duration * 1000, 2),
+        )
+        if profiler:
+            profiler.create_stats()
+            profile.cpu_stats = marshal.dumps(profiler.stats)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            profile.cpu_summary = summary.getvalue()
+        if tracing:
+            snapshot = snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            ])
+            profile.allocations = [
+                {'site': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                 'size_kib': round(stat.size / 1024, 1), 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+            ]
+            profile.peak_memory_kib = round(peak / 1024, 1)
+        profile.save()
+        response['X-Profile'] = reverse('admin:store_requestprofile_change', args=[profile.pk])
+        return response
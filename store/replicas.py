@@ -0,0 +1,138 @@
+"""
+Read replicas for catalog pages.
+
+Views decorated with @replica_reads run their reads on one of
+settings.DATABASE_REPLICAS, picked at random per request; every other view,
+and every write anywhere, uses default. Once a request writes, the rest of
+its reads go to default too, and ReplicaPinMiddleware sets a cookie that
+keeps that browser on default for REPLICA_STICKY_SECONDS, so people see
+their own changes (cart, reviews, login) while the replicas catch up.
+
+Locally the replicas are SQLite files refreshed from the primary by
+`python manage.py replicate` (replicate() below), which stands in for real
+replication and its lag.
+"""
+import contextvars
+import functools
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'db_pin'
+
+
+class _Routing:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.replica = None
+        self.wrote = False
+
+
+_routing = contextvars.ContextVar('db_routing', default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing and routing.replica and not routing.wrote:
+            return routing.replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        return obj1._state.db in databases and obj2._state.db in databases
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get the schema with the data
+        return db not in settings.DATABASE_REPLICAS
+
+
+def _start():
+    routing = _routing.get()
+    token = None
+    if routing is None:
+        routing = _Routing()
+        token = _routing.set(routing)
+    if not routing.pinned and settings.DATABASE_REPLICAS:
+        routing.replica = random.choice(settings.DATABASE_REPLICAS)
+    return routing, token
+
+
+def _finish(routing, token):
+    routing.replica = None
+    if token is not None:
+        _routing.reset(token)
+
+
+def replica_reads(view):
+    """Run the view's reads on a replica unless the user is pinned."""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            routing, token = _start()
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _finish(routing, token)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            routing, token = _start()
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _finish(routing, token)
+    return wrapper
+
+
+class ReplicaPinMiddleware:
+    """Pin a browser to the primary for a while after it writes."""
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = _Routing(pinned=PIN_COOKIE in request.COOKIES)
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.pin(response, routing)
+
+    async def __acall__(self, request):
+        routing = _Routing(pinned=PIN_COOKIE in request.COOKIES)
+        token = _routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.pin(response, routing)
+
+    def pin(self, response, routing):
+        if routing.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+def replicate(alias):
+    """Copy the primary SQLite database into the replica alias, as one
+    consistent snapshot."""
+    primary, replica = connections[DEFAULT_DB_ALIAS], connections[alias]
+    primary.ensure_connection()
+    replica.ensure_connection()
+    primary.connection.backup(replica.connection)
@@ -0,0 +1,237 @@
+"""
+Daily sales rollups.
+
+SalesRollup holds one row per (day, product) with units, revenue, coupon
+discounts, and the part of them that was later cancelled or returned.
+Category and brand are copied from the product so the table can be grouped
+by either without a join. Revenue questions are answered by sales_summary()
+over this table instead of aggregating OrderItem.
+
+Rows are kept up to date from a queue of changes. Whenever an order's
+status, payment or pricing changes, or one of its return requests does,
+mark_orders() queues a SalesRollupChange for each (day, product) the order
+contributes to: the post_save/pre_delete receivers in signals.py cover
+saves, and transition_orders(), the payment event handlers and
+reprice_orders(), which write with update()/bulk_update(), call it
+themselves. refresh_rollups() re-aggregates only the queued pairs and
+deletes the changes it consumed, so a change queued while it runs is kept
+for the next one. The first run, with no rollups yet, builds everything.
+backfill_rollups() rebuilds a date range a few days per transaction.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import (
+    Case, Count, DecimalField, Exists, F, IntegerField, Max, Min, OuterRef, Q, Sum, Value, When,
+)
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Order, OrderItem, ReturnRequest, SalesRollup, SalesRollupChange,
+)
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+BACKFILL_DAYS = 7  # days recomputed per transaction by backfill_rollups()
+REFRESH_BATCH = 1000  # queued changes applied per transaction by refresh_rollups()
+# Order columns the rollups are computed from; saving only other columns
+# (summary, tracking) does not queue a change
+ORDER_FIELDS = {'order_status', 'payment_status', 'subtotal', 'discount', 'created_at'}
+
+MEASURES = (
+    'orders', 'units', 'revenue', 'discounts',
+    'cancelled_units', 'cancelled_revenue', 'returned_units', 'returned_revenue',
+)
+GROUPINGS = ('date', 'product', 'category', 'brand')
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _product_filter(product_ids, field='product'):
+    """Rows for these products; None stands for a deleted product."""
+    condition = Q(**{f'{field}_id__in': [pk for pk in product_ids if pk is not None]})
+    if None in product_ids:
+        condition |= Q(**{f'{field}__isnull': True})
+    return condition
+
+
+def _aggregate(item_model, start, end, returns=True, products=None):
+    """Per (day, product) aggregates for orders placed in [start, end),
+    optionally only for the given product ids."""
+    items = item_model.objects.filter(
+        order__created_at__gte=start, order__created_at__lt=end,
+    ).exclude(order__payment_status='failed')
+    if products is not None:
+        items = items.filter(_product_filter(products))
+
+    returned = Q(order__order_status='returned')
+    if returns:
+        items = items.annotate(has_return=Exists(ReturnRequest.objects.filter(
+            order_item=OuterRef('pk'), status__in=['approved', 'completed'],
+        )))
+        returned |= Q(has_return=True)
+    cancelled = Q(order__order_status='cancelled')
+
+    # The order's coupon discount, spread over its items by line total
+    share = Case(
+        When(order__subtotal__gt=0, then=F('total_price') * F('order__discount') / F('order__subtotal')),
+        default=Value(ZERO),
+        output_field=MONEY,
+    )
+    net = F('total_price') - share
+
+    return items.annotate(day=TruncDate('order__created_at')).values(
+        'day', 'product_id', 'product__category_id', 'product__brand_id',
+    ).annotate(
+        orders=Count('order_id', distinct=True),
+        units=Sum('quantity'),
+        revenue=Sum('total_price', output_field=MONEY),
+        discounts=Sum(share, output_field=MONEY),
+        cancelled_units=Sum(Case(When(cancelled, then='quantity'), default=0, output_field=IntegerField())),
+        cancelled_revenue=Sum(Case(When(cancelled, then=net), default=Value(ZERO), output_field=MONEY)),
+        returned_units=Sum(Case(When(returned & ~cancelled, then='quantity'), default=0, output_field=IntegerField())),
+        returned_revenue=Sum(Case(When(returned & ~cancelled, then=net), default=Value(ZERO), output_field=MONEY)),
+    ).order_by()
+
+
+def _build_rows(start, end, now, products=None):
+    totals = {}
+    rows = (list(_aggregate(OrderItem, start, end, products=products))
+            + list(_aggregate(ArchivedOrderItem, start, end, returns=False, products=products)))
+    for row in rows:
+        key = (row['day'], row['product_id'])
+        if key not in totals:
+            totals[key] = SalesRollup(
+                date=row['day'],
+                product_id=row['product_id'],
+                category_id=row['product__category_id'],
+                brand_id=row['product__brand_id'],
+                refreshed_at=now,
+            )
+        rollup = totals[key]
+        for measure in MEASURES:
+            value = row[measure] or 0
+            if isinstance(value, (Decimal, float)):
+                value = Decimal(value).quantize(CENT)
+            setattr(rollup, measure, getattr(rollup, measure) + value)
+    return list(totals.values())
+
+
+def recompute_range(start_day, end_day, now=None):
+    """Replace the rollups for days start_day..end_day (inclusive).
+    Returns the number of rows written."""
+    now = now or timezone.now()
+    start, _ = _day_bounds(start_day)
+    _, end = _day_bounds(end_day)
+    rows = _build_rows(start, end, now)
+    with transaction.atomic():
+        SalesRollup.objects.filter(date__gte=start_day, date__lte=end_day).delete()
+        SalesRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def recompute_products(day, product_ids, now=None):
+    """Replace the rollups for these products on one day. Returns the
+    number of rows written."""
+    now = now or timezone.now()
+    start, end = _day_bounds(day)
+    rows = _build_rows(start, end, now, products=product_ids)
+    with transaction.atomic():
+        SalesRollup.objects.filter(_product_filter(product_ids), date=day).delete()
+        SalesRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def mark_orders(order_ids):
+    """Queue the (day, product) rollups these orders count towards for the
+    next refresh. Call it before the order's items are gone."""
+    pairs = (
+        OrderItem.objects.filter(order_id__in=order_ids).annotate(day=TruncDate('order__created_at'))
+        .values_list('day', 'product_id').distinct().order_by()
+    )
+    SalesRollupChange.objects.bulk_create(
+        [SalesRollupChange(date=day, product_id=product_id) for day, product_id in pairs]
+    )
+
+
+def refresh_rollups(batch_size=REFRESH_BATCH):
+    """Recompute the (day, product) rollups queued by mark_orders(), or
+    build everything on the first run. Returns (changes, rows)."""
+    now = timezone.now()
+    if not SalesRollup.objects.exists():
+        # Changes queued from here on are not covered by the backfill
+        last = SalesRollupChange.objects.aggregate(last=Max('id'))['last']
+        _, written = backfill_rollups(now=now)
+        consumed = 0
+        if last is not None:
+            consumed, _ = SalesRollupChange.objects.filter(id__lte=last).delete()
+        return consumed, written
+
+    consumed = written = 0
+    while True:
+        changes = list(SalesRollupChange.objects.order_by('id').values_list('id', 'date', 'product_id')[:batch_size])
+        if not changes:
+            return consumed, written
+        products = defaultdict(set)
+        for _, day, product_id in changes:
+            products[day].add(product_id)
+        with transaction.atomic():
+            for day, product_ids in sorted(products.items()):
+                written += recompute_products(day, product_ids, now)
+            SalesRollupChange.objects.filter(id__in=[change_id for change_id, _, _ in changes]).delete()
+        consumed += len(changes)
+
+
+def backfill_rollups(start_day=None, end_day=None, chunk_days=BACKFILL_DAYS, now=None):
+    """Rebuild rollups for a date range (default: all order history),
+    chunk_days per transaction. Returns (days, rows)."""
+    now = now or timezone.now()
+    if start_day is None or end_day is None:
+        bounds = [
+            model.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+            for model in (Order, ArchivedOrder)
+        ]
+        firsts = [b['first'] for b in bounds if b['first']]
+        lasts = [b['last'] for b in bounds if b['last']]
+        if not firsts:
+            return 0, 0
+        start_day = start_day or timezone.localtime(min(firsts)).date()
+        end_day = end_day or timezone.localtime(max(lasts)).date()
+
+    days = written = 0
+    day = start_day
+    while day <= end_day:
+        last = min(day + timedelta(days=chunk_days - 1), end_day)
+        written += recompute_range(day, last, now)
+        days += (last - day).days + 1
+        day = last + timedelta(days=1)
+    return days, written
+
+
+def sales_summary(group_by='date', start=None, end=None, **filters):
+    """Totals from the rollup table, grouped by date, product, category or
+    brand, for days start..end (inclusive). Extra keyword arguments filter
+    the rollup rows, e.g. category_id=3."""
+    rollups = SalesRollup.objects.filter(**filters)
+    if start:
+        rollups = rollups.filter(date__gte=start)
+    if end:
+        rollups = rollups.filter(date__lte=end)
+    if group_by not in GROUPINGS:
+        raise ValueError(f'Cannot group sales by {group_by}')
+    summary = rollups.values(group_by).annotate(**{
+        measure: Sum(measure) for measure in MEASURES
+    }).order_by(group_by)
+    for row in summary:
+        row['net_revenue'] = (
+            (row['revenue'] or ZERO) - (row['discounts'] or ZERO)
+            - (row['cancelled_revenue'] or ZERO) - (row['returned_revenue'] or ZERO)
+        )
+        yield row
@@ -0,0 +1,62 @@
+from django.core.signals import setting_changed
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import Coupon, Order, ReturnRequest
+from . import metrics, profiling
+from .coupons import coupon_index, release_coupon
+from .orders import can_transition
+from .payments import reset_razorpay_client
+from .rollups import ORDER_FIELDS, mark_orders
+
+
+@receiver([post_save, post_delete], sender=Coupon)
+def invalidate_coupon_index(sender, **kwargs):
+    coupon_index.clear()
+
+
+@receiver(pre_delete, sender=Order)
+def release_deleted_order_coupon(sender, instance, **kwargs):
+    # An order deleted while it could still be cancelled never used its
+    # coupon; its redemption would otherwise hold the use with no order.
+    # Archived (delivered or cancelled) orders are left alone.
+    if can_transition(instance.order_status, 'cancelled'):
+        release_coupon(instance)
+        mark_orders([instance.pk])
+
+
+@receiver(post_save, sender=Order)
+def mark_saved_order(sender, instance, created, update_fields, **kwargs):
+    # A new order has no items yet; checkout saves it again once it has
+    if created or (update_fields is not None and not ORDER_FIELDS & update_fields):
+        return
+    mark_orders([instance.pk])
+
+
+@receiver(post_save, sender=ReturnRequest)
+def mark_returned_order(sender, instance, created, **kwargs):
+    # Only approved and completed returns count against sales
+    if not (created and instance.status == 'pending'):
+        mark_orders([instance.order_item.order_id])
+
+
+@receiver(setting_changed)
+def reset_payment_gateway(sender, setting, **kwargs):
+    if setting.startswith('RAZORPAY_'):
+        reset_razorpay_client()
+
+
+@receiver(setting_changed)
+def reset_metrics_file(sender, setting, **kwargs):
+    if setting == 'METRICS_DIR':
+        metrics.reset()
+
+
+@receiver(connection_created)
+def instrument_queries(sender, connection, **kwargs):
+    # Installed once per connection, for every thread: under ASGI the ORM
+    # runs in worker threads, out of reach of per-request execute_wrapper()s
+    for wrapper in (metrics.count_query, profiling.record_query):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
@@ -0,0 +1,241 @@
+"""
+Stock writes.
+
+Every stock change goes through here as a set-based UPDATE that is relative
+to the value in the row (stock = stock + delta), so checkout, cancellations
+and the warehouse feed add up instead of overwriting each other's work the
+way a read-modify-write save() does.
+
+The warehouse feed (apply_feed(), the sync_stock command) sends rows keyed
+by product slug with either a delta or an absolute count. An absolute count
+is the warehouse's view at some moment (as_of); orders placed after that
+moment (and not cancelled) are subtracted from it, so decrements the
+warehouse has not seen yet are not lost. Without as_of the count is taken
+as is. A feed file is applied in one transaction, in batches of UPDATEs:
+if it fails partway nothing is applied, so the file can be fixed and
+dropped again without counting its deltas twice.
+
+stock_changed is sent once the transaction commits, with the ids of the
+products whose stock was written, for anything caching per-product data.
+Products that went from in stock to none are counted in the stock_outs_total
+metric, at one extra COUNT per batch.
+"""
+import csv
+import json
+import os
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Expression, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import metrics
+from .catalog_import import records
+from .models import OrderItem, Product
+
+BATCH_SIZE = 500  # products per UPDATE
+MAX_ERRORS = 100
+
+# Sent with product_ids after the stock of those products changed
+stock_changed = Signal()
+
+
+def _changed(product_ids, stock_outs=0):
+    product_ids = sorted(product_ids)
+    transaction.on_commit(lambda: stock_changed.send(sender=Product, product_ids=product_ids))
+    if stock_outs:
+        transaction.on_commit(lambda: metrics.STOCK_OUTS.inc(stock_outs))
+
+
+class PerProduct(Expression):
+    """CASE id WHEN <id> THEN <value> ... ELSE 0 END for {id: value}. Unlike
+    Case(When(id=...)) it does not build a filter per product, which costs
+    far more than running the UPDATE."""
+    output_field = IntegerField()
+
+    def __init__(self, values):
+        super().__init__()
+        self.values = values
+        self.column = F('pk')
+
+    def get_source_expressions(self):
+        return [self.column]
+
+    def set_source_expressions(self, exprs):
+        self.column, = exprs
+
+    def as_sql(self, compiler, connection):
+        column, params = compiler.compile(self.column)
+        whens = ' '.join(['WHEN %s THEN %s'] * len(self.values))
+        params = [*params, *(value for pair in self.values.items() for value in pair)]
+        return f'CASE {column} {whens} ELSE 0 END', params
+
+
+def adjust_stock(deltas):
+    """Add deltas ({product id: units}, negative to take away) to stock.
+    Returns the number of products updated."""
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    ids = list(deltas)
+    updated = stock_outs = 0
+    now = timezone.now()
+    for i in range(0, len(ids), BATCH_SIZE):
+        batch = {product_id: deltas[product_id] for product_id in ids[i:i + BATCH_SIZE]}
+        updated += Product.objects.filter(id__in=batch).update(
+            stock=F('stock') + PerProduct(batch), updated_at=now,
+        )
+        taken = {product_id: delta for product_id, delta in batch.items() if delta < 0}
+        if taken:
+            # Out of stock now, and stock - delta (the old level) was above zero
+            stock_outs += Product.objects.filter(id__in=taken, stock__lte=0, stock__gt=PerProduct(taken)).count()
+    if ids:
+        _changed(ids, stock_outs)
+    return updated
+
+
+def ordered_since(as_of):
+    """Units of each product (OuterRef('pk')) in orders placed after as_of
+    that have not been cancelled."""
+    return Coalesce(Subquery(
+        OrderItem.objects.filter(product_id=OuterRef('pk'), order__created_at__gt=as_of)
+        .exclude(order__order_status='cancelled')
+        .values('product_id').annotate(units=Sum('quantity')).values('units')[:1],
+        output_field=IntegerField(),
+    ), 0)
+
+
+def set_stock(levels, as_of=None):
+    """Set stock to absolute levels ({product id: units}) counted at as_of,
+    less anything ordered since then. Returns the number of products
+    updated."""
+    ids = list(levels)
+    updated = stock_outs = 0
+    now = timezone.now()
+    for i in range(0, len(ids), BATCH_SIZE):
+        batch = {product_id: levels[product_id] for product_id in ids[i:i + BATCH_SIZE]}
+        stock = PerProduct(batch)
+        if as_of is not None:
+            stock = stock - ordered_since(as_of)
+        products = Product.objects.filter(id__in=batch)
+        stock_outs += products.filter(stock__gt=0).alias(new_stock=stock).filter(new_stock__lte=0).count()
+        updated += products.update(stock=stock, updated_at=now)
+    if ids:
+        _changed(ids, stock_outs)
+    return updated
+
+
+# Warehouse feed
+
+class FeedError(ValueError):
+    pass
+
+
+@dataclass
+class SyncStats:
+    rows: int = 0
+    set: int = 0
+    adjusted: int = 0
+    unknown_count: int = 0
+    unknown: list = field(default_factory=list)  # first MAX_ERRORS slugs not in the catalog
+    error_count: int = 0
+    errors: list = field(default_factory=list)  # first MAX_ERRORS (row number, message)
+
+    def error(self, number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((number, message))
+
+
+def parse_row(row, default_as_of=None):
+    """(slug, 'delta' or 'set', units, as_of) for one feed row: slug plus
+    either delta or stock, and optionally as_of (ISO 8601)."""
+    slug = str(row.get('slug') or '').strip()
+    if not slug:
+        raise FeedError('slug is required')
+    delta, stock = row.get('delta'), row.get('stock')
+    kind, value = ('delta', delta) if delta not in (None, '') else ('set', stock)
+    try:
+        units = int(value)
+    except (TypeError, ValueError):
+        raise FeedError(f'{slug}: needs a whole number delta or stock, got {value!r}')
+
+    as_of = default_as_of
+    if row.get('as_of'):
+        as_of = parse_datetime(str(row['as_of']))
+        if as_of is None:
+            raise FeedError(f'{slug}: as_of {row["as_of"]!r} is not a date and time')
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of)
+    return slug, kind, units, as_of
+
+
+def apply_rows(rows, stats):
+    """Apply one batch of parsed rows in a transaction. Deltas for a slug add
+    up; for absolute counts the last row wins and later deltas apply on top."""
+    ids = dict(Product.objects.filter(slug__in={slug for slug, *_ in rows}).values_list('slug', 'id'))
+    levels, deltas = {}, {}  # levels: {as_of: {id: units}}
+    for slug, kind, units, as_of in rows:
+        product_id = ids.get(slug)
+        if product_id is None:
+            stats.unknown_count += 1
+            if len(stats.unknown) < MAX_ERRORS:
+                stats.unknown.append(slug)
+            continue
+        if kind == 'set':
+            for group in levels.values():
+                group.pop(product_id, None)
+            levels.setdefault(as_of, {})[product_id] = units
+            deltas.pop(product_id, None)
+        else:
+            deltas[product_id] = deltas.get(product_id, 0) + units
+
+    with transaction.atomic():
+        for as_of, group in levels.items():
+            stats.set += set_stock(group, as_of)
+        stats.adjusted += adjust_stock(deltas)
+
+
+def apply_feed(path, fmt=None, as_of=None, batch_size=BATCH_SIZE * 4, stats=None):
+    """Apply a CSV or JSONL feed file in one transaction, batch_size rows at
+    a time."""
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    stats = stats or SyncStats()
+    with open(path, newline='' if fmt == 'csv' else None, encoding='utf-8') as f, transaction.atomic():
+        header = None
+        if fmt == 'csv':
+            header = [name.strip() for name in next(csv.reader([f.readline()]), [])]
+        batch = []
+        for number, record in enumerate(records(f, fmt, header), 1):
+            if fmt == 'jsonl':
+                if not record.strip():
+                    continue
+                try:
+                    record = json.loads(record)
+                except ValueError as e:
+                    stats.error(number, f'invalid JSON: {e}')
+                    continue
+            stats.rows += 1
+            try:
+                batch.append(parse_row(record, as_of))
+            except FeedError as e:
+                stats.error(number, str(e))
+                continue
+            if len(batch) >= batch_size:
+                apply_rows(batch, stats)
+                batch = []
+        if batch:
+            apply_rows(batch, stats)
+    return stats
+
+
+def pending_feeds(directory):
+    """Feed files waiting in a drop directory, oldest name first. Files
+    being written should be given another name (e.g. .tmp) until complete."""
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.endswith(('.csv', '.jsonl', '.ndjson')) and not name.startswith('.')
+    )
+    return [os.path.join(directory, name) for name in names if os.path.isfile(os.path.join(directory, name))]
+
@@ -0,0 +1,349 @@
+"""
+Synthetic catalog, customer and order data for load testing.
+
+generate() appends a deterministic data set of any size: the same seed,
+scale and starting database always produce the same rows. Work is split
+into chunks (products, users or orders), and each chunk is built by a pure
+function of (plan, chunk start, chunk stop) with its own seeded random
+generator.
+
+Building model instances and compiling them into INSERT statements costs
+far more than SQLite takes to run the statements, so both happen in worker
+processes: each worker turns its chunk into the same multi-row INSERTs
+bulk_create would issue (compiled raw, as loaddata does, so generated
+timestamps are kept). The main process only executes them, in order, one
+transaction per chunk. SQLite allows a single writer, so this is as far as
+the work can be spread.
+
+Every row gets an explicit primary key, allocated after the table's current
+maximum, so a chunk can refer to products, users or order lines made by
+other chunks without querying for their ids. Order lines get MAX_LINES ids
+per order, used from the start of each chunk's block.
+
+Users all share the password LOAD_TEST_PASSWORD, hashed once, and products
+all share one placeholder image, SYNTHETIC_IMAGE, written once; orders get
+it as their thumbnail, as checkout would. Orders are priced by
+pricing.quote(). The rows skip save() and its signals, so when the database
+already has sales rollups each order chunk is queued with mark_orders() for
+the next refresh (without rollups the first refresh builds everything).
+"""
+import io
+import multiprocessing
+import random
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import Max
+from django.db.models.sql import InsertQuery
+from django.utils import timezone
+from PIL import Image
+
+from .models import (
+    Address, Brand, Cart, CartItem, Category, Order, OrderItem, OrderStatusHistory, Product, ProductImage,
+    ProductSpecification, Review, SalesRollup, UserProfile,
+)
+from .pricing import line_total, quote
+from .rollups import mark_orders
+
+LOAD_TEST_PASSWORD = 'loadtest'
+SYNTHETIC_IMAGE = 'products/synthetic.jpg'
+CHUNK_SIZE = 5000
+MAX_LINES = 4  # order lines per order at most
+
+NOUNS = ('Phone', 'Laptop', 'TV', 'Headphones', 'Smartwatch', 'Tablet', 'Speaker', 'Camera', 'Monitor', 'Router')
+ADJECTIVES = ('Pro', 'Max', 'Lite', 'Ultra', 'Air', 'Plus', 'Mini', 'Neo', 'Prime', 'Edge')
+SPEC_NAMES = ('Display', 'Processor', 'RAM', 'Storage', 'Battery', 'Warranty')
+CITIES = (
+    ('Bengaluru', 'Karnataka'), ('Mumbai', 'Maharashtra'), ('Delhi', 'Delhi'), ('Chennai', 'Tamil Nadu'),
+    ('Hyderabad', 'Telangana'), ('Pune', 'Maharashtra'), ('Kolkata', 'West Bengal'), ('Jaipur', 'Rajasthan'),
+)
+IN_FLIGHT = ('pending', 'confirmed', 'packed', 'shipped', 'out_for_delivery')
+STATUS_PATH = ('pending', 'confirmed', 'packed', 'shipped', 'out_for_delivery', 'delivered')
+
+
+@dataclass
+class Plan:
+    """What to generate and where each table's explicit ids start."""
+    seed: int
+    categories: int
+    brands: int
+    products: int
+    users: int
+    orders: int
+    days: int
+    now: object
+    password: str = ''
+    first_id: dict = field(default_factory=dict)
+
+    def rng(self, kind, start):
+        return random.Random(f'{self.seed}:{kind}:{start}')
+
+    def product_id(self, index):
+        return self.first_id['product'] + index
+
+    def user_id(self, index):
+        return self.first_id['user'] + index
+
+
+def product_info(plan, index):
+    """(name, price, discount price) of product index, so order chunks can
+    price their lines without reading the product table."""
+    rng = plan.rng('product', index)
+    name = f'{rng.choice(NOUNS)} {rng.choice(ADJECTIVES)} {plan.product_id(index)}'
+    price = Decimal(rng.randrange(499, 150000))
+    discount = (price * Decimal(rng.randrange(70, 95)) / 100).quantize(Decimal('1')) if rng.random() < 0.4 else None
+    return name, price, discount
+
+
+def popular_product(rng, plan):
+    # Squaring skews sales towards low indexes: a few products sell a lot
+    return int(plan.products * rng.random() ** 2)
+
+
+def build_products(plan, start, stop):
+    rng = plan.rng('products', start)
+    products, images, specs = [], [], []
+    for index in range(start, stop):
+        pk = plan.product_id(index)
+        name, price, discount = product_info(plan, index)
+        products.append(Product(
+            id=pk, name=name, slug=f'synthetic-{pk}',
+            category_id=plan.first_id['category'] + index % plan.categories,
+            brand_id=plan.first_id['brand'] + rng.randrange(plan.brands),
+            description=f'{name}, generated for load testing.',
+            price=price, discount_price=discount, stock=rng.randrange(0, 500),
+            is_featured=rng.random() < 0.01, warranty_period=f'{rng.randrange(1, 3)} Year',
+            created_at=plan.now - timedelta(days=plan.days),
+        ))
+        images.append(ProductImage(id=plan.first_id['productimage'] + index, product_id=pk,
+                                   image=SYNTHETIC_IMAGE, is_primary=True))
+        specs.extend(
+            ProductSpecification(product_id=pk, name=spec, value=f'{spec} {rng.randrange(1, 64)}', order=position)
+            for position, spec in enumerate(SPEC_NAMES[:rng.randrange(3, len(SPEC_NAMES) + 1)])
+        )
+    return [(Product, products), (ProductImage, images), (ProductSpecification, specs)]
+
+
+def build_users(plan, start, stop):
+    rng = plan.rng('users', start)
+    users, profiles, addresses, carts, cart_items = [], [], [], [], []
+    for index in range(start, stop):
+        pk = plan.user_id(index)
+        users.append(User(
+            id=pk, username=f'loadtest{pk}', email=f'loadtest{pk}@example.com', password=plan.password,
+            first_name='Load', last_name=f'Tester {pk}', date_joined=plan.now - timedelta(days=plan.days),
+        ))
+        phone = f'9{rng.randrange(10 ** 9):09d}'
+        profiles.append(UserProfile(user_id=pk, phone=phone))
+        city, state = rng.choice(CITIES)
+        addresses.append(Address(
+            id=plan.first_id['address'] + index, user_id=pk, full_name=f'Load Tester {pk}', phone=phone,
+            address_line1=f'{rng.randrange(1, 999)} Test Street', city=city, state=state,
+            pincode=f'{rng.randrange(110000, 860000)}', is_default=True,
+        ))
+        cart = Cart(id=plan.first_id['cart'] + index, user_id=pk)
+        carts.append(cart)
+        if rng.random() < 0.3:
+            picked = {popular_product(rng, plan) for _ in range(rng.randrange(1, 4))}
+            cart_items.extend(
+                CartItem(cart_id=cart.id, product_id=plan.product_id(p), quantity=rng.randrange(1, 3)) for p in picked
+            )
+    return [(User, users), (UserProfile, profiles), (Address, addresses), (Cart, carts), (CartItem, cart_items)]
+
+
+def build_orders(plan, start, stop):
+    """Orders are spread evenly over the last plan.days days in id order, as
+    they would have been placed; older orders have reached a final status."""
+    rng = plan.rng('orders', start)
+    span = timedelta(days=plan.days).total_seconds()
+    next_line = plan.first_id['orderitem'] + start * MAX_LINES
+    orders, items, history, reviews = [], [], [], []
+    for index in range(start, stop):
+        pk = plan.first_id['order'] + index
+        user = rng.randrange(plan.users)
+        age = span * (1 - (index + rng.random()) / plan.orders)
+        created_at = plan.now - timedelta(seconds=age)
+
+        if age > 10 * 86400:
+            status = rng.choices(('delivered', 'cancelled', 'returned'), weights=(85, 10, 5))[0]
+        else:
+            status = rng.choice(IN_FLIGHT)
+        method = 'razorpay' if rng.random() < 0.6 else 'cod'
+        if status == 'returned' or (status == 'cancelled' and method == 'razorpay'):
+            payment = 'refunded'
+        elif status == 'delivered' or (method == 'razorpay' and status != 'pending'):
+            payment = 'completed'
+        else:
+            payment = 'failed' if method == 'razorpay' and status == 'pending' and rng.random() < 0.3 else 'pending'
+
+        order = Order(
+            id=pk, order_number=f'SYN{pk:012d}', user_id=plan.user_id(user),
+            address_id=plan.first_id['address'] + user, payment_method=method, order_status=status,
+            payment_status=payment, created_at=created_at, updated_at=created_at,
+            delivered_at=created_at + timedelta(days=rng.randrange(2, 8)) if status in ('delivered', 'returned') else None,
+        )
+        subtotal, count, lines = Decimal('0'), 0, []
+        for product in {popular_product(rng, plan) for _ in range(rng.choice((1, 1, 1, 2, 2, 3, MAX_LINES)))}:
+            name, price, discount = product_info(plan, product)
+            quantity = rng.choice((1, 1, 1, 1, 2, 3))
+            line = OrderItem(
+                id=next_line, order_id=pk, product_id=plan.product_id(product), product_name=name,
+                product_price=discount or price, quantity=quantity, total_price=line_total(price, discount, quantity),
+                return_deadline=(created_at + timedelta(days=10)).date(),
+            )
+            next_line += 1
+            lines.append(line)
+            subtotal += line.total_price
+            count += quantity
+        priced = quote(subtotal)
+        order.subtotal, order.shipping_charge, order.tax, order.total = (
+            priced.subtotal, priced.shipping, priced.tax, priced.total,
+        )
+        order.item_count = count
+        order.thumbnail = SYNTHETIC_IMAGE
+        orders.append(order)
+        items.extend(lines)
+
+        if status in ('cancelled', 'returned'):
+            path = ('pending', 'confirmed', status) if status == 'cancelled' else STATUS_PATH + ('returned',)
+        else:
+            path = STATUS_PATH[:STATUS_PATH.index(status) + 1]
+        history.extend(OrderStatusHistory(order_id=pk, status=step, created_at=created_at) for step in path)
+
+        if status == 'delivered':
+            for line in lines:
+                if rng.random() < 0.2:
+                    rating = rng.choices((1, 2, 3, 4, 5), weights=(5, 5, 10, 30, 50))[0]
+                    reviews.append(Review(
+                        product_id=line.product_id, user_id=order.user_id, order_item_id=line.id, rating=rating,
+                        title=f'{rating} stars', comment='Generated review.', is_verified_purchase=True,
+                        is_approved=rng.random() < 0.9, created_at=order.delivered_at, updated_at=order.delivered_at,
+                    ))
+    return [(Order, orders), (OrderItem, items), (OrderStatusHistory, history), (Review, reviews)]
+
+
+BUILDERS = {'products': build_products, 'users': build_users, 'orders': build_orders}
+
+
+def compile_inserts(model, objs, now):
+    """The INSERT statements bulk_create would run for objs, as (sql, params)
+    pairs. Compiled raw, so auto_now fields keep the values set on objs;
+    any left empty get now."""
+    db = connections[DEFAULT_DB_ALIAS]  # not the proxy: it is read per value
+    fields = model._meta.concrete_fields
+    stamped = [f.attname for f in fields if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)]
+    for obj in objs:
+        for attname in stamped:
+            if getattr(obj, attname) is None:
+                setattr(obj, attname, now)
+    size = min(1000, max(db.ops.bulk_batch_size(fields, objs), 1))
+    statements = []
+    for i in range(0, len(objs), size):
+        query = InsertQuery(model)
+        query.insert_values(fields, objs[i:i + size], raw=True)
+        statements.extend(query.get_compiler(connection=db).as_sql())
+    return statements
+
+
+def _start_worker():
+    django.setup()
+    # Drop the database handles inherited from the parent without closing
+    # them; workers only compile SQL.
+    for alias in connections:
+        connections[alias].connection = None
+
+
+def _build(task):
+    """Build one chunk in a worker: returns (kind, start, stop, [(model name,
+    rows, statements)])."""
+    plan, kind, start, stop = task
+    return kind, start, stop, [
+        (model._meta.model_name, len(objs), compile_inserts(model, objs, plan.now))
+        for model, objs in BUILDERS[kind](plan, start, stop) if objs
+    ]
+
+
+def _next_ids(*models):
+    return {
+        model._meta.model_name: (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        for model in models
+    }
+
+
+def make_plan(seed=0, products=1000, users=1000, orders=10000, categories=None, brands=None, days=365, now=None):
+    plan = Plan(
+        seed=seed, products=products, users=users, orders=orders,
+        categories=categories or max(10, products // 1000), brands=brands or max(20, products // 200),
+        days=days, now=now or timezone.now(), password=make_password(LOAD_TEST_PASSWORD, salt=f'loadtest{seed}'),
+    )
+    plan.first_id = _next_ids(
+        Category, Brand, Product, ProductImage, ProductSpecification, User, UserProfile, Address, Cart, CartItem,
+        Order, OrderItem, OrderStatusHistory, Review,
+    )
+    return plan
+
+
+def _tasks(plan, chunk_size):
+    for kind, total in (('products', plan.products), ('users', plan.users), ('orders', plan.orders)):
+        for start in range(0, total, chunk_size):
+            yield plan, kind, start, min(start + chunk_size, total)
+
+
+def write_placeholder_image():
+    if not default_storage.exists(SYNTHETIC_IMAGE):
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 400), (99, 102, 241)).save(buffer, 'JPEG')
+        default_storage.save(SYNTHETIC_IMAGE, ContentFile(buffer.getvalue()))
+
+
+def generate(plan, chunk_size=CHUNK_SIZE, workers=1, progress=None):
+    """Generate and insert everything in plan. progress(kind, done, rows) is
+    called after each chunk with the chunk kind, how many of that kind are
+    done and the rows the chunk inserted. Returns {model name: rows}."""
+    write_placeholder_image()
+    has_rollups = SalesRollup.objects.exists()
+    categories = [
+        Category(id=plan.first_id['category'] + i, name=f'Synthetic {NOUNS[i % len(NOUNS)]} {plan.first_id["category"] + i}',
+                 slug=f'synthetic-{plan.first_id["category"] + i}')
+        for i in range(plan.categories)
+    ]
+    brands = [
+        Brand(id=plan.first_id['brand'] + i, name=f'Synthetic Brand {plan.first_id["brand"] + i}',
+              slug=f'synthetic-brand-{plan.first_id["brand"] + i}')
+        for i in range(plan.brands)
+    ]
+    # Raw, like the chunks, so their timestamps are plan.now too
+    with transaction.atomic(), connection.cursor() as cursor:
+        for sql, params in compile_inserts(Category, categories, plan.now) + compile_inserts(Brand, brands, plan.now):
+            cursor.execute(sql, params)
+    counts = {'category': plan.categories, 'brand': plan.brands}
+
+    tasks = _tasks(plan, chunk_size)
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_start_worker)
+        results = pool.imap(_build, tasks)
+    else:
+        results = map(_build, tasks)
+    try:
+        for kind, start, stop, tables in results:
+            with transaction.atomic(), connection.cursor() as cursor:
+                for name, rows, statements in tables:
+                    for sql, params in statements:
+                        cursor.execute(sql, params)
+                    counts[name] = counts.get(name, 0) + rows
+                if kind == 'orders' and has_rollups:
+                    mark_orders(range(plan.first_id['order'] + start, plan.first_id['order'] + stop))
+            if progress:
+                progress(kind, stop, sum(rows for _, rows, _ in tables))
+    finally:
+        if pool:
+            pool.terminate()
+    return counts
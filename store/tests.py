@@ -1,3 +1,1955 @@
-from django.test import TestCase
+from datetime import datetime, timedelta
+from decimal import Decimal
+import copy
+import hashlib
+import hmac
+import io
+import json
+import marshal
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Sum
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.http import Http404, HttpResponse
+from django.urls import include, path, resolve, reverse
+from django.utils import timezone
+from django.utils.text import slugify
+from PIL import Image
+import requests
+
+from .models import (
+    Category, Brand, Product, ProductImage, UserProfile, Address, Cart, CartItem, Wishlist,
+    Coupon, CouponRedemption, Order, OrderItem, OrderStatusHistory, ArchivedOrder,
+    PaymentEvent, OutboxEmail, ReturnRequest, Review, Newsletter, ContactMessage, SalesRollup,
+    SalesRollupChange, ProductSpecification, RequestProfile,
+)
+from . import urls as store_urls
+from . import async_views, exports, forecasting, metrics, stock
+from .archive import archive_orders, get_order
+from .catalog_import import CatalogImporter
+from .coupons import CouponIndex, coupon_index, redeem_coupon, release_coupon
+from .emails import OTP_VALID_FOR, claim_batch, deliver_outbox, enqueue_email, enqueue_otp_email
+from .forecasting import forecast_stock
+from .orders import transition_orders
+from .payment_events import claim, process_payment_event, record_payment_event
+from .pagination import _estimates, _query_estimate
+from .replicas import PIN_COOKIE, replica_reads
+from .rollups import refresh_rollups, sales_summary
+from .synthetic import generate, make_plan
+from .stock import adjust_stock, apply_feed, stock_changed
+from .payments import PaymentGatewayClient, RetryBudget, payment_signature, verify_payment_signature
+from .pricing import price_cart, price_order, quote, reprice_carts, reprice_orders
+
+# Shared fixtures
+
+def create_shopper(username='shopper', **fields):
+    """A customer, password 'secret'."""
+    return User.objects.create_user(username, f'{username}@example.com', 'secret', **fields)
+
+
+def create_staff():
+    return User.objects.create_user('staff', password='secret', is_staff=True, is_superuser=True)
+
+
+def create_address(user, **fields):
+    return Address.objects.create(user=user, full_name='Test Shopper', phone='9999999999',
+                                  address_line1='1 Test Street', city='Bengaluru', state='Karnataka',
+                                  pincode='560001', **fields)
+
+
+def create_category(name='Phones'):
+    return Category.objects.get_or_create(slug=slugify(name), defaults={'name': name})[0]
+
+
+def create_product(name='Phone', category=None, **fields):
+    """A product at 999.00 with 10 in stock, in the Phones category unless
+    given another."""
+    fields = {'slug': slugify(name), 'description': f'A {name.lower()}', 'price': Decimal('999.00'), 'stock': 10,
+              **fields}
+    return Product.objects.create(name=name, category=category or create_category(), **fields)
+
+
+class ShopperTestData:
+    """Test data for one shopper buying one product: cls.user, cls.address,
+    cls.category and cls.product, with PRODUCT_STOCK in stock."""
+
+    PRODUCT_STOCK = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = create_shopper()
+        cls.address = create_address(cls.user)
+        cls.category = create_category()
+        cls.product = create_product(category=cls.category, stock=cls.PRODUCT_STOCK)
+
+
+# A step that reads a whole table, directly or through an index
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(?!CONSTANT ROW)(\w+)(?: USING (?:COVERING )?INDEX (\w+))?')
+
+
+class AdminChangelistQueryBudgetTests(TestCase):
+    """Every store changelist renders in a fixed number of queries, however
+    many rows the table holds."""
+
+    ROWS = 10000
+    QUERY_BUDGET = 8
+
+    @classmethod
+    def setUpTestData(cls):
+        n = cls.ROWS
+        now = timezone.now()
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+        User.objects.bulk_create(User(username=f'shopper{i}', email=f'shopper{i}@example.com', password='!') for i in range(n))
+        users = list(User.objects.filter(username__startswith='shopper').order_by('id'))
+        Category.objects.bulk_create(Category(name=f'Category {i}', slug=f'category-{i}') for i in range(n))
+        Brand.objects.bulk_create(Brand(name=f'Brand {i}', slug=f'brand-{i}') for i in range(n))
+        categories = list(Category.objects.order_by('id'))
+        brands = list(Brand.objects.order_by('id'))
+        Product.objects.bulk_create(
+            Product(
+                name=f'Product {i}', slug=f'product-{i}', category=categories[i], brand=brands[i],
+                description='Test product', price=Decimal('999.00'),
+                discount_price=Decimal('899.00') if i % 2 else None, stock=i % 20,
+            )
+            for i in range(n)
+        )
+        products = list(Product.objects.order_by('id'))
+
+        ProductImage.objects.bulk_create(ProductImage(product=p, image='products/test.jpg') for p in products)
+        UserProfile.objects.bulk_create(UserProfile(user=u) for u in users)
+        Address.objects.bulk_create(
+            Address(user=u, full_name='Test Shopper', phone='9999999999', address_line1='1 Test Street',
+                    city='Bengaluru', state='Karnataka', pincode='560001')
+            for u in users
+        )
+        Cart.objects.bulk_create(Cart(user=u) for u in users)
+        carts = list(Cart.objects.order_by('id'))
+        CartItem.objects.bulk_create(CartItem(cart=c, product=p, quantity=2) for c, p in zip(carts, products))
+        Wishlist.objects.bulk_create(Wishlist(user=u, product=p) for u, p in zip(users, products))
+        Coupon.objects.bulk_create(
+            Coupon(code=f'CODE{i}', discount_type='fixed', discount_value=Decimal('50'),
+                   valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=30), usage_limit=n)
+            for i in range(n)
+        )
+        coupons = list(Coupon.objects.order_by('id'))
+
+        Order.objects.bulk_create(
+            Order(order_number=f'FLGTEST{i:07d}', user=u, subtotal=Decimal('899.00'), total=Decimal('949.00'),
+                  payment_method='cod', coupon=c)
+            for i, (u, c) in enumerate(zip(users, coupons))
+        )
+        orders = list(Order.objects.order_by('id'))
+        OrderItem.objects.bulk_create(
+            OrderItem(order=o, product=p, product_name=p.name, product_price=Decimal('899.00'),
+                      quantity=1, total_price=Decimal('899.00'))
+            for o, p in zip(orders, products)
+        )
+        OrderStatusHistory.objects.bulk_create(OrderStatusHistory(order=o, status='pending') for o in orders)
+        items = list(OrderItem.objects.order_by('id'))
+        CouponRedemption.objects.bulk_create(
+            CouponRedemption(coupon=c, user=o.user_id and u, order=o) for c, o, u in zip(coupons, orders, users)
+        )
+        ArchivedOrder.objects.bulk_create(
+            ArchivedOrder(id=10 ** 7 + i, order_number=f'FLGARCH{i:07d}', user=u, subtotal=Decimal('899.00'),
+                          total=Decimal('949.00'), order_status='delivered', payment_method='cod',
+                          payment_status='completed', created_at=now, updated_at=now)
+            for i, u in enumerate(users)
+        )
+        PaymentEvent.objects.bulk_create(
+            PaymentEvent(razorpay_payment_id=f'pay_{i}', razorpay_order_id=f'order_{i}') for i in range(n)
+        )
+        OutboxEmail.objects.bulk_create(
+            OutboxEmail(subject=f'Email {i}', body='Hello', from_email='noreply@example.com',
+                        recipients=[f'shopper{i}@example.com'])
+            for i in range(n)
+        )
+        ReturnRequest.objects.bulk_create(
+            ReturnRequest(order_item=item, user=u, reason='other', description='Test return')
+            for item, u in zip(items, users)
+        )
+        Review.objects.bulk_create(
+            Review(product=p, user=u, order_item=item, rating=5, title='Great', comment='Works well')
+            for p, u, item in zip(products, users, items)
+        )
+        SalesRollup.objects.bulk_create(
+            SalesRollup(date=now.date() - timedelta(days=i % 365), product=p, category_id=p.category_id,
+                        brand_id=p.brand_id, orders=1, units=1, revenue=p.price, refreshed_at=now)
+            for i, p in enumerate(products)
+        )
+        RequestProfile.objects.bulk_create(
+            RequestProfile(user=u, kind='all', method='GET', path=f'/products/?page={i}', view_name='product_list',
+                           status_code=200, duration_ms=12.5, cpu_stats=b'{}', allocations=[])
+            for i, u in enumerate(users)
+        )
+        Newsletter.objects.bulk_create(Newsletter(email=f'reader{i}@example.com') for i in range(n))
+        ContactMessage.objects.bulk_create(
+            ContactMessage(name='Shopper', email='shopper@example.com', subject=f'Question {i}', message='Hi')
+            for i in range(n)
+        )
+
+        # Give the estimated-count paginator statistics to work with
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        _estimates.clear()
+        self.client.force_login(self.admin_user)
+
+    def test_changelists_stay_within_query_budget(self):
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label != 'store':
+                continue
+            url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+            with self.subTest(model=model.__name__):
+                self.assertGreaterEqual(model.objects.count(), self.ROWS)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(
+                    len(queries), self.QUERY_BUDGET,
+                    '\n'.join(query['sql'] for query in queries.captured_queries),
+                )
+
+    def test_cart_changelist_totals_match_cart_pricing(self):
+        cart = Cart.objects.order_by('id').first()
+        response = self.client.get(reverse('admin:store_cart_changelist'), {'q': cart.user.username})
+        self.assertContains(response, f'₹{cart.subtotal}')
+
+    def test_filtered_changelist_uses_exact_count(self):
+        response = self.client.get(reverse('admin:store_product_changelist'), {'is_featured__exact': '1'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+
+class RowEstimateTests(TestCase):
+    def test_partial_indexes_do_not_shrink_the_estimate(self):
+        # The listing indexes on Product only cover active products
+        category = create_category()
+        Product.objects.bulk_create(
+            Product(name=f'Phone {i}', slug=f'phone-{i}', category=category, description='A phone',
+                    price=Decimal('999.00'), is_active=i % 10 == 0)
+            for i in range(200)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(_query_estimate(connection, Product._meta.db_table), 200)
+
+
+class QueryPlanTests(TestCase):
+    """The queries behind the storefront pages and payment lookups use
+    indexes: EXPLAIN QUERY PLAN shows no full scan of a large table."""
+
+    # A few dozen rows at most; reading them whole is the cheapest plan
+    SMALL_TABLES = {'store_category', 'store_brand'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_shopper()
+        UserProfile.objects.create(user=cls.user)
+        cls.category = create_category()
+        cls.brand = Brand.objects.create(name='Acme', slug='acme')
+        cls.products = [
+            create_product(f'Phone {i}', cls.category, brand=cls.brand, is_featured=i == 0) for i in range(3)
+        ]
+        ProductImage.objects.create(product=cls.products[0], image='products/test.jpg', is_primary=True)
+        address = create_address(cls.user)
+        cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.create(cart=cart, product=cls.products[1], quantity=1)
+        Wishlist.objects.create(user=cls.user, product=cls.products[2])
+        cls.order = Order.objects.create(
+            user=cls.user, address=address, subtotal=Decimal('999.00'), total=Decimal('999.00'),
+            payment_method='razorpay', order_status='delivered', razorpay_order_id='order_test',
+        )
+        item = OrderItem.objects.create(order=cls.order, product=cls.products[0], product_name='Phone 0',
+                                        product_price=Decimal('999.00'), quantity=1, total_price=Decimal('999.00'))
+        Review.objects.create(product=cls.products[0], user=cls.user, order_item=item, rating=5,
+                              title='Great', comment='Works well', is_approved=True)
+
+    def assertNoFullScans(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[3] for row in cursor.fetchall()]
+            # Scanning a partial index reads only the rows the query wants
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")
+            partial = {name for name, in cursor.fetchall()}
+        scans = [
+            match.group(1) for match in map(FULL_SCAN.match, plan)
+            if match and match.group(1) not in self.SMALL_TABLES and match.group(2) not in partial
+        ]
+        self.assertFalse(scans, f'{sql}\n' + '\n'.join(plan))
+
+    def assertPageUsesIndexes(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                self.assertNoFullScans(query['sql'])
+
+    def test_catalog_pages(self):
+        product = self.products[0]
+        pages = [
+            (reverse('home'), {}),
+            (reverse('product_list'), {}),
+            (reverse('product_list'), {'category': 'phones'}),
+            (reverse('product_list'), {'brand': 'acme'}),
+            (reverse('product_list'), {'sort': 'price'}),
+            (reverse('product_list'), {'sort': '-price'}),
+            (reverse('product_list'), {'category': 'phones', 'sort': 'price'}),
+            (reverse('product_detail', args=[product.slug]), {}),
+            # Not search_suggestions: a substring match has no index to use; it
+            # reads product_listing_idx in order and stops at the fifth match
+        ]
+        for logged_in in (False, True):
+            if logged_in:
+                self.client.force_login(self.user)
+            for url, params in pages:
+                with self.subTest(url=url, logged_in=logged_in, **params):
+                    self.assertPageUsesIndexes(url, **params)
+
+    def test_account_pages(self):
+        self.client.force_login(self.user)
+        for url in (reverse('cart'), reverse('wishlist'), reverse('order_list'),
+                    reverse('order_detail', args=[self.order.id]), reverse('profile')):
+            with self.subTest(url=url):
+                self.assertPageUsesIndexes(url)
+
+    def test_payment_lookups(self):
+        for queryset in (
+            Order.objects.filter(razorpay_order_id='order_test'),
+            PaymentEvent.objects.filter(razorpay_order_id='order_test'),
+        ):
+            self.assertNoFullScans(*queryset.query.sql_with_params())
+
+
+class ViewBudgetTests(TestCase):
+    """Every URL in store/urls.py, anonymous and signed in, within a query
+    and a wall-time budget.
+
+    The shopper's pages are full (a page of products, a cart and a wishlist
+    of several products, a page of orders), so an N+1 in a view or template
+    blows the query budget. Each request runs twice inside a rolled-back
+    savepoint, and the second run is measured. Query budgets are always
+    checked. Time budgets only when PERF_BUDGET_SCALE is set (1 as written,
+    more on slow machines), since wall time varies between runs. With
+    PERF_REPORT set, the measurements are written there as JSON to diff
+    between commits.
+    """
+
+    PRODUCTS = 40
+    CART_ITEMS = 6
+    ORDERS = 12
+    ITEMS_PER_ORDER = 3
+    KEY_ID, KEY_SECRET, WEBHOOK_SECRET = 'rzp_test_budget', 'budget_secret', 'budget_webhook_secret'
+    METRICS_TOKEN = 'budget_metrics_token'
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.user = create_shopper()
+        UserProfile.objects.create(user=cls.user)
+        cls.address = create_address(cls.user, is_default=True)
+        categories = Category.objects.bulk_create(Category(name=f'Category {i}', slug=f'category-{i}') for i in range(4))
+        brands = Brand.objects.bulk_create(Brand(name=f'Brand {i}', slug=f'brand-{i}') for i in range(4))
+        Product.objects.bulk_create(
+            Product(name=f'Phone {i}', slug=f'phone-{i}', category=categories[i % 4], brand=brands[i % 4],
+                    description='A phone', price=Decimal('999.00') + i, stock=100, is_featured=i % 3 == 0,
+                    discount_price=Decimal('899.00') if i % 2 else None)
+            for i in range(cls.PRODUCTS)
+        )
+        cls.products = products = list(Product.objects.order_by('id'))
+        ProductImage.objects.bulk_create(
+            ProductImage(product=p, image=f'products/{p.slug}-{n}.jpg', is_primary=n == 0)
+            for p in products for n in range(2)
+        )
+        ProductSpecification.objects.bulk_create(
+            ProductSpecification(product=p, name=f'Spec {n}', value='Value', order=n) for p in products for n in range(4)
+        )
+
+        cart = Cart.objects.create(user=cls.user)
+        cls.cart_items = CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=p, quantity=1) for p in products[:cls.CART_ITEMS]
+        )
+        cls.wishlist = Wishlist.objects.bulk_create(
+            Wishlist(user=cls.user, product=p) for p in products[-cls.CART_ITEMS:]
+        )
+        Coupon.objects.create(code='SAVE50', discount_type='fixed', discount_value=Decimal('50'),
+                              valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=30), usage_limit=100)
+
+        cls.orders = []
+        for n in range(cls.ORDERS):
+            order = Order.objects.create(
+                user=cls.user, address=cls.address, subtotal=Decimal('2997.00'), total=Decimal('2997.00'),
+                payment_method='razorpay', order_status='delivered' if n else 'confirmed',
+                razorpay_order_id=f'order_budget_{n}',
+            )
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=p, product_name=p.name, product_price=p.price, quantity=1,
+                          total_price=p.price, return_deadline=now.date() + timedelta(days=7))
+                for p in products[n:n + cls.ITEMS_PER_ORDER]
+            )
+            OrderStatusHistory.objects.create(order=order, status=order.order_status)
+            order.refresh_summary()
+            cls.orders.append(order)
+        cls.order = cls.orders[0]  # confirmed, so it can still be cancelled
+        cls.delivered_item = cls.orders[1].items.order_by('id').first()
+
+        reviewer = User.objects.create_user('reviewer', 'reviewer@example.com', 'secret')
+        Review.objects.bulk_create(
+            Review(product=products[1], user=reviewer, rating=4, title=f'Review {n}', comment='Good', is_approved=True)
+            for n in range(8)
+        )
+
+    # Wall-time budgets (ms): pages render templates; actions redirect or
+    # return JSON; password hashing is slow by design
+    PAGE_MS, ACTION_MS, HASHING_MS = 150, 100, 2000
+
+    def cases(self):
+        """(name, method, url, data, signed in, status, query budget, ms budget)"""
+        product, item = self.products[1], self.delivered_item
+        paid = {'razorpay_order_id': self.order.razorpay_order_id, 'razorpay_payment_id': 'pay_budget'}
+        paid['razorpay_signature'] = payment_signature(paid['razorpay_order_id'], paid['razorpay_payment_id'],
+                                                       self.KEY_SECRET)
+        webhook = json.dumps({'event': 'payment.captured', 'payload': {'payment': {'entity': {
+            'id': 'pay_budget_hook', 'order_id': self.order.razorpay_order_id}}}})
+        page, action = self.PAGE_MS, self.ACTION_MS
+        cases = []
+        # Open to everyone: (anonymous, signed in) query budgets. Signing in
+        # costs the session, the user and the cart badge on HTML pages.
+        for name, method, url, data, status, queries, ms in [
+            ('home', 'get', reverse('home'), None, 200, (6, 9), page),
+            ('product_list', 'get', reverse('product_list'), None, 200, (5, 8), page),
+            ('product_list', 'get', reverse('product_list'), {'category': 'category-1', 'sort': 'price'},
+             200, (5, 8), page),
+            ('product_list', 'get', reverse('product_list'), {'q': 'phone', 'page': '2'}, 200, (5, 8), page),
+            ('product_detail', 'get', reverse('product_detail', args=[product.slug]), None, 200, (7, 11), page),
+            ('search_suggestions', 'get', reverse('search_suggestions'), {'q': 'phone'}, 200, (2, 2), action),
+            ('contact', 'get', reverse('contact'), None, 200, (0, 3), page),
+            ('contact', 'post', reverse('contact'), {'name': 'Shopper', 'email': 'shopper@example.com',
+                                                     'subject': 'Hi', 'message': 'Hello'}, 302, (1, 1), action),
+            ('subscribe_newsletter', 'post', reverse('subscribe_newsletter'), {'email': 'reader@example.com'},
+             200, (4, 4), action),
+            ('verify_payment', 'post', reverse('verify_payment'), json.dumps(paid), 200, (4, 4), action),
+            ('razorpay_webhook', 'post', reverse('razorpay_webhook'), webhook, 200, (3, 3), action),
+            ('metrics', 'get', reverse('metrics'), None, 200, (0, 0), action),
+        ]:
+            for signed_in in (False, True):
+                cases.append((name, method, url, data, signed_in, status, queries[signed_in], ms))
+
+        cases += [
+            ('register', 'get', reverse('register'), None, False, 200, 0, page),
+            ('register', 'post', reverse('register'), {'username': 'newshopper', 'email': 'new@example.com',
+                                                       'password': 'x-secret-1', 'password2': 'x-secret-1'},
+             False, 302, 5, self.HASHING_MS),
+            ('login', 'get', reverse('login'), None, False, 200, 0, page),
+            ('login', 'post', reverse('login'), {'username': 'shopper', 'password': 'secret'},
+             False, 302, 9, self.HASHING_MS),
+            ('forgot_password', 'get', reverse('forgot_password'), None, False, 200, 0, page),
+            ('forgot_password', 'post', reverse('forgot_password'), {'email': 'shopper@example.com'},
+             False, 302, 6, action),
+            ('verify_otp', 'get', reverse('verify_otp'), None, False, 200, 0, page),
+            ('reset_password', 'get', reverse('reset_password'), None, False, 302, 0, action),
+            # Pages that need a session redirect anonymous visitors to login
+            ('cart', 'get', reverse('cart'), None, False, 302, 0, action),
+            ('checkout', 'get', reverse('checkout'), None, False, 302, 0, action),
+            ('order_list', 'get', reverse('order_list'), None, False, 302, 0, action),
+
+            ('logout', 'get', reverse('logout'), None, True, 302, 4, action),
+            ('profile', 'get', reverse('profile'), None, True, 200, 4, page),
+            ('profile', 'post', reverse('profile'), {'first_name': 'Test', 'last_name': 'Shopper',
+                                                     'email': 'shopper@example.com', 'phone': '9999999999'},
+             True, 302, 5, action),
+            ('address_list', 'get', reverse('address_list'), None, True, 200, 4, page),
+            ('add_address', 'get', reverse('add_address'), None, True, 200, 3, page),
+            ('add_address', 'post', reverse('add_address'), {
+                'full_name': 'Test Shopper', 'phone': '9999999999', 'address_line1': '2 Test Street',
+                'city': 'Bengaluru', 'state': 'Karnataka', 'pincode': '560001'}, True, 302, 3, action),
+            ('edit_address', 'get', reverse('edit_address', args=[self.address.id]), None, True, 200, 4, page),
+            ('delete_address', 'get', reverse('delete_address', args=[self.address.id]), None, True, 302, 6, action),
+            ('cart', 'get', reverse('cart'), None, True, 200, 6, page),
+            ('add_to_cart', 'get', reverse('add_to_cart', args=[self.products[20].id]), None, True, 302, 8, action),
+            ('update_cart', 'post', reverse('update_cart', args=[self.cart_items[0].id]), {'quantity': '2'},
+             True, 200, 5, action),
+            ('remove_from_cart', 'get', reverse('remove_from_cart', args=[self.cart_items[0].id]), None,
+             True, 302, 5, action),
+            ('wishlist', 'get', reverse('wishlist'), None, True, 200, 5, page),
+            ('add_to_wishlist', 'get', reverse('add_to_wishlist', args=[self.products[20].id]), None,
+             True, 302, 7, action),
+            ('remove_from_wishlist', 'get', reverse('remove_from_wishlist', args=[self.wishlist[0].id]), None,
+             True, 302, 5, action),
+            ('checkout', 'get', reverse('checkout'), None, True, 200, 8, page),
+            ('checkout', 'post', reverse('checkout'), {'address_id': self.address.id, 'payment_method': 'cod',
+                                                       'coupon_code': 'SAVE50'}, True, 302, 25, page),
+            ('apply_coupon', 'post', reverse('apply_coupon'), {'coupon_code': 'SAVE50'}, True, 200, 4, action),
+            ('razorpay_callback', 'post', reverse('razorpay_callback'), {**paid, 'order_id': self.order.id},
+             True, 302, 6, action),
+            ('order_list', 'get', reverse('order_list'), None, True, 200, 6, page),
+            ('order_success', 'get', reverse('order_success', args=[self.order.order_number]), None,
+             True, 200, 4, page),
+            ('order_detail', 'get', reverse('order_detail', args=[self.order.id]), None, True, 200, 7, page),
+            ('cancel_order', 'get', reverse('cancel_order', args=[self.order.id]), None, True, 302, 14, action),
+            # Submitted from the order and product pages
+            ('request_return', 'post', reverse('request_return', args=[item.id]),
+             {'reason': 'defective', 'description': 'Broken'}, True, 302, 5, action),
+            ('add_review', 'post', reverse('add_review', args=[item.product_id]),
+             {'rating': '5', 'title': 'Great', 'comment': 'Works well'}, True, 302, 5, action),
+        ]
+        return cases
+
+    def request(self, method, url, data, signed_in):
+        """Run one request in a savepoint that is rolled back. Returns
+        (response, SQL of the queries run, seconds)."""
+        self.client.logout()
+        if signed_in:
+            self.client.force_login(self.user)
+        kwargs = {'content_type': 'application/json'} if isinstance(data, str) else {}  # JSON bodies
+        if url == reverse('razorpay_webhook'):
+            kwargs['headers'] = {'X-Razorpay-Signature': hmac.new(
+                self.WEBHOOK_SECRET.encode(), data.encode(), hashlib.sha256).hexdigest()}
+        if url == reverse('metrics'):
+            kwargs['headers'] = {'Authorization': f'Bearer {self.METRICS_TOKEN}'}
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = getattr(self.client, method)(url, data, **kwargs)
+                elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        return response, [query['sql'] for query in queries.captured_queries], elapsed
+
+    def test_order_list_shows_summary_and_items(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('order_list'))
+        newest = self.orders[-1]
+        self.assertEqual(newest.thumbnail.name, f'products/{self.products[len(self.orders) - 1].slug}-0.jpg')
+        self.assertContains(response, f'src="{newest.thumbnail.url}"')
+        self.assertContains(response, f'{self.ITEMS_PER_ORDER} items')
+        for item in newest.items.all():
+            self.assertContains(response, item.product_name)
+            self.assertContains(response, f'Quantity: {item.quantity} × ₹{item.product_price}')
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in store_urls.urlpatterns}
+        self.assertEqual(names - {case[0] for case in self.cases()}, set())
+
+    def test_views_within_budget(self):
+        scale = os.environ.get('PERF_BUDGET_SCALE')
+        report = {}
+        with override_settings(RAZORPAY_KEY_ID=self.KEY_ID, RAZORPAY_KEY_SECRET=self.KEY_SECRET,
+                               RAZORPAY_WEBHOOK_SECRET=self.WEBHOOK_SECRET, PAYMENT_EVENTS_ASYNC=False,
+                               METRICS_TOKEN=self.METRICS_TOKEN):
+            for name, method, url, data, signed_in, status, max_queries, max_ms in self.cases():
+                label = f'{name} {method.upper()} {"signed in" if signed_in else "anonymous"}'
+                if data and method == 'get':
+                    label += ' ?' + '&'.join(f'{k}={v}' for k, v in sorted(data.items()))
+                self.request(method, url, data, signed_in)  # warm up
+                response, queries, elapsed = self.request(method, url, data, signed_in)
+                report[label] = {
+                    'status': response.status_code, 'queries': len(queries), 'ms': round(elapsed * 1000, 1),
+                    'max_queries': max_queries, 'max_ms': max_ms,
+                }
+                with self.subTest(label):
+                    self.assertEqual(response.status_code, status)
+                    self.assertLessEqual(len(queries), max_queries, '\n'.join(queries))
+                    if scale:
+                        self.assertLessEqual(elapsed * 1000, max_ms * float(scale))
+
+        path = os.environ.get('PERF_REPORT')
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write('\n')
+
+
+class RequestProfileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_product()
+
+    @override_settings(REQUEST_PROFILE_SAMPLE_RATE=1, REQUEST_PROFILE_SLOW_QUERIES=2)
+    def test_profiled_request(self):
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('store.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('product_detail', args=[self.product.slug]))
+        self.assertEqual(response.status_code, 200)
+        timings = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'db', 'tpl', 'view', 'app', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['view'], record['status'], record['queries']), ('product_detail', 200, len(queries)))
+        self.assertGreater(record['template_ms'], 0)
+        self.assertGreaterEqual(record['view_ms'], record['template_ms'])
+        self.assertAlmostEqual(record['total_ms'],
+                               record['sql_ms'] + record['template_ms'] + record['app_ms'], delta=0.05)
+        self.assertEqual(len(record['slow_queries']), 2)
+        self.assertGreaterEqual(record['slow_queries'][0]['ms'], record['slow_queries'][1]['ms'])
+        self.assertTrue(record['slow_queries'][0]['sql'].startswith('SELECT'))
+
+    def test_off_by_default(self):
+        response = self.client.get(reverse('product_detail', args=[self.product.slug]))
+        self.assertNotIn('Server-Timing', response)
+
+
+class OnDemandProfileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = create_staff()
+        cls.shopper = create_shopper()
+        create_product()
+
+    def test_staff_profile(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('product_list'), {'_profile': 'all'})
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get()
+        self.assertEqual(response['X-Profile'], reverse('admin:store_requestprofile_change', args=[profile.pk]))
+        self.assertEqual((profile.view_name, profile.status_code, profile.user), ('product_list', 200, self.staff))
+        self.assertIn('cumulative', profile.cpu_summary)
+        self.assertTrue(profile.allocations)
+        self.assertGreater(profile.peak_memory_kib, 0)
+
+        download = self.client.get(reverse('admin:store_requestprofile_download', args=[profile.pk]))
+        self.assertEqual(download.status_code, 200)
+        # pstats data: {(file, line, function): timings}
+        self.assertIn('product_list', {function for _, _, function in marshal.loads(download.content)})
+        self.assertContains(self.client.get(response['X-Profile']), 'Top Allocation Sites')
+
+    def test_header_and_kind(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse('home'), headers={'X-Profile': 'cpu'})
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.kind, profile.allocations, profile.peak_memory_kib), ('cpu', [], None))
+        self.assertTrue(profile.cpu_stats)
+
+    def test_ignored_for_shoppers(self):
+        self.client.force_login(self.shopper)
+        response = self.client.get(reverse('home'), {'_profile': 'all'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+
+def _count_in_child(times):
+    for _ in range(times):
+        metrics.STOCK_OUTS.inc()
+
+
+class MetricsTests(ShopperTestData, TestCase):
+    PRODUCT_STOCK = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        CartItem.objects.create(cart=Cart.objects.create(user=cls.user), product=cls.product, quantity=1)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        overridden = override_settings(METRICS_DIR=self.directory, METRICS_TOKEN='scrape-token')
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def scrape(self, **headers):
+        headers.setdefault('Authorization', 'Bearer scrape-token')
+        response = self.client.get(reverse('metrics'), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_requests_and_checkout(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('home'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('checkout'), {'address_id': self.address.id, 'payment_method': 'cod'})
+        self.assertEqual(response.status_code, 302)
+
+        exposition = self.scrape()
+        for line in [
+            'http_requests_total{view="home",method="GET",status="200"} 1',
+            'http_requests_total{view="checkout",method="POST",status="302"} 1',
+            'http_request_duration_seconds_bucket{view="home",le="+Inf"} 1',
+            'http_request_duration_seconds_count{view="home"} 1',
+            'checkouts_total{payment_method="cod",outcome="placed"} 1',
+            'stock_outs_total 1',
+            '# TYPE http_request_duration_seconds histogram',
+        ]:
+            self.assertIn(line, exposition.splitlines())
+        self.assertRegex(exposition, r'db_queries_total\{view="checkout"\} [1-9]\d*')
+
+    def test_processes_are_added_up(self):
+        metrics.STOCK_OUTS.inc(2)
+        context = multiprocessing.get_context('fork')
+        children = [context.Process(target=_count_in_child, args=(500,)) for _ in range(2)]
+        for child in children:
+            child.start()
+        for child in children:
+            child.join()
+            self.assertEqual(child.exitcode, 0)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        self.assertIn('stock_outs_total 1002', self.scrape().splitlines())
+
+    def test_scrape_needs_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code,
+                         403)
+        self.scrape()
+
+    @override_settings(METRICS_TOKEN='')
+    def test_local_scrape_without_token_only_in_debug(self):
+        # The test client's REMOTE_ADDR is 127.0.0.1, as behind a local proxy
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with override_settings(DEBUG=True):
+            self.scrape(Authorization='')
+
+
+class AsyncCatalogURLs:
+    """URLconf with the catalog routed as under flugede/asgi.py."""
+    urlpatterns = [
+        path('', async_views.home, name='home'),
+        path('products/', async_views.product_list, name='product_list'),
+        path('product/<slug:slug>/', async_views.product_detail, name='product_detail'),
+        path('search-suggestions/', async_views.search_suggestions, name='search_suggestions'),
+        path('', include('flugede.urls')),
+    ]
+
+
+class AsyncCatalogTests(TestCase):
+    """The coroutine catalog views show what the sync ones do, and the
+    store's middleware keeps working when requests are served async."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_shopper()
+        cls.staff = create_staff()
+        address = create_address(cls.user)
+        categories = Category.objects.bulk_create(Category(name=f'Category {i}', slug=f'category-{i}') for i in range(2))
+        brands = Brand.objects.bulk_create(Brand(name=f'Brand {i}', slug=f'brand-{i}') for i in range(2))
+        Product.objects.bulk_create(
+            Product(name=f'Phone {i}', slug=f'phone-{i}', category=categories[i % 2], brand=brands[i % 2],
+                    description='A phone', price=Decimal('999.00') + i, stock=10, is_featured=i % 3 == 0)
+            for i in range(30)
+        )
+        cls.product = product = Product.objects.get(slug='phone-4')
+        ProductImage.objects.bulk_create(
+            ProductImage(product=p, image=f'products/{p.slug}.jpg', is_primary=True) for p in Product.objects.all()
+        )
+        order = Order.objects.create(user=cls.user, address=address, subtotal=product.price, total=product.price,
+                                     payment_method='cod', order_status='delivered')
+        OrderItem.objects.create(order=order, product=product, product_name=product.name,
+                                 product_price=product.price, quantity=1, total_price=product.price)
+        Review.objects.create(product=product, user=cls.staff, rating=4, title='Good', comment='Good phone',
+                              is_approved=True)
+
+    def fetch(self, paths, user=None):
+        """{path: response} from the sync views, then from the async ones."""
+        if user:
+            self.client.force_login(user)
+        sync = {path: self.client.get(path) for path in paths}
+
+        async def fetch_async():
+            if user:
+                await self.async_client.aforce_login(user)
+            return {path: await self.async_client.get(path) for path in paths}
+
+        with override_settings(ROOT_URLCONF=AsyncCatalogURLs):
+            self.assertTrue(iscoroutinefunction(resolve('/').func))
+            return sync, async_to_sync(fetch_async)()
+
+    def assertSameContext(self, sync, async_, names):
+        self.assertEqual(async_.status_code, sync.status_code)
+        for name in names:
+            with self.subTest(name):
+                self.assertEqual(list(async_.context[name]), list(sync.context[name]))
+
+    def test_home(self):
+        sync, async_ = self.fetch(['/'])
+        self.assertSameContext(sync['/'], async_['/'], ['featured_products', 'categories', 'brands', 'new_arrivals'])
+        self.assertContains(async_['/'], 'Phone 29')
+
+    def test_product_list(self):
+        paths = ['/products/', '/products/?page=2', '/products/?page=99', '/products/?category=category-1&sort=price',
+                 '/products/?brand=brand-0&q=Phone+1&min_price=1000']
+        sync, async_ = self.fetch(paths)
+        for path in paths:
+            with self.subTest(path):
+                self.assertSameContext(sync[path], async_[path], ['page_obj', 'categories', 'brands'])
+                sync_page, async_page = sync[path].context['page_obj'], async_[path].context['page_obj']
+                self.assertEqual((async_page.number, async_page.paginator.count, async_page.paginator.num_pages),
+                                 (sync_page.number, sync_page.paginator.count, sync_page.paginator.num_pages))
+                self.assertEqual(async_[path].context['current_category'], sync[path].context['current_category'])
+
+    def test_product_detail(self):
+        path = reverse('product_detail', args=[self.product.slug])
+        sync, async_ = self.fetch([path, '/product/no-such-phone/'], user=self.user)
+        self.assertSameContext(sync[path], async_[path], ['related_products', 'reviews'])
+        for name in ['product', 'avg_rating', 'review_count', 'can_review']:
+            self.assertEqual(async_[path].context[name], sync[path].context[name])
+        self.assertIs(async_[path].context['can_review'], True)
+        self.assertEqual(async_['/product/no-such-phone/'].status_code, 404)
+
+    def test_search_suggestions(self):
+        paths = ['/search-suggestions/?q=phone+2', '/search-suggestions/?q=brand-1', '/search-suggestions/?q=p']
+        sync, async_ = self.fetch(paths)
+        for path in paths:
+            self.assertEqual(async_[path].json(), sync[path].json())
+        self.assertEqual(len(async_[paths[0]].json()['suggestions']), 5)
+
+    @override_settings(REQUEST_PROFILE_SAMPLE_RATE=1)
+    def test_middleware_under_async(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        async def fetch():
+            await self.async_client.aforce_login(self.staff)
+            return await self.async_client.get('/products/', {'_profile': 'cpu'})
+
+        with override_settings(ROOT_URLCONF=AsyncCatalogURLs, METRICS_DIR=directory.name), \
+                self.assertLogs('store.profiling', 'INFO') as logs:
+            response = async_to_sync(fetch)()
+            exposition = metrics.render()
+        self.assertEqual(response.status_code, 200)
+
+        # Queries run in worker threads are still counted
+        record = json.loads(logs.records[0].getMessage())
+        self.assertGreater(record['queries'], 3)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertIn(f'desc="{record["queries"]} queries"', response['Server-Timing'])
+        self.assertIn(f'db_queries_total{{view="product_list"}} {record["queries"]}', exposition.splitlines())
+
+        # The profiler sees the ORM and template work done for the coroutine
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.view_name, profile.user), ('product_list', self.staff))
+        self.assertIn('_fetch_all', {function for _, _, function in marshal.loads(profile.cpu_stats)})
+
+
+class CouponRedemptionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.users = [create_shopper(f'shopper{i}') for i in range(3)]
+        cls.address = create_address(cls.users[0])
+        cls.coupon = Coupon.objects.create(code='SAVE50', discount_type='fixed', discount_value=Decimal('50'),
+                                           valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=30),
+                                           usage_limit=2, per_user_limit=1)
+        cls.product = create_product(stock=5)
+
+    def order(self, user=None, status='pending'):
+        return Order.objects.create(user=user or self.users[0], address=self.address, subtotal=Decimal('999.00'),
+                                    total=Decimal('949.00'), payment_method='cod', order_status=status)
+
+    def used_count(self):
+        return Coupon.objects.values_list('used_count', flat=True).get(pk=self.coupon.pk)
+
+    def test_usage_limit(self):
+        self.assertIsNotNone(redeem_coupon(self.coupon, self.users[0]))
+        self.assertIsNotNone(redeem_coupon(self.coupon, self.users[1]))
+        self.assertIsNone(redeem_coupon(self.coupon, self.users[2]))
+        self.assertEqual(self.used_count(), 2)
+        self.assertEqual(CouponRedemption.objects.count(), 2)
+
+    def test_per_user_limit(self):
+        self.assertIsNotNone(redeem_coupon(self.coupon, self.users[0]))
+        self.assertIsNone(redeem_coupon(self.coupon, self.users[0]))
+        # The refused attempt's increment was rolled back
+        self.assertEqual(self.used_count(), 1)
+        self.assertIsNotNone(redeem_coupon(self.coupon, self.users[1]))
+
+    def test_release_twice_gives_back_one_use(self):
+        order = self.order()
+        redeem_coupon(self.coupon, self.users[0], order=order)
+        self.assertEqual(release_coupon(order), 1)
+        self.assertEqual(release_coupon(order), 0)
+        self.assertEqual(self.used_count(), 0)
+        # Released uses no longer count towards the per-user limit
+        self.assertIsNotNone(redeem_coupon(self.coupon, self.users[0]))
+
+    def test_cancel_gives_back_use(self):
+        order = self.order(status='confirmed')
+        redemption = redeem_coupon(self.coupon, self.users[0], order=order)
+        transition_orders([order.id], 'cancelled', notify=False)
+        redemption.refresh_from_db()
+        self.assertIsNotNone(redemption.released_at)
+        self.assertEqual(self.used_count(), 0)
+
+    def test_delete_gives_back_use(self):
+        pending, delivered = self.order(), self.order(self.users[1], status='delivered')
+        redeem_coupon(self.coupon, self.users[0], order=pending)
+        redeem_coupon(self.coupon, self.users[1], order=delivered)
+        pending.delete()
+        # A delivered order used its coupon, deleted (or archived) or not
+        delivered.delete()
+        self.assertEqual(self.used_count(), 1)
+
+    @override_settings(RAZORPAY_KEY_ID='rzp_test_key', RAZORPAY_KEY_SECRET='secret')
+    def test_gateway_failure_undoes_checkout(self):
+        user = self.users[0]
+        CartItem.objects.create(cart=Cart.objects.create(user=user), product=self.product, quantity=2)
+        self.client.force_login(user)
+        with mock.patch('store.views.get_razorpay_client') as get_client:
+            get_client.return_value.order.create.side_effect = ConnectionError('gateway down')
+            response = self.client.post(reverse('checkout'), {
+                'address_id': self.address.id, 'payment_method': 'razorpay', 'coupon_code': 'SAVE50',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['success'])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 5)
+        self.assertEqual(self.used_count(), 0)
+        self.assertEqual(CartItem.objects.filter(cart__user=user).count(), 1)
+
+
+class CouponIndexTests(TestCase):
+    def setUp(self):
+        coupon_index.clear()
+        self.addCleanup(coupon_index.clear)
+
+    def coupon(self, code, **fields):
+        now = timezone.now()
+        fields = {'valid_from': now - timedelta(days=1), 'valid_to': now + timedelta(days=30), **fields}
+        return Coupon.objects.create(code=code, discount_type='fixed', discount_value=Decimal('50'),
+                                     usage_limit=10, **fields)
+
+    def test_lookup(self):
+        self.coupon('SAVE50')
+        self.coupon('OLD10', valid_to=timezone.now() - timedelta(days=1))
+        self.coupon('OFF10', is_active=False)
+        index = CouponIndex()
+        self.assertEqual(index.get('SAVE50').code, 'SAVE50')
+        with self.assertNumQueries(0):
+            # Codes match exactly, like the Coupon.objects.get(code=...) it replaces
+            self.assertIsNone(index.get('save50'))
+            self.assertIsNone(index.get('OLD10'))
+            self.assertIsNone(index.get('OFF10'))
+            self.assertIsNone(index.get(''))
+
+    def test_saving_and_deleting_invalidate(self):
+        coupon = self.coupon('SAVE50')
+        self.assertIsNotNone(coupon_index.get('SAVE50'))
+        self.assertIsNone(coupon_index.get('NEW20'))
+        self.coupon('NEW20')
+        self.assertIsNotNone(coupon_index.get('NEW20'))
+        coupon.is_active = False
+        coupon.save()
+        self.assertIsNone(coupon_index.get('SAVE50'))
+        Coupon.objects.get(code='NEW20').delete()
+        self.assertIsNone(coupon_index.get('NEW20'))
+
+    def test_redemption_refreshes_entry(self):
+        user = create_shopper()
+        coupon = self.coupon('SAVE50')
+        with self.captureOnCommitCallbacks(execute=True):
+            redeem_coupon(coupon_index.get('SAVE50'), user)
+        self.assertEqual(coupon_index.get('SAVE50').used_count, 1)
+
+    def test_expired_code_refused_at_checkout(self):
+        user = create_shopper()
+        self.coupon('OLD10', valid_to=timezone.now() - timedelta(days=1))
+        self.coupon('SOON10', valid_from=timezone.now() + timedelta(days=1))
+        Cart.objects.create(user=user)
+        self.client.force_login(user)
+        for code in ['OLD10', 'SOON10']:
+            response = self.client.post(reverse('apply_coupon'), {'coupon_code': code})
+            self.assertFalse(response.json()['success'], code)
+
+
+@override_settings(PAYMENT_EVENTS_ASYNC=False, RAZORPAY_WEBHOOK_SECRET='webhook_secret')
+class PaymentEventTests(ShopperTestData, TestCase):
+    PRODUCT_STOCK = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        CartItem.objects.create(cart=Cart.objects.create(user=cls.user), product=cls.product, quantity=1)
+        cls.coupon = Coupon.objects.create(code='SAVE50', discount_type='fixed', discount_value=Decimal('50'),
+                                           valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=30),
+                                           usage_limit=1)
+        cls.order = Order.objects.create(user=cls.user, address=cls.address, subtotal=Decimal('999.00'),
+                                         discount=Decimal('50.00'), total=Decimal('949.00'), coupon=cls.coupon,
+                                         payment_method='razorpay', razorpay_order_id='order_1')
+        redeem_coupon(cls.coupon, cls.user, order=cls.order)
+
+    def record(self, payment_id, event='payment.captured', source='checkout'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return record_payment_event('order_1', payment_id, 'signature', source=source, event=event)
+
+    def webhook(self, payment_id, event):
+        body = json.dumps({'event': event, 'payload': {'payment': {'entity': {
+            'id': payment_id, 'order_id': 'order_1'}}}})
+        signature = hmac.new(b'webhook_secret', body.encode(), hashlib.sha256).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('razorpay_webhook'), body, content_type='application/json',
+                                        headers={'X-Razorpay-Signature': signature})
+        return response.json()['status']
+
+    def assertFinalizedOnce(self):
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.order.order_status), ('completed', 'confirmed'))
+        self.assertEqual(OrderStatusHistory.objects.filter(order=self.order, status='confirmed').count(), 1)
+        self.assertEqual(OutboxEmail.objects.filter(kind='order_confirmation').count(), 1)
+        self.assertFalse(CartItem.objects.exists())
+
+    def used_count(self):
+        return Coupon.objects.values_list('used_count', flat=True).get(pk=self.coupon.pk)
+
+    def test_callback_and_webhook_replayed(self):
+        self.assertTrue(self.record('pay_1')[1])
+        self.assertFalse(self.record('pay_1', source='callback')[1])
+        self.assertEqual(self.webhook('pay_1', 'payment.captured'), 'duplicate')
+        self.assertEqual(self.webhook('pay_1', 'payment.captured'), 'duplicate')
+        # A different event for the same payment is kept, and changes nothing
+        self.assertEqual(self.webhook('pay_1', 'order.paid'), 'ok')
+        self.assertEqual(sorted(PaymentEvent.objects.values_list('event', 'status')),
+                         [('order.paid', 'ignored'), ('payment.captured', 'processed')])
+        self.assertFinalizedOnce()
+        self.assertEqual(self.used_count(), 1)
+
+    def test_failed_then_captured(self):
+        self.assertEqual(self.webhook('pay_1', 'payment.failed'), 'ok')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'failed')
+        self.assertEqual(self.used_count(), 0)
+        # The shopper retries and the new attempt is captured; the same
+        # payment can also be captured after a failure report
+        self.assertEqual(self.webhook('pay_1', 'payment.captured'), 'ok')
+        self.assertFinalizedOnce()
+        self.assertEqual(self.used_count(), 1)
+        self.assertFalse(CouponRedemption.objects.filter(released_at__isnull=False).exists())
+        # A late failure report cannot undo the completed payment
+        self.assertEqual(self.webhook('pay_2', 'payment.failed'), 'ok')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'completed')
+        self.assertEqual(self.used_count(), 1)
+
+    def test_refunded_order_stays_refunded(self):
+        Order.objects.filter(pk=self.order.pk).update(payment_status='refunded')
+        self.record('pay_1')
+        self.assertEqual(PaymentEvent.objects.get().status, 'ignored')
+        self.assertEqual(Order.objects.get(pk=self.order.pk).payment_status, 'refunded')
+
+    def test_capture_after_cancel_needs_refund(self):
+        transition_orders([self.order.id], 'cancelled', notify=False)
+        self.assertEqual(self.used_count(), 0)
+        self.assertEqual(self.webhook('pay_1', 'payment.captured'), 'ok')
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.order_status, self.order.payment_status), ('cancelled', 'pending'))
+        self.assertEqual(self.order.razorpay_payment_id, 'pay_1')
+        self.assertEqual(PaymentEvent.objects.get().status, 'refund_due')
+        self.assertTrue(OrderStatusHistory.objects.filter(
+            order=self.order, notes='Payment pay_1 captured after the order was cancelled; refund due').exists())
+        # Nothing is taken again, and the same payment is flagged once
+        self.assertEqual(self.used_count(), 0)
+        self.assertTrue(CartItem.objects.exists())
+        self.assertEqual(self.webhook('pay_1', 'order.paid'), 'ok')
+        self.assertEqual(PaymentEvent.objects.get(event='order.paid').status, 'ignored')
+        self.assertEqual(OrderStatusHistory.objects.filter(order=self.order, notes__contains='refund due').count(), 1)
+
+    def test_concurrent_delivery(self):
+        # Both channels deliver before any worker runs
+        checkout, _ = record_payment_event('order_1', 'pay_1', 'signature', source='checkout')
+        webhook, _ = record_payment_event('order_1', 'pay_1', source='webhook', event='order.paid')
+        # Two workers pick up the same event: only the one that claims it works on it
+        self.assertTrue(claim(checkout.pk))
+        self.assertIsNone(process_payment_event(checkout.pk))
+        # Meanwhile another event for the payment completes the order
+        self.assertEqual(process_payment_event(webhook.pk), 'processed')
+        # The first worker died; its event is retried and finds nothing left to do
+        PaymentEvent.objects.filter(pk=checkout.pk).update(status='failed')
+        self.assertEqual(process_payment_event(checkout.pk), 'ignored')
+        self.assertFinalizedOnce()
+
+
+class FlakyBackend(LocmemBackend):
+    """locmem, but the first `failures` messages raise."""
+    failures = 0
+
+    def send_messages(self, messages):
+        if FlakyBackend.failures:
+            FlakyBackend.failures -= 1
+            raise ConnectionError('mail server went away')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=3)
+class OutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_shopper()
+        cls.staff = create_staff()
+
+    def test_enqueue_and_send(self):
+        enqueue_email('Hello', 'First', ['a@example.com'])
+        enqueue_email('Hello', 'Second', ['b@example.com', 'c@example.com'])
+        self.assertIsNone(enqueue_email('Hello', 'Nobody', ['']))
+        self.assertEqual(mail.outbox, [])
+        call_command('send_outbox', stdout=io.StringIO())
+        self.assertEqual(sorted((m.body, tuple(m.to)) for m in mail.outbox),
+                         [('First', ('a@example.com',)), ('Second', ('b@example.com', 'c@example.com'))])
+        self.assertEqual(set(OutboxEmail.objects.values_list('status', 'attempts')), {('sent', 1)})
+        self.assertEqual(deliver_outbox(), (0, 0))
+
+    def test_retry_with_backoff(self):
+        email = enqueue_email('Hello', 'Body', ['a@example.com'])
+        FlakyBackend.failures = 2
+        self.addCleanup(setattr, FlakyBackend, 'failures', 0)
+        backend = FlakyBackend()
+
+        self.assertEqual(deliver_outbox(connection=backend), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=25))
+        # Not due again until the backoff has passed
+        self.assertEqual(deliver_outbox(connection=backend), (0, 0))
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_outbox(connection=backend), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 2)
+        self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=55))
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_outbox(connection=backend), (1, 0))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.last_error), ('sent', 3, ''))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        email = enqueue_email('Hello', 'Body', ['a@example.com'])
+        FlakyBackend.failures = 5
+        self.addCleanup(setattr, FlakyBackend, 'failures', 0)
+        for _ in range(3):
+            OutboxEmail.objects.update(next_attempt_at=timezone.now())
+            deliver_outbox(connection=FlakyBackend())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', 3))
+        self.assertIn('went away', email.last_error)
+
+    def test_claims_are_exclusive(self):
+        for n in range(3):
+            enqueue_email('Hello', f'Body {n}', ['a@example.com'])
+        first = claim_batch(2)
+        second = claim_batch(10)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({email.id for email in first} & {email.id for email in second})
+        self.assertEqual(claim_batch(10), [])
+        # A sender that died mid-batch leaves its rows to be claimed again
+        OutboxEmail.objects.filter(id__in=[email.id for email in first]).update(
+            updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual({email.id for email in claim_batch(10)}, {email.id for email in first})
+
+    def test_otp_not_kept(self):
+        email = enqueue_otp_email(self.user, '123456')
+        self.client.force_login(self.staff)
+        change_url = reverse('admin:store_outboxemail_change', args=[email.pk])
+        self.assertNotContains(self.client.get(change_url), '123456')
+
+        deliver_outbox()
+        self.assertIn('123456', mail.outbox[0].body)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.body), ('sent', ''))
+
+        # Staff cannot rewrite outgoing mail
+        self.client.post(change_url, {'subject': 'Changed', 'body': 'Changed', 'recipients': '["x@example.com"]',
+                                      'status': 'pending', 'attempts': 0,
+                                      'next_attempt_at_0': '2030-01-01', 'next_attempt_at_1': '00:00:00'})
+        email.refresh_from_db()
+        self.assertEqual((email.subject, email.recipients), ('Password Reset OTP - FlugEde', ['shopper@example.com']))
+
+    def test_expired_otp_given_up(self):
+        email = enqueue_otp_email(self.user, '123456')
+        OutboxEmail.objects.update(created_at=timezone.now() - OTP_VALID_FOR - timedelta(seconds=1))
+        self.assertEqual(deliver_outbox(), (0, 0))
+        self.assertEqual(mail.outbox, [])
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.body), ('failed', ''))
+
+
+class ForecastTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_shopper()
+        cls.staff = create_staff()
+        cls.address = create_address(cls.user)
+        cls.selling, cls.idle, cls.gone = (create_product(name, stock=100) for name in ('Selling', 'Idle', 'Gone'))
+        order = Order.objects.create(user=cls.user, address=cls.address, subtotal=Decimal('2997.00'),
+                                     total=Decimal('2997.00'), payment_method='cod')
+        for product, quantity in ((cls.selling, 2), (cls.gone, 1)):
+            OrderItem.objects.create(order=order, product=product, product_name=product.name,
+                                     product_price=product.price, quantity=quantity,
+                                     total_price=product.price * quantity)
+        cls.gone.delete()
+
+    def stockout(self, value):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('admin:store_product_changelist'), {'stockout': value})
+        return {product.name for product in response.context['cl'].result_list}
+
+    def test_lines_of_deleted_products_skipped(self):
+        self.assertEqual(forecast_stock(), (1, 1))
+        self.selling.refresh_from_db()
+        self.assertEqual((self.selling.sales_velocity, self.selling.days_until_stockout), (Decimal('2.00'), 50))
+
+    def test_product_without_sales(self):
+        forecast_stock()
+        self.idle.refresh_from_db()
+        self.assertEqual((self.idle.sales_velocity, self.idle.days_until_stockout), (Decimal('0.00'), None))
+        self.assertIsNone(self.idle.days_of_stock)
+        self.assertEqual(self.idle.stock_status, 'In Stock')
+        self.assertEqual(self.stockout('no_sales'), {'Idle'})
+
+    def test_status_follows_current_stock(self):
+        forecast_stock()
+        self.assertEqual(self.stockout('later'), {'Selling'})
+        # Stock sold since the forecast ran counts straight away
+        Product.objects.filter(pk=self.selling.pk).update(stock=10)
+        self.selling.refresh_from_db()
+        self.assertEqual(self.selling.days_until_stockout, 50)
+        self.assertEqual(self.selling.days_of_stock, 5)
+        self.assertEqual(self.selling.stock_status, 'Low Stock')
+        self.assertEqual(self.stockout('week'), {'Selling'})
+        self.assertEqual(self.stockout('later'), set())
+        Product.objects.filter(pk=self.idle.pk).update(stock=0)
+        self.assertEqual(self.stockout('week'), {'Selling', 'Idle'})
+
+    def test_order_placed_between_reads(self):
+        read_items = forecasting._int_columns
+
+        def place_order_then_read(*args):
+            order = Order.objects.create(user=self.user, address=self.address, subtotal=Decimal('999.00'),
+                                         total=Decimal('999.00'), payment_method='cod')
+            OrderItem.objects.create(order=order, product=self.idle, product_name='Idle',
+                                     product_price=Decimal('999.00'), quantity=1, total_price=Decimal('999.00'))
+            return read_items(*args)
+
+        with mock.patch.object(forecasting, '_int_columns', side_effect=place_order_then_read):
+            self.assertEqual(forecast_stock(), (1, 1))
+        # Counted on the next run
+        self.assertEqual(forecast_stock(), (2, 1))
+        self.idle.refresh_from_db()
+        self.assertEqual(self.idle.sales_velocity, Decimal('1.00'))
+
+
+@mock.patch.multiple(exports, CHUNK_SIZE=3, BUFFER_SIZE=1)
+class ExportStreamingTests(TestCase):
+    PRODUCTS = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        category = create_category()
+        Product.objects.bulk_create(
+            Product(name=f'Phone {i}', slug=f'phone-{i}', category=category, description='A phone',
+                    price=Decimal('999.00'), stock=5)
+            for i in range(cls.PRODUCTS)
+        )
+
+    def export(self, request):
+        return exports.export_response(exports.ProductExporter(), Product.objects.all(), 'csv', request)
+
+    def assertStreams(self, arrivals):
+        """arrivals: (chunk, queries run so far) as each chunk came out. The
+        header comes before any query, the first rows after one page, and
+        the rest a page at a time."""
+        self.assertEqual(len(arrivals), 1 + self.PRODUCTS)
+        (header, before_header), (first_row, before_first_row) = arrivals[:2]
+        self.assertTrue(header.startswith(b'id,name,slug'))
+        self.assertEqual(before_header, 0)
+        self.assertTrue(first_row.startswith(b'1,Phone 0,'))
+        # One page of products and its specifications
+        self.assertEqual(before_first_row, 2)
+        self.assertEqual([queries for _, queries in arrivals[1:]], [2] * 3 + [4] * 3 + [6] * 3 + [8])
+
+    def test_wsgi_streams_sync(self):
+        response = self.export(RequestFactory().get('/'))
+        self.assertFalse(response.is_async)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertStreams([(chunk, len(queries)) for chunk in response.streaming_content])
+
+    def test_asgi_streams_async(self):
+        response = self.export(AsyncRequestFactory().get('/'))
+        self.assertTrue(response.is_async)
+
+        async def read():
+            return [(chunk, len(queries)) async for chunk in response.streaming_content]
+
+        # The wrapper itself rather than the proxy, which would give the event
+        # loop thread's connection
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertStreams(async_to_sync(read)())
+
+
+def change_form_data(response):
+    """POST data that resubmits an admin change form as rendered."""
+    data = {}
+    forms = [response.context['adminform'].form]
+    for inline in response.context['inline_admin_formsets']:
+        data.update({field.html_name: field.value() for field in inline.formset.management_form})
+        forms.extend(inline.formset.forms)
+    for form in forms:
+        for field in form:
+            if field.value() is not None:
+                data[field.html_name] = field.value()
+            if field.field.show_hidden_initial:
+                data[field.html_initial_name] = field.initial
+    return data
+
+
+class OrderTransitionTests(ShopperTestData, TestCase):
+    PRODUCT_STOCK = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        cls.staff = create_staff()
+        cls.coupon = Coupon.objects.create(code='SAVE50', discount_type='fixed', discount_value=Decimal('50'),
+                                           valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=30),
+                                           usage_limit=10)
+
+    def setUp(self):
+        self.order = Order.objects.create(user=self.user, address=self.address, subtotal=Decimal('1998.00'),
+                                          total=Decimal('1948.00'), payment_method='cod', coupon=self.coupon)
+        OrderItem.objects.create(order=self.order, product=self.product, product_name='Phone',
+                                 product_price=Decimal('999.00'), quantity=2, total_price=Decimal('1998.00'))
+        redeem_coupon(self.coupon, self.user, order=self.order)
+
+    def assertCancelled(self):
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.order_status, 'cancelled')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 7)
+        self.assertEqual(Coupon.objects.get(pk=self.coupon.pk).used_count, 0)
+        self.assertIsNotNone(CouponRedemption.objects.get(order=self.order).released_at)
+        self.assertEqual(list(self.order.status_history.values_list('status', 'notes')),
+                         [('cancelled', 'Status changed from pending to cancelled')])
+        self.assertEqual(list(OutboxEmail.objects.values_list('kind', 'recipients')),
+                         [('order_status', ['shopper@example.com'])])
+
+    def test_cancel(self):
+        changed, skipped = transition_orders([self.order.id], 'cancelled')
+        self.assertEqual((changed, skipped), ([self.order], []))
+        self.assertCancelled()
+        # Cancelling again is refused, so nothing is put back twice
+        self.assertEqual(transition_orders([self.order.id], 'cancelled'), ([], [self.order]))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 7)
+
+    def test_moves_not_allowed_are_skipped(self):
+        changed, skipped = transition_orders(Order.objects.all(), 'delivered')
+        self.assertEqual((changed, skipped), ([], [self.order]))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.order_status, 'pending')
+        self.assertFalse(self.order.status_history.exists())
+
+    def change(self, **changes):
+        self.client.force_login(self.staff)
+        url = reverse('admin:store_order_change', args=[self.order.pk])
+        return self.client.post(url, {**change_form_data(self.client.get(url)), **changes})
+
+    def test_admin_form_goes_through_transitions(self):
+        response = self.change(order_status='cancelled', tracking_number='TRK1')
+        self.assertRedirects(response, reverse('admin:store_order_changelist'))
+        self.assertCancelled()
+        self.assertEqual(self.order.tracking_number, 'TRK1')
+
+    def test_admin_form_refuses_moves_not_allowed(self):
+        response = self.change(order_status='delivered')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('order_status', response.context['adminform'].form.errors)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.order_status, 'pending')
+        self.assertFalse(self.order.status_history.exists())
+
+
+# A TransactionTestCase so the rows are committed: the replica is a second
+# connection to the test database, which cannot see default's open transaction
+@override_settings(DATABASE_REPLICAS=['replica_test'], REPLICA_STICKY_SECONDS=15)
+class ReplicaRoutingTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The replica is added here, as bench_sqlite adds its databases, and
+        # only then listed: the runner checks every alias in `databases`
+        # before any test class is set up
+        source = connections['default'].settings_dict
+        connections.settings['replica_test'] = connections.configure_settings({
+            'default': copy.deepcopy(source), 'replica_test': copy.deepcopy(source),
+        })['replica_test']
+        cls.addClassCleanup(cls.remove_replica)
+        cls.databases = {'default', 'replica_test'}
+        super().setUpClass()
+
+    @classmethod
+    def remove_replica(cls):
+        connections['replica_test'].close()
+        del connections['replica_test']
+        del connections.settings['replica_test']
+
+    def setUp(self):
+        self.user = create_shopper()
+        self.product = create_product(stock=5)
+
+    def read_from(self, response, name):
+        return response.context[name]._state.db
+
+    def test_catalog_reads_go_to_replica(self):
+        response = self.client.get(reverse('product_detail', args=[self.product.slug]))
+        self.assertEqual(self.read_from(response, 'product'), 'replica_test')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        # Views without @replica_reads read the primary
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(self.read_from(response, 'cart'), 'default')
+
+    def test_reads_after_a_write_go_to_primary(self):
+        seen = []
+
+        @replica_reads
+        def view(request):
+            seen.append(Category.objects.get(slug='phones')._state.db)
+            Category.objects.filter(slug='phones').update(description='Updated')
+            seen.append(Category.objects.get(slug='phones')._state.db)
+            return HttpResponse()
+
+        view(RequestFactory().get('/'))
+        self.assertEqual(seen, ['replica_test', 'default'])
+
+    def test_write_pins_browser_to_primary(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        cookie = response.cookies[PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 15)
+        self.assertTrue(cookie['httponly'])
+
+        response = self.client.get(reverse('product_detail', args=[self.product.slug]))
+        self.assertEqual(self.read_from(response, 'product'), 'default')
+
+        # Once the cookie expires, catalog reads go back to the replica
+        del self.client.cookies[PIN_COOKIE]
+        response = self.client.get(reverse('product_detail', args=[self.product.slug]))
+        self.assertEqual(self.read_from(response, 'product'), 'replica_test')
+
+
+class ArchiveTests(ShopperTestData, TestCase):
+    PRODUCT_STOCK = 5
+
+    def order(self, status='delivered'):
+        order = Order.objects.create(user=self.user, address=self.address, subtotal=Decimal('999.00'),
+                                     total=Decimal('999.00'), payment_method='cod', order_status=status)
+        item = OrderItem.objects.create(order=order, product=self.product, product_name='Phone',
+                                        product_price=Decimal('999.00'), quantity=1, total_price=Decimal('999.00'))
+        return order, item
+
+    def archive(self):
+        return archive_orders(cutoff=timezone.now() + timedelta(days=1))
+
+    def test_get_order_falls_through_to_archive(self):
+        order, _ = self.order()
+        self.assertIsInstance(get_order(id=order.id), Order)
+        self.assertEqual(self.archive(), 1)
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+
+        archived = get_order(id=order.id, user=self.user)
+        self.assertIsInstance(archived, ArchivedOrder)
+        self.assertEqual(archived.order_number, order.order_number)
+        self.assertEqual(archived.items.get().product_name, 'Phone')
+        with self.assertRaises(Http404):
+            get_order(id=order.id + 1)
+
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('order_detail', args=[order.id])), order.order_number)
+        self.assertContains(self.client.get(reverse('order_success', args=[order.order_number])),
+                            order.order_number)
+
+    def test_orders_with_returns_or_reviews_stay_hot(self):
+        returned, returned_item = self.order()
+        ReturnRequest.objects.create(order_item=returned_item, user=self.user, reason='defective',
+                                     description='Broken')
+        reviewed, reviewed_item = self.order()
+        Review.objects.create(product=self.product, user=self.user, order_item=reviewed_item, rating=5,
+                              title='Great', comment='Works well')
+        in_flight, _ = self.order(status='shipped')
+        done, _ = self.order()
+
+        self.assertEqual(self.archive(), 1)
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {returned.id, reviewed.id, in_flight.id})
+        self.assertEqual(list(ArchivedOrder.objects.values_list('id', flat=True)), [done.id])
+
+    def test_order_numbers_unique_across_archive(self):
+        order, _ = self.order()
+        Order.objects.filter(pk=order.pk).update(order_number=f'FLG{timezone.now():%Y%m%d}123456')
+        self.archive()
+        with mock.patch('store.models.random.choices', side_effect=[list('123456'), list('654321')]):
+            self.assertEqual(Order.generate_order_number()[-6:], '654321')
+
+
+class StockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = create_staff()
+        cls.user = create_shopper()
+        cls.address = create_address(cls.user)
+        cls.phone, cls.tablet, cls.watch = (create_product(name) for name in ('Phone', 'Tablet', 'Watch'))
+
+    def stock(self, product):
+        return Product.objects.values_list('stock', flat=True).get(pk=product.pk)
+
+    def order(self, product, quantity, created_at=None):
+        """An order placed now, taking its stock as checkout does."""
+        order = Order.objects.create(user=self.user, address=self.address, subtotal=Decimal('999.00'),
+                                     total=Decimal('999.00'), payment_method='cod')
+        OrderItem.objects.create(order=order, product=product, product_name=product.name,
+                                 product_price=product.price, quantity=quantity, total_price=product.price * quantity)
+        adjust_stock({product.pk: -quantity})
+        return order
+
+    def feed(self, rows, **kwargs):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'feed.csv')
+        with open(path, 'w') as f:
+            f.write('slug,delta,stock,as_of\n' + ''.join(f'{row}\n' for row in rows))
+        return apply_feed(path, **kwargs)
+
+    def test_one_update_for_many_products(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(adjust_stock({self.phone.pk: -3, self.tablet.pk: 4, self.watch.pk: 0}), 2)
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries.captured_queries), 1)
+        self.assertEqual([self.stock(p) for p in (self.phone, self.tablet, self.watch)], [7, 14, 10])
+
+    def test_order_and_feed_delta_both_apply(self):
+        # The feed was read against stock 10; an order lands before it is applied
+        self.order(self.phone, 2)
+        stats = self.feed(['phone,5,,'])
+        self.assertEqual((stats.rows, stats.adjusted), (1, 1))
+        self.assertEqual(self.stock(self.phone), 13)
+
+    def test_feed_count_keeps_orders_placed_since(self):
+        counted_at = timezone.now()
+        self.order(self.phone, 2)
+        cancelled = self.order(self.tablet, 1)
+        transition_orders([cancelled.id], 'cancelled', notify=False)
+        stats = self.feed([f'phone,,20,{counted_at.isoformat()}', f'tablet,,20,{counted_at.isoformat()}',
+                           'watch,,3,', 'unknown,,1,', 'phone,,,'])
+        self.assertEqual((stats.set, stats.unknown, stats.error_count), (3, ['unknown'], 1))
+        # Cancelled orders gave their stock back, so they are not taken off again
+        self.assertEqual([self.stock(p) for p in (self.phone, self.tablet, self.watch)], [18, 20, 3])
+
+    def test_admin_edit_after_order_applies_difference(self):
+        self.client.force_login(self.staff)
+        url = reverse('admin:store_product_change', args=[self.phone.pk])
+        data = change_form_data(self.client.get(url))
+        self.order(self.phone, 3)  # lands while the form is open
+        response = self.client.post(url, {**data, 'stock': 15, 'name': 'Phone 2'})
+        self.assertRedirects(response, reverse('admin:store_product_changelist'))
+        self.phone.refresh_from_db()
+        # +5 on top of the 7 left after the order, not 15
+        self.assertEqual((self.phone.stock, self.phone.name), (12, 'Phone 2'))
+
+        # Editing something else keeps the stock taken since
+        data = change_form_data(self.client.get(url))
+        self.order(self.phone, 2)
+        self.client.post(url, {**data, 'name': 'Phone 3'})
+        self.assertEqual(self.stock(self.phone), 10)
+
+    def test_changelist_edit_after_order_applies_difference(self):
+        self.client.force_login(self.staff)
+        url = reverse('admin:store_product_changelist')
+        formset = self.client.get(url).context['cl'].formset
+        data = {field.html_name: field.value() for field in formset.management_form}
+        for form in formset:
+            for field in form:
+                data[field.html_name] = '' if field.value() is None else field.value()
+                if field.field.show_hidden_initial:
+                    data[field.html_initial_name] = field.initial
+        prefix = next(form.prefix for form in formset if form.instance.pk == self.phone.pk)
+        self.order(self.phone, 4)
+        self.order(self.tablet, 1)
+        self.client.post(url, {**data, f'{prefix}-stock': 11, '_save': 'Save'})
+        self.assertEqual([self.stock(p) for p in (self.phone, self.tablet, self.watch)], [7, 9, 10])
+
+    def test_failed_feed_applies_nothing(self):
+        apply_rows = stock.apply_rows
+        calls = []
+
+        def locked_on_second_batch(rows, stats):
+            calls.append(rows)
+            if len(calls) == 2:
+                raise OperationalError('database is locked')
+            apply_rows(rows, stats)
+
+        rows = ['phone,5,,', 'tablet,-3,,']
+        with mock.patch.object(stock, 'apply_rows', side_effect=locked_on_second_batch):
+            with self.assertRaises(OperationalError):
+                self.feed(rows, batch_size=1)
+        self.assertEqual([self.stock(self.phone), self.stock(self.tablet)], [10, 10])
+        # Dropped again, the feed applies once
+        self.feed(rows, batch_size=1)
+        self.assertEqual([self.stock(self.phone), self.stock(self.tablet)], [15, 7])
+
+    def test_stock_changed_after_commit(self):
+        received = []
+        handler = lambda sender, product_ids, **kwargs: received.append(product_ids)
+        stock_changed.connect(handler)
+        self.addCleanup(stock_changed.disconnect, handler)
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_stock({self.tablet.pk: 1, self.phone.pk: -1})
+            self.assertEqual(received, [])
+        self.assertEqual(received, [sorted([self.phone.pk, self.tablet.pk])])
+
+
+class CatalogImportTests(TestCase):
+    HEADER = 'slug,name,category,brand,price,stock,specifications,images'
+
+    def setUp(self):
+        self.dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=os.path.join(self.dir, 'media')))
+        Image.new('RGB', (2400, 1200), 'red').save(os.path.join(self.dir, 'phone.png'))
+        with open(os.path.join(self.dir, 'broken.png'), 'w') as f:
+            f.write('not an image')
+
+    def write(self, name, lines):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w', newline='') as f:
+            f.write(''.join(f'{line}\n' for line in lines))
+        return path
+
+    def run_import(self, path, **options):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_catalog', path, chunk_size=2, image_workers=2, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_resumes_after_interruption(self):
+        path = self.write('catalog.csv', [self.HEADER] + [
+            f'phone-{i},Phone {i},Phones,Acme,{999 + i},{i},RAM: 8 GB; Storage: 128 GB,' for i in range(5)
+        ])
+        original, calls = CatalogImporter.import_chunk, []
+
+        def interrupted(importer, records, fmt):
+            calls.append([number for number, _ in records])
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return original(importer, records, fmt)
+
+        with mock.patch.object(CatalogImporter, 'import_chunk', interrupted), self.assertRaises(KeyboardInterrupt):
+            self.run_import(path)
+        self.assertEqual(sorted(Product.objects.values_list('slug', flat=True)), ['phone-0', 'phone-1'])
+        with open(f'{path}.import-state') as f:
+            self.assertEqual(json.load(f)['records'], 2)
+
+        with mock.patch.object(CatalogImporter, 'import_chunk', interrupted):
+            out, err = self.run_import(path)
+        # Picks up at record 3, not the top of the file
+        self.assertEqual(calls[2:], [[3, 4], [5]])
+        self.assertIn('Resuming after record 2', out)
+        self.assertIn('3 created, 0 updated, 0 unchanged', out)
+        self.assertEqual(err, '')
+        self.assertFalse(os.path.exists(f'{path}.import-state'))
+        self.assertEqual(Product.objects.count(), 5)
+        self.assertEqual(Product.objects.get(slug='phone-4').specifications.count(), 2)
+
+    def test_error_rows_reported_and_skipped(self):
+        path = self.write('catalog.csv', [self.HEADER] + [
+            'phone,Phone,Phones,Acme,999.00,5,RAM: 8 GB,phone.png;broken.png;missing.png',
+            'no-price,No Price,Phones,,,5,,',
+            'bad-price,Bad Price,Phones,,cheap,5,,',
+            'bad-stock,Bad Stock,Phones,,999,lots,,',
+            'no-category,No Category,,,999,5,,',
+            ',,Phones,,999,5,,',
+        ])
+        out, err = self.run_import(path)
+        self.assertIn('1 created, 0 updated, 0 unchanged, 1 images, 7 errors', out)
+        errors = err.splitlines()
+        self.assertEqual([line.split(': ')[:2] for line in errors if ': image ' in line], [
+            ['record 1', f'image {os.path.join(self.dir, "broken.png")}'],
+            ['record 1', f'image {os.path.join(self.dir, "missing.png")}'],
+        ])
+        self.assertEqual(sorted(line for line in errors if ': image ' not in line), [
+            'record 2: price is required',
+            "record 3: price: 'cheap' is not a number",
+            "record 4: stock: 'lots' is not a whole number",
+            'record 5: category is required',
+            'record 6: slug or name is required',
+        ])
+        product = Product.objects.get(slug='phone')
+        image = product.images.get()
+        self.assertEqual((image.image.name, image.is_primary), ('products/phone-1.jpg', True))
+        self.assertEqual((image.image.width, image.image.height), (1200, 600))
+
+    def test_jsonl_errors_and_updates(self):
+        create_category()
+        path = self.write('catalog.jsonl', [
+            json.dumps({'slug': 'phone', 'name': 'Phone', 'category': 'Phones', 'price': '999', 'stock': 5}),
+            '{not json',
+            '["a list"]',
+            json.dumps({'slug': 'tablet', 'price': '499'}),
+            '',
+            json.dumps({'slug': 'phone', 'stock': 7}),
+        ])
+        out, err = self.run_import(path)
+        self.assertIn('1 created, 1 updated, 0 unchanged, 0 images, 3 errors', out)
+        self.assertIn('record 3: each line must be a JSON object', err)
+        self.assertIn('record 4: new product needs name, category_id', err)
+        # The later row for phone only changes stock
+        self.assertEqual(Product.objects.values_list('name', 'price', 'stock').get(slug='phone'),
+                         ('Phone', Decimal('999.00'), 7))
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_shopper()
+        cls.address = create_address(cls.user)
+        cls.products = [
+            create_product(name, price=Decimal('100.00'), stock=100) for name in ('Phone', 'Tablet', 'Watch')
+        ]
+
+    def place(self, *lines):
+        subtotal = sum(product.price * quantity for product, quantity in lines)
+        order = Order.objects.create(user=self.user, address=self.address, payment_method='cod',
+                                     subtotal=subtotal, total=subtotal)
+        for product, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, product_name=product.name,
+                                     product_price=product.price, quantity=quantity,
+                                     total_price=product.price * quantity)
+        order.save()  # as checkout does once the items exist
+        return order
+
+    def direct_summary(self):
+        """Per-product totals straight from the order items."""
+        totals = {}
+        items = OrderItem.objects.select_related('order').exclude(order__payment_status='failed')
+        for item in items:
+            row = totals.setdefault(item.product_id, {
+                'units': 0, 'revenue': Decimal('0'), 'cancelled_units': 0, 'returned_units': 0,
+            })
+            row['units'] += item.quantity
+            row['revenue'] += item.total_price
+            if item.order.order_status == 'cancelled':
+                row['cancelled_units'] += item.quantity
+            elif item.return_requests.filter(status__in=['approved', 'completed']).exists():
+                row['returned_units'] += item.quantity
+        return totals
+
+    def rollup_summary(self):
+        return {
+            row['product']: {measure: row[measure] for measure in
+                             ('units', 'revenue', 'cancelled_units', 'returned_units')}
+            for row in sales_summary(group_by='product')
+        }
+
+    def test_refresh_follows_order_changes(self):
+        phone, tablet, watch = self.products
+        cancelled = self.place((phone, 1), (tablet, 2))
+        returned = self.place((phone, 3))
+        self.place((tablet, 1))
+        # The first run builds everything and drops the four changes queued so far
+        self.assertEqual(refresh_rollups(), (4, 2))
+        self.assertEqual(self.rollup_summary(), self.direct_summary())
+
+        transition_orders([cancelled.id], 'cancelled', notify=False)
+        self.place((watch, 4))
+        item = returned.items.get()
+        request = ReturnRequest.objects.create(order_item=item, user=self.user, reason='defective',
+                                               description='Broken')
+        request.status = 'approved'
+        request.save()
+        # Only the products of the changed orders are queued
+        today = timezone.localdate()
+        self.assertEqual(set(SalesRollupChange.objects.values_list('date', 'product_id')),
+                         {(today, phone.id), (today, tablet.id), (today, watch.id)})
+
+        refresh_rollups()
+        self.assertEqual(self.rollup_summary(), self.direct_summary())
+        self.assertFalse(SalesRollupChange.objects.exists())
+        self.assertEqual(refresh_rollups(), (0, 0))
+
+
+class SyntheticDataTests(TestCase):
+    MODELS = (Category, Brand, Product, ProductImage, ProductSpecification, User, UserProfile, Address, Cart,
+              CartItem, Order, OrderItem, OrderStatusHistory, Review)
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+
+    def plan(self):
+        return make_plan(seed=7, products=30, users=20, orders=120, days=30,
+                         now=timezone.make_aware(datetime(2026, 1, 1)))
+
+    def rows(self):
+        return {model.__name__: list(model.objects.order_by('pk').values_list()) for model in self.MODELS}
+
+    def test_workers_build_the_same_rows(self):
+        plan = self.plan()
+        generated = {}
+        for workers in (1, 2):
+            with transaction.atomic():
+                generate(plan, chunk_size=25, workers=workers)
+                generated[workers] = self.rows()
+                transaction.set_rollback(True)
+        self.assertEqual(len(generated[1]['Order']), 120)
+        self.assertEqual(generated[1], generated[2])
+
+    def test_orders_priced_and_queued_for_rollups(self):
+        category = create_category()
+        SalesRollup.objects.create(date=timezone.localdate(), category=category, refreshed_at=timezone.now())
+        generate(self.plan(), chunk_size=25)
+        for order in Order.objects.all():
+            self.assertEqual(
+                (order.shipping_charge, order.tax, order.total),
+                tuple(getattr(quote(order.subtotal), name) for name in ('shipping', 'tax', 'total')),
+            )
+        self.assertTrue(SalesRollupChange.objects.exists())
+        refresh_rollups()
+        self.assertEqual(sum(row['units'] for row in sales_summary()),
+                         OrderItem.objects.exclude(order__payment_status='failed').aggregate(units=Sum('quantity'))['units'])
+
+
+class PricingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.user = create_shopper()
+        address = create_address(cls.user)
+        cls.products = [
+            create_product(name, price=price, discount_price=discount_price, stock=100)
+            for name, price, discount_price in (('Phone', Decimal('333.33'), None),
+                                                ('Case', Decimal('19.99'), Decimal('16.67')),
+                                                ('Charger', Decimal('499.99'), None))
+        ]
+        cls.percent = Coupon.objects.create(code='TEN', discount_type='percentage', discount_value=Decimal('10'),
+                                            max_discount_amount=Decimal('75.00'), valid_from=now,
+                                            valid_to=now + timedelta(days=30))
+        # Carts and orders of 0 to 3 products, 1 to 3 of each
+        for i in range(8):
+            cart = Cart.objects.create(user=cls.user)
+            order = Order.objects.create(user=cls.user, address=address, subtotal=0, total=0, payment_method='cod',
+                                         coupon=cls.percent if i % 2 else None)
+            for j, product in enumerate(cls.products[:i % 4]):
+                quantity = (i + j) % 3 + 1
+                CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+                OrderItem.objects.create(order=order, product=product, product_name=product.name,
+                                         product_price=product.final_price, quantity=quantity,
+                                         total_price=product.final_price * quantity)
+
+    def coupon(self, **terms):
+        now = timezone.now()
+        return Coupon(code='EDGE', valid_from=now, valid_to=now, **terms)
+
+    def test_shipping_threshold(self):
+        self.assertEqual(quote(Decimal('499.99')).shipping, Decimal('50.00'))
+        self.assertEqual(quote(Decimal('500.00')).shipping, Decimal('0.00'))
+
+    def test_tax_rounded_to_paise(self):
+        priced = quote(Decimal('333.33'))
+        self.assertEqual(priced.tax, Decimal('60.00'))  # 59.9994
+        self.assertEqual(priced.total, Decimal('443.33'))
+
+    def test_percentage_coupon_and_cap(self):
+        self.assertEqual(quote(Decimal('333.33'), self.percent).discount, Decimal('33.33'))
+        # 10% of 999.99 is over the cap
+        self.assertEqual(quote(Decimal('999.99'), self.percent).discount, Decimal('75.00'))
+        uncapped = self.coupon(discount_type='percentage', discount_value=Decimal('12.5'))
+        self.assertEqual(quote(Decimal('999.99'), uncapped).discount, Decimal('125.00'))
+
+    def test_minimum_purchase(self):
+        fixed = self.coupon(discount_type='fixed', discount_value=Decimal('50'), min_purchase_amount=Decimal('500'))
+        self.assertEqual(quote(Decimal('499.99'), fixed).discount, Decimal('0.00'))
+        priced = quote(Decimal('500.00'), fixed)
+        self.assertEqual((priced.discount, priced.total), (Decimal('50.00'), Decimal('540.00')))
+
+    def assertSameQuotes(self, batch, single):
+        # Compared as strings: the same amounts, rounded to paise the same way
+        self.assertEqual({pk: [str(amount) for amount in q] for pk, q in batch.items()},
+                         {pk: [str(amount) for amount in q] for pk, q in single.items()})
+
+    def test_batch_prices_match_single(self):
+        carts = Cart.objects.order_by('id')
+        self.assertSameQuotes(reprice_carts(batch_size=3), {cart.id: price_cart(cart) for cart in carts})
+        self.assertSameQuotes(reprice_carts(coupon=self.percent, batch_size=3),
+                              {cart.id: price_cart(cart, self.percent) for cart in carts})
+        orders = Order.objects.order_by('id')
+        self.assertSameQuotes(reprice_orders(batch_size=3), {order.id: price_order(order) for order in orders})
+
+    def test_reprice_orders_saves(self):
+        quotes = reprice_orders(batch_size=3, save=True)
+        for order in Order.objects.all():
+            self.assertEqual(
+                (order.subtotal, order.shipping_charge, order.tax, order.discount, order.total),
+                tuple(quotes[order.id]),
+            )
+
+
+class PaymentGatewayClientTests(SimpleTestCase):
+    def client_with(self, method, *outcomes, budget=None):
+        """A client whose session answers `method` calls with outcomes in
+        turn: an exception to raise, or a JSON body to return."""
+        client = PaymentGatewayClient('rzp_test_key', 'secret', backoff=0, retry_budget=budget)
+        responses = []
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                responses.append(outcome)
+            else:
+                responses.append(mock.Mock(status_code=200, json=mock.Mock(return_value=outcome)))
+        calls = mock.Mock(side_effect=responses)
+        setattr(client.session, method, calls)
+        self.addCleanup(client.session.close)
+        return client, calls
+
+    def test_get_retried_on_timeout(self):
+        client, calls = self.client_with('get', requests.Timeout(), {'id': 'order_1'})
+        self.assertEqual(client.order.fetch('order_1'), {'id': 'order_1'})
+        self.assertEqual(calls.call_count, 2)
+
+    def test_post_not_retried_on_timeout(self):
+        # The gateway may have created the order before the read timed out
+        client, calls = self.client_with('post', requests.Timeout(), {'id': 'order_1'})
+        with self.assertRaises(requests.Timeout):
+            client.order.create({'amount': 100, 'currency': 'INR'})
+        self.assertEqual(calls.call_count, 1)
+
+    def test_post_retried_on_connection_error(self):
+        client, calls = self.client_with('post', requests.ConnectionError(), {'id': 'order_1'})
+        self.assertEqual(client.order.create({'amount': 100, 'currency': 'INR'}), {'id': 'order_1'})
+        self.assertEqual(calls.call_count, 2)
+
+    def test_retries_stop_when_budget_is_empty(self):
+        budget = RetryBudget(ratio=0, initial=1)
+        client, calls = self.client_with('get', requests.Timeout(), requests.Timeout(), {'id': 'order_1'},
+                                         budget=budget)
+        with self.assertRaises(requests.Timeout):
+            client.order.fetch('order_1')
+        # One retry from the budget, though max_retries allows two
+        self.assertEqual(calls.call_count, 2)
+        self.assertFalse(budget.withdraw())
+
+    def test_budget_refills_with_requests(self):
+        budget = RetryBudget(ratio=0.5, initial=0, cap=1)
+        self.assertFalse(budget.withdraw())
+        for _ in range(4):
+            budget.deposit()
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+    @override_settings(RAZORPAY_KEY_SECRET='')
+    def test_verify_payment_signature(self):
+        signature = payment_signature('order_1', 'pay_1', 'secret')
+        self.assertTrue(verify_payment_signature('order_1', 'pay_1', signature, 'secret'))
+        self.assertFalse(verify_payment_signature('order_1', 'pay_2', signature, 'secret'))
+        self.assertFalse(verify_payment_signature('order_1', 'pay_1', signature, 'other'))
+        self.assertFalse(verify_payment_signature('order_1', 'pay_1', signature.upper(), 'secret'))
+        for blank in ('order_1', 'pay_1', signature, 'secret'):
+            args = [value if value != blank else '' for value in ('order_1', 'pay_1', signature, 'secret')]
+            with self.subTest(blank=blank):
+                self.assertFalse(verify_payment_signature(*args))
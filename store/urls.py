@@ -1,14 +1,18 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Coroutine catalog views when serving over ASGI (see store/async_views.py)
+catalog = async_views if settings.CATALOG_VIEWS_ASYNC else views
 
 urlpatterns = [
     # Home
-    path('', views.home, name='home'),
+    path('', catalog.home, name='home'),
     
     # Products
-    path('products/', views.product_list, name='product_list'),
-    path('product/<slug:slug>/', views.product_detail, name='product_detail'),
-    path('search-suggestions/', views.search_suggestions, name='search_suggestions'),
+    path('products/', catalog.product_list, name='product_list'),
+    path('product/<slug:slug>/', catalog.product_detail, name='product_detail'),
+    path('search-suggestions/', catalog.search_suggestions, name='search_suggestions'),
     
     # Authentication
     path('register/', views.register, name='register'),
@@ -43,6 +47,7 @@ urlpatterns = [
     path('apply-coupon/', views.apply_coupon, name='apply_coupon'),
     path('razorpay/callback/', views.razorpay_payment_callback, name='razorpay_callback'),
     path('verify-payment/', views.verify_payment, name='verify_payment'),
+    path('razorpay/webhook/', views.razorpay_webhook, name='razorpay_webhook'),
     path('orders/', views.order_list, name='order_list'),
     path('order/success/<str:order_number>/', views.order_success, name='order_success'),
     path('order/<int:order_id>/', views.order_detail, name='order_detail'),
@@ -57,4 +62,7 @@ urlpatterns = [
     # Contact & Newsletter
     path('contact/', views.contact, name='contact'),
     path('subscribe/', views.subscribe_newsletter, name='subscribe_newsletter'),
+
+    # Monitoring
+    path('metrics', views.metrics_view, name='metrics'),
 ]
@@ -1,36 +1,70 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.core.mail import send_mail
 from django.conf import settings
 import random
-import razorpay
 import json
-import hmac
-import hashlib
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db.models import Q, Avg, Count
-from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import Q, Avg, Count, Prefetch, prefetch_related_objects
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.core.paginator import Paginator
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from datetime import timedelta
-from decimal import Decimal
 from .models import (
     Category, Brand, Product, ProductImage, ProductSpecification,
-    UserProfile, Address, Cart, CartItem, Wishlist, Coupon,
-    Order, OrderItem, OrderStatusHistory, ReturnRequest,
+    UserProfile, Address, Cart, CartItem, Wishlist,
+    Order, OrderItem, OrderStatusHistory, ArchivedOrder, ArchivedOrderItem, ReturnRequest,
     Review, ReviewImage, Newsletter, ContactMessage
 )
+from .archive import get_order
+from .coupons import coupon_index, redeem_coupon, release_coupon
+from .pricing import price_cart, coupon_discount
+from .payments import get_razorpay_client, verify_payment_signature, verify_webhook_signature
+from .payment_events import record_payment_event
+from .emails import enqueue_otp_email, enqueue_order_confirmation, enqueue_order_status_email
+from .pagination import keyset_page
+from .orders import restock
+from .stock import adjust_stock
+from .replicas import replica_reads
+from . import metrics
+
+ORDERS_PER_PAGE = 10
+PRODUCTS_PER_PAGE = 12
+SUGGESTIONS = 5
+
+
+def product_cards(queryset):
+    """Products with what a product card shows (brand, images) loaded in
+    two queries for the whole list."""
+    return queryset.select_related('brand').prefetch_related('images')
+
+
+def abandon_order(order):
+    """Undo a checkout that will not go ahead: put its stock back and drop
+    the order, which gives back its coupon use (see signals.py)."""
+    with transaction.atomic():
+        restock([order.id])
+        order.delete()
+
+
+def cart_with_items():
+    """Carts with items, products, brands and images prefetched: everything
+    the cart and checkout pages and price_cart() read."""
+    return Cart.objects.prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.select_related('product__brand').prefetch_related('product__images'))
+    )
 
 
 # Home Page
+@replica_reads
 def home(request):
-    featured_products = Product.objects.filter(is_active=True, is_featured=True)[:8]
+    featured_products = product_cards(Product.objects.filter(is_active=True, is_featured=True))[:8]
     categories = Category.objects.filter(is_active=True)[:6]
     brands = Brand.objects.filter(is_active=True)[:8]
-    new_arrivals = Product.objects.filter(is_active=True).order_by('-created_at')[:8]
+    new_arrivals = product_cards(Product.objects.filter(is_active=True).order_by('-created_at'))[:8]
     
     context = {
         'featured_products': featured_products,
@@ -42,17 +76,14 @@ def home(request):
 
 
 # Product Listing
-def product_list(request):
-    products = Product.objects.filter(is_active=True)
-    categories = Category.objects.filter(is_active=True)
-    brands = Brand.objects.filter(is_active=True)
-    
-    # Filtering
-    category_slug = request.GET.get('category')
-    brand_slug = request.GET.get('brand')
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    search_query = request.GET.get('q')
+def filter_products(products, params):
+    """Apply the product list's filters and sort order from query
+    parameters."""
+    category_slug = params.get('category')
+    brand_slug = params.get('brand')
+    min_price = params.get('min_price')
+    max_price = params.get('max_price')
+    search_query = params.get('q')
     
     if category_slug:
         products = products.filter(category__slug=category_slug)
@@ -74,12 +105,20 @@ def product_list(request):
         )
     
     # Sorting
-    sort_by = request.GET.get('sort', '-created_at')
+    sort_by = params.get('sort', '-created_at')
     if sort_by in ['price', '-price', 'name', '-name', '-created_at']:
         products = products.order_by(sort_by)
+    return products
+
+
+@replica_reads
+def product_list(request):
+    products = filter_products(product_cards(Product.objects.filter(is_active=True)), request.GET)
+    categories = Category.objects.filter(is_active=True)
+    brands = Brand.objects.filter(is_active=True)
     
     # Pagination
-    paginator = Paginator(products, 12)
+    paginator = Paginator(products, PRODUCTS_PER_PAGE)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
@@ -87,22 +126,25 @@ def product_list(request):
         'page_obj': page_obj,
         'categories': categories,
         'brands': brands,
-        'current_category': category_slug,
-        'current_brand': brand_slug,
+        'current_category': request.GET.get('category'),
+        'current_brand': request.GET.get('brand'),
     }
     return render(request, 'store/product_list.html', context)
 
 
 # Product Detail
+@replica_reads
 def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug, is_active=True)
-    related_products = Product.objects.filter(
-        category=product.category, 
+    product = get_object_or_404(
+        product_cards(Product.objects.prefetch_related('specifications')), slug=slug, is_active=True
+    )
+    related_products = product_cards(Product.objects.filter(
+        category=product.category_id,
         is_active=True
-    ).exclude(id=product.id)[:4]
+    ).exclude(id=product.id))[:4]
     
-    reviews = product.reviews.filter(is_approved=True).order_by('-created_at')
-    avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
+    reviews = product.reviews.filter(is_approved=True).select_related('user').order_by('-created_at')
+    rating = reviews.aggregate(avg=Avg('rating'), count=Count('id'))
     
     # Check if user has purchased this product
     can_review = False
@@ -111,34 +153,47 @@ def product_detail(request, slug):
             order__user=request.user,
             product=product,
             order__order_status='delivered'
+        ).exists() or ArchivedOrderItem.objects.filter(
+            order__user=request.user,
+            product=product,
+            order__order_status='delivered'
         ).exists()
     
     context = {
         'product': product,
         'related_products': related_products,
         'reviews': reviews,
-        'avg_rating': avg_rating,
+        'avg_rating': rating['avg'] or 0,
+        'review_count': rating['count'],
         'can_review': can_review,
     }
     return render(request, 'store/product_detail.html', context)
 
 
 # Search with AJAX
+def suggestion_products(query):
+    return Product.objects.filter(
+        Q(name__icontains=query) | Q(brand__name__icontains=query),
+        is_active=True
+    ).prefetch_related(
+        Prefetch('images', queryset=ProductImage.objects.filter(is_primary=True), to_attr='primary_images')
+    )[:SUGGESTIONS]
+
+
+def suggestion(product):
+    return {
+        'name': product.name,
+        'url': f'/product/{product.slug}/',
+        'price': str(product.final_price),
+        'image': product.primary_images[0].image.url if product.primary_images else ''
+    }
+
+
+@replica_reads
 def search_suggestions(request):
     query = request.GET.get('q', '')
     if len(query) >= 2:
-        products = Product.objects.filter(
-            Q(name__icontains=query) | Q(brand__name__icontains=query),
-            is_active=True
-        )[:5]
-        
-        suggestions = [{
-            'name': p.name,
-            'url': f'/product/{p.slug}/',
-            'price': str(p.final_price),
-            'image': p.images.filter(is_primary=True).first().image.url if p.images.filter(is_primary=True).exists() else ''
-        } for p in products]
-        
+        suggestions = [suggestion(p) for p in suggestion_products(query)]
         return JsonResponse({'suggestions': suggestions})
     return JsonResponse({'suggestions': []})
 
@@ -217,13 +272,8 @@ def forgot_password(request):
             request.session['forgot_pwd_otp'] = otp
             request.session['forgot_pwd_email'] = email
             
-            # Send Email
-            subject = 'Password Reset OTP - FlugEde'
-            message = f'Hi {user.username},\n\nYour OTP for password reset is: {otp}\n\nValid for 10 minutes.'
-            from_email = settings.DEFAULT_FROM_EMAIL
-            recipient_list = [email]
-            
-            send_mail(subject, message, from_email, recipient_list, fail_silently=False)
+            # Queue Email (delivered by the send_outbox command)
+            enqueue_otp_email(user, otp)
             
             messages.success(request, 'OTP sent to your email address.')
             return redirect('verify_otp')
@@ -363,7 +413,7 @@ def delete_address(request, address_id):
 # Cart Management
 @login_required
 def cart_view(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
+    cart, created = cart_with_items().get_or_create(user=request.user)
     context = {'cart': cart}
     return render(request, 'store/cart.html', context)
 
@@ -417,7 +467,7 @@ def remove_from_cart(request, item_id):
 # Wishlist
 @login_required
 def wishlist_view(request):
-    wishlist_items = Wishlist.objects.filter(user=request.user)
+    wishlist_items = Wishlist.objects.filter(user=request.user).select_related('product').prefetch_related('product__images')
     return render(request, 'store/wishlist.html', {'wishlist_items': wishlist_items})
 
 
@@ -446,9 +496,9 @@ def remove_from_wishlist(request, wishlist_id):
 # Checkout
 @login_required
 def checkout(request):
-    cart = get_object_or_404(Cart, user=request.user)
+    cart = get_object_or_404(cart_with_items(), user=request.user)
     
-    if not cart.items.exists():
+    if not cart.items.all():
         messages.warning(request, 'Your cart is empty!')
         return redirect('cart')
     
@@ -458,59 +508,64 @@ def checkout(request):
         address_id = request.POST.get('address_id')
         payment_method = request.POST.get('payment_method')
         coupon_code = request.POST.get('coupon_code', '')
+        method_label = payment_method if payment_method in dict(Order.PAYMENT_METHOD) else 'other'
         # Validate address selection to avoid 404 when missing/invalid
         if not address_id:
+            metrics.CHECKOUTS.inc(payment_method=method_label, outcome='invalid_address')
             messages.error(request, 'Please select a delivery address before placing your order.')
             return redirect('checkout')
 
         try:
             address = Address.objects.get(id=address_id, user=request.user)
         except Address.DoesNotExist:
+            metrics.CHECKOUTS.inc(payment_method=method_label, outcome='invalid_address')
             messages.error(request, 'Selected address was not found. Please choose a valid address.')
             return redirect('checkout')
         
         # Calculate totals
-        subtotal = cart.subtotal
-        shipping_charge = Decimal('50.00') if subtotal < 500 else Decimal('0.00')
-        tax = subtotal * Decimal('0.18')  # 18% GST
-        discount = Decimal('0.00')
+        quote = price_cart(cart)
         coupon = None
+        redemption = None
         
         # Apply coupon
         if coupon_code:
-            try:
-                coupon = Coupon.objects.get(code=coupon_code)
-                if coupon.is_valid() and subtotal >= coupon.min_purchase_amount:
-                    if coupon.discount_type == 'percentage':
-                        discount = (subtotal * coupon.discount_value) / 100
-                        if coupon.max_discount_amount:
-                            discount = min(discount, coupon.max_discount_amount)
-                    else:
-                        discount = coupon.discount_value
-                    coupon.used_count += 1
-                    coupon.save()
-            except Coupon.DoesNotExist:
+            coupon = coupon_index.get(coupon_code)
+            if coupon is None:
                 messages.warning(request, 'Invalid coupon code!')
+            else:
+                if coupon.is_valid() and quote.subtotal >= coupon.min_purchase_amount:
+                    redemption = redeem_coupon(coupon, request.user)
+                if redemption:
+                    quote = quote.with_coupon(coupon)
+                else:
+                    coupon = None
+                    messages.warning(request, 'Coupon is not valid or its usage limit has been reached!')
         
-        total = subtotal + shipping_charge + tax - discount
+        total = quote.total
         
         # Create order
         order = Order.objects.create(
             user=request.user,
             address=address,
-            subtotal=subtotal,
-            shipping_charge=shipping_charge,
-            tax=tax,
-            discount=discount,
+            subtotal=quote.subtotal,
+            shipping_charge=quote.shipping,
+            tax=quote.tax,
+            discount=quote.discount,
             total=total,
             coupon=coupon,
             payment_method=payment_method,
             expected_delivery_date=timezone.now().date() + timedelta(days=7)
         )
         
+        if redemption:
+            redemption.order = order
+            redemption.save(update_fields=['order'])
+        
         # Create order items
+        stock_taken = {}
+        order_items = []
         for cart_item in cart.items.all():
-            OrderItem.objects.create(
+            order_items.append(OrderItem(
                 order=order,
                 product=cart_item.product,
                 product_name=cart_item.product.name,
@@ -519,11 +574,14 @@ def checkout(request):
                 total_price=cart_item.total_price,
                 warranty_period=cart_item.product.warranty_period,
                 return_deadline=timezone.now().date() + timedelta(days=7)
-            )
+            ))
             
-            # Update stock
-            cart_item.product.stock -= cart_item.quantity
-            cart_item.product.save()
+            stock_taken[cart_item.product_id] = stock_taken.get(cart_item.product_id, 0) - cart_item.quantity
+        OrderItem.objects.bulk_create(order_items)
+        
+        # Update stock relative to the row, so concurrent orders and stock syncs add up
+        adjust_stock(stock_taken)
+        order.refresh_summary()
         
         # Create status history
         OrderStatusHistory.objects.create(
@@ -539,32 +597,45 @@ def checkout(request):
             order.order_status = 'confirmed'
             order.save()
             cart.items.all().delete()
+            enqueue_order_confirmation(order)
+            metrics.CHECKOUTS.inc(payment_method=method_label, outcome='placed')
             messages.success(request, f'Order placed successfully! Order Number: {order.order_number}')
             return redirect('order_success', order_number=order.order_number)
         elif payment_method == 'razorpay':
             # Online payment via Razorpay
             if not settings.RAZORPAY_KEY_ID or not settings.RAZORPAY_KEY_SECRET:
                 messages.warning(request, 'Razorpay payment gateway is not configured. Please select Cash on Delivery or configure Razorpay API keys.')
-                order.delete()
+                abandon_order(order)
+                metrics.CHECKOUTS.inc(payment_method=method_label, outcome='gateway_unconfigured')
                 return redirect('checkout')
             
-            # Initialize Razorpay client
-            client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+            # Shared, connection-pooled Razorpay client
+            client = get_razorpay_client()
             
             # Create Razorpay order
-            razorpay_order = client.order.create({
-                'amount': int(total * 100),  # Amount in paise
-                'currency': 'INR',
-                'receipt': order.order_number,
-                'notes': {
-                    'order_id': str(order.id),
-                    'user_id': str(request.user.id),
-                }
-            })
+            try:
+                razorpay_order = client.order.create({
+                    'amount': int(total * 100),  # Amount in paise
+                    'currency': 'INR',
+                    'receipt': order.order_number,
+                    'notes': {
+                        'order_id': str(order.id),
+                        'user_id': str(request.user.id),
+                    }
+                })
+            except Exception:
+                # No payment can be made against this order
+                abandon_order(order)
+                metrics.CHECKOUTS.inc(payment_method=method_label, outcome='gateway_error')
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Could not reach the payment gateway. Please try again or choose Cash on Delivery.',
+                })
             
             # Save Razorpay order ID
             order.razorpay_order_id = razorpay_order['id']
             order.save()
+            metrics.CHECKOUTS.inc(payment_method=method_label, outcome='awaiting_payment')
             
             # Return JSON response with Razorpay order details
             return JsonResponse({
@@ -578,7 +649,8 @@ def checkout(request):
             })
         else:
             messages.error(request, 'Invalid payment method selected.')
-            order.delete()
+            abandon_order(order)
+            metrics.CHECKOUTS.inc(payment_method=method_label, outcome='invalid_payment_method')
             return redirect('checkout')
     
     context = {
@@ -594,33 +666,28 @@ def checkout(request):
 def apply_coupon(request):
     if request.method == 'POST':
         coupon_code = request.POST.get('coupon_code')
-        cart = get_object_or_404(Cart, user=request.user)
-        
-        try:
-            coupon = Coupon.objects.get(code=coupon_code)
-            if coupon.is_valid() and cart.subtotal >= coupon.min_purchase_amount:
-                if coupon.discount_type == 'percentage':
-                    discount = (cart.subtotal * coupon.discount_value) / 100
-                    if coupon.max_discount_amount:
-                        discount = min(discount, coupon.max_discount_amount)
-                else:
-                    discount = coupon.discount_value
-                
-                return JsonResponse({
-                    'success': True,
-                    'discount': str(discount),
-                    'message': 'Coupon applied successfully!'
-                })
-            else:
-                return JsonResponse({
-                    'success': False,
-                    'message': 'Coupon is not valid or minimum purchase amount not met!'
-                })
-        except Coupon.DoesNotExist:
+        coupon = coupon_index.get(coupon_code)
+        if coupon is None:
             return JsonResponse({
                 'success': False,
                 'message': 'Invalid coupon code!'
             })
+        
+        cart = get_object_or_404(Cart, user=request.user)
+        subtotal = cart.subtotal
+        if coupon.is_valid() and subtotal >= coupon.min_purchase_amount:
+            discount = coupon_discount(coupon, subtotal)
+            
+            return JsonResponse({
+                'success': True,
+                'discount': str(discount),
+                'message': 'Coupon applied successfully!'
+            })
+        else:
+            return JsonResponse({
+                'success': False,
+                'message': 'Coupon is not valid or minimum purchase amount not met!'
+            })
     
     return JsonResponse({'success': False})
 
@@ -628,13 +695,33 @@ def apply_coupon(request):
 # Orders
 @login_required
 def order_list(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'store/order_list.html', {'orders': orders})
+    # Keyset pagination with the items, products and images of the page
+    # prefetched: a fixed number of queries per page however long the order
+    # history is. The card header uses the stored item_count and thumbnail
+    # (Order.refresh_summary). ?archived=1 pages through orders moved to the
+    # archive tables.
+    archived = request.GET.get('archived') == '1'
+    order_model, item_model = (ArchivedOrder, ArchivedOrderItem) if archived else (Order, OrderItem)
+    orders = order_model.objects.filter(user=request.user).prefetch_related(
+        Prefetch('items', queryset=item_model.objects.select_related('product').prefetch_related('product__images'))
+    )
+    orders, next_cursor = keyset_page(orders, request.GET.get('before'), ORDERS_PER_PAGE)
+    context = {
+        'orders': orders,
+        'next_cursor': next_cursor,
+        'archived': archived,
+        'is_first_page': not archived and not request.GET.get('before'),
+        'has_archive': not archived and not next_cursor and request.user.archived_orders.exists(),
+    }
+    return render(request, 'store/order_list.html', context)
 
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_order(id=order_id, user=request.user)
+    prefetch_related_objects([order], 'address', Prefetch(
+        'items', queryset=order.items.model.objects.select_related('product').prefetch_related('product__images')
+    ))
     return render(request, 'store/order_detail.html', {'order': order})
 
 
@@ -647,16 +734,17 @@ def cancel_order(request, order_id):
         order.save()
         
         # Restore stock
-        for item in order.items.all():
-            if item.product:
-                item.product.stock += item.quantity
-                item.product.save()
+        restock([order.id])
+        
+        # Give back the coupon use, if any
+        release_coupon(order)
         
         OrderStatusHistory.objects.create(
             order=order,
             status='cancelled',
             notes='Order cancelled by user'
         )
+        enqueue_order_status_email(order, 'Your order has been cancelled as requested.')
         
         messages.success(request, 'Order cancelled successfully!')
     else:
@@ -694,8 +782,15 @@ def add_review(request, product_id):
         product=product,
         order__order_status='delivered'
     ).first()
+    # Purchases moved to the archive still count; the review is just not
+    # linked to an order item.
+    purchased = order_item is not None or ArchivedOrderItem.objects.filter(
+        order__user=request.user,
+        product=product,
+        order__order_status='delivered'
+    ).exists()
     
-    if not order_item:
+    if not purchased:
         messages.error(request, 'You can only review products you have purchased!')
         return redirect('product_detail', slug=product.slug)
     
@@ -741,7 +836,7 @@ def subscribe_newsletter(request):
 
 @login_required
 def order_success(request, order_number):
-    order = get_object_or_404(Order, order_number=order_number, user=request.user)
+    order = get_order(order_number=order_number, user=request.user)
     return render(request, 'store/order_success.html', {'order': order})
 
 
@@ -762,43 +857,23 @@ def razorpay_payment_callback(request):
             
             # Verify payment signature
             if settings.RAZORPAY_KEY_SECRET:
-                client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-                
-                # Verify signature
-                params_dict = {
-                    'razorpay_order_id': razorpay_order_id,
-                    'razorpay_payment_id': razorpay_payment_id,
-                    'razorpay_signature': razorpay_signature
-                }
-                
-                try:
-                    client.utility.verify_payment_signature(params_dict)
-                    
-                    # Payment verified - update order
-                    order.razorpay_payment_id = razorpay_payment_id
-                    order.razorpay_signature = razorpay_signature
-                    order.payment_status = 'completed'
-                    order.order_status = 'confirmed'
-                    order.save()
-                    
-                    # Clear cart
-                    cart, created = Cart.objects.get_or_create(user=request.user)
-                    cart.items.all().delete()
-                    
-                    # Create status history
-                    OrderStatusHistory.objects.create(
-                        order=order,
-                        status='confirmed',
-                        notes='Payment completed via Razorpay'
+                verified = verify_payment_signature(razorpay_order_id, razorpay_payment_id, razorpay_signature)
+                metrics.PAYMENT_VERIFICATIONS.inc(source='callback', outcome='verified' if verified else 'failed')
+                if verified:
+                    # Payment verified - the order is finalized by the payment event worker
+                    record_payment_event(
+                        razorpay_order_id, razorpay_payment_id, razorpay_signature,
+                        source='callback', payload=request.POST.dict()
                     )
                     
                     messages.success(request, f'Payment successful! Order Number: {order.order_number}')
                     return redirect('order_success', order_number=order.order_number)
-                    
-                except razorpay.errors.SignatureVerificationError:
+                else:
                     # Payment signature verification failed
-                    order.payment_status = 'failed'
-                    order.save()
+                    if order.payment_status == 'pending':
+                        order.payment_status = 'failed'
+                        order.save(update_fields=['payment_status', 'updated_at'])
+                        release_coupon(order)
                     messages.error(request, 'Payment verification failed. Please try again.')
                     return redirect('checkout')
             else:
@@ -814,7 +889,7 @@ def razorpay_payment_callback(request):
 
 @csrf_exempt
 def verify_payment(request):
-    """Verify Razorpay payment sent from frontend (JSON) and finalize order."""
+    """Verify Razorpay payment sent from frontend (JSON) and queue the order for finalization."""
     if request.method != 'POST':
         return JsonResponse({'status': 'fail', 'message': 'Invalid method'}, status=400)
 
@@ -833,39 +908,62 @@ def verify_payment(request):
     if not settings.RAZORPAY_KEY_ID or not settings.RAZORPAY_KEY_SECRET:
         return JsonResponse({'status': 'fail', 'message': 'Razorpay not configured'}, status=500)
 
-    client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+    verified = verify_payment_signature(razorpay_order_id, razorpay_payment_id, razorpay_signature)
+    metrics.PAYMENT_VERIFICATIONS.inc(source='checkout', outcome='verified' if verified else 'failed')
+    if not verified:
+        return JsonResponse({'status': 'fail', 'message': 'Signature verification failed'}, status=400)
 
     try:
-        params_dict = {
-            'razorpay_order_id': razorpay_order_id,
-            'razorpay_payment_id': razorpay_payment_id,
-            'razorpay_signature': razorpay_signature
-        }
-        client.utility.verify_payment_signature(params_dict)
-
-        # find local order and update
-        order = Order.objects.get(razorpay_order_id=razorpay_order_id)
-        order.razorpay_payment_id = razorpay_payment_id
-        order.razorpay_signature = razorpay_signature
-        order.payment_status = 'completed'
-        order.order_status = 'confirmed'
-        order.save()
+        if not Order.objects.filter(razorpay_order_id=razorpay_order_id).exists():
+            return JsonResponse({'status': 'fail', 'message': 'Order not found'}, status=404)
 
-        # clear cart for the user
-        cart, _ = Cart.objects.get_or_create(user=order.user)
-        cart.items.all().delete()
-
-        OrderStatusHistory.objects.create(
-            order=order,
-            status='confirmed',
-            notes='Payment completed via Razorpay'
+        # Acknowledge now; the order is finalized by the payment event worker
+        record_payment_event(
+            razorpay_order_id, razorpay_payment_id, razorpay_signature,
+            source='checkout', payload=payload
         )
-
         return JsonResponse({'status': 'ok'})
 
-    except razorpay.errors.SignatureVerificationError:
-        return JsonResponse({'status': 'fail', 'message': 'Signature verification failed'}, status=400)
-    except Order.DoesNotExist:
-        return JsonResponse({'status': 'fail', 'message': 'Order not found'}, status=404)
     except Exception as e:
         return JsonResponse({'status': 'fail', 'message': str(e)}, status=500)
+
+
+@csrf_exempt
+def razorpay_webhook(request):
+    """Ingest Razorpay webhooks (payment.captured, order.paid, payment.failed, ...)."""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'fail', 'message': 'Invalid method'}, status=400)
+
+    if not settings.RAZORPAY_WEBHOOK_SECRET:
+        return JsonResponse({'status': 'fail', 'message': 'Webhook secret not configured'}, status=500)
+
+    verified = verify_webhook_signature(request.body, request.headers.get('X-Razorpay-Signature'))
+    metrics.PAYMENT_VERIFICATIONS.inc(source='webhook', outcome='verified' if verified else 'failed')
+    if not verified:
+        return JsonResponse({'status': 'fail', 'message': 'Signature verification failed'}, status=400)
+
+    try:
+        payload = json.loads(request.body.decode('utf-8'))
+    except Exception:
+        return JsonResponse({'status': 'fail', 'message': 'Invalid JSON'}, status=400)
+
+    event = payload.get('event', '')
+    payment = ((payload.get('payload') or {}).get('payment') or {}).get('entity') or {}
+    razorpay_payment_id = payment.get('id')
+    razorpay_order_id = payment.get('order_id')
+
+    if not (razorpay_payment_id and razorpay_order_id):
+        return JsonResponse({'status': 'ignored'})
+
+    _, created = record_payment_event(
+        razorpay_order_id, razorpay_payment_id,
+        source='webhook', event=event, payload=payload
+    )
+    return JsonResponse({'status': 'ok' if created else 'duplicate'})
+
+
+# Metrics (Prometheus scrape target, see store/metrics.py)
+def metrics_view(request):
+    if not metrics.scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)